@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Cubemap Benchmark - Times the stitcher's stages on synthetic faces.
+
+Generates six deterministic faces per face size, then times decoding,
+header validation, stitching and encoding the cross, and projecting and
+saving the panorama across filters, worker counts and panorama widths,
+each both on the fly and through a reused projection plan.
+Results are written as JSON (seconds, Mpix/s, peak RSS, speedup over the
+per-pixel reference loop) and can be compared against a stored baseline
+to flag regressions.
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import cubemap_stitcher as cs
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+BENCHMARK_VERSION = 2
+
+# Face sizes the generator supports; the default run uses the small end
+FACE_SIZES = (256, 512, 1024, 2048, 4096)
+DEFAULT_FACE_SIZES = (256, 1024)
+DEFAULT_PANO_WIDTHS = (1024, 2048)
+DEFAULT_WORKERS = (1, 2)
+# Projection cases run on the fly (False) and through a prebuilt, reused plan (True)
+DEFAULT_PLANS = (False, True)
+
+# The reference loop is pure Python, so it is timed on a small panorama only
+REFERENCE_WIDTH = 256
+
+# A case is a regression when its throughput drops (or its peak RSS grows) by more than this
+DEFAULT_THRESHOLD = 0.10
+# Cases faster than this are mostly timer noise, so their throughput is not compared
+MIN_COMPARE_SECONDS = 0.005
+
+# Stages timed once per face size, on the faces' pixels
+FACE_STAGES = ('validate', 'decode', 'stitch', 'encode')
+# Stages timed per panorama configuration, on the panorama's pixels
+PANORAMA_STAGES = ('project', 'save')
+
+
+def synthetic_faces(face_size, channels=3, seed=0):
+    """
+    Generate six deterministic faces with sky-like content.
+
+    Each face is a smooth gradient with a per-face tint, a few soft bands and
+    a little noise, so PNG compresses it roughly like a real sky rather than
+    a flat colour or white noise.
+
+    Args:
+        face_size (int): Width and height of each face
+        channels (int): 3 for RGB (default) or 4 for RGBA with an opaque alpha
+        seed (int): Seed of the noise
+
+    Returns:
+        dict: Face name -> (face_size, face_size, channels) uint8 array
+    """
+    if channels not in (3, 4):
+        raise ValueError(f"Unsupported channel count {channels} (expected 3 or 4)")
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 1, face_size, dtype=np.float32)
+    faces = {}
+    for index, name in enumerate(cs.FACE_NAMES):
+        bands = 0.5 + 0.5 * np.sin(ramp[:, None] * (6 + index) * np.pi + ramp[None, :] * 3 * np.pi)
+        face = np.empty((face_size, face_size, channels), dtype=np.uint8)
+        face[..., 0] = 40 + 120 * ramp[None, :] + 30 * bands
+        face[..., 1] = 80 + 100 * ramp[:, None] + 20 * bands
+        face[..., 2] = 150 + 12 * index + 20 * bands
+        face[..., :3] += rng.integers(0, 8, (face_size, face_size, 1), dtype=np.uint8)
+        if channels == 4:
+            face[..., 3] = 255
+        faces[name] = face
+    return faces
+
+
+def write_synthetic_faces(directory, face_size, image_name="bench", channels=3, seed=0):
+    """
+    Write synthetic faces as <image_name>_<face>.png files.
+
+    Returns:
+        dict: Face name -> path, as expected by load_face_stack
+    """
+    paths = {}
+    for name, face in synthetic_faces(face_size, channels, seed).items():
+        paths[name] = os.path.join(directory, f"{image_name}_{name}.png")
+        Image.fromarray(face).save(paths[name])
+    return paths
+
+
+def _reset_peak_rss():
+    """Reset the process's peak RSS where the OS allows it (Linux); returns whether it did."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB, or None where it can't be read.
+
+    On Linux this is VmHWM, which _reset_peak_rss resets between cases; elsewhere
+    it is ru_maxrss, the peak over the whole run. Worker processes are not included.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kB elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _timed(function, repeat=1):
+    """
+    Run function repeat times with its output silenced.
+
+    Returns:
+        tuple: (best seconds, peak RSS in MB, the last result)
+    """
+    best = None
+    _reset_peak_rss()
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, peak_rss_mb(), result
+
+
+def _result(stage, face_size, seconds, pixels, rss, **config):
+    """One benchmark record; config holds the pano_width/filter/workers of panorama stages."""
+    record = {"stage": stage, "face_size": face_size, **config, "seconds": round(seconds, 6),
+              "mpix_per_s": round(pixels / 1e6 / seconds, 3) if seconds > 0 else None}
+    record["peak_rss_mb"] = None if rss is None else round(rss, 1)
+    return record
+
+
+def reference_mpix_per_s(face_stack):
+    """
+    Throughput of the per-pixel reference projection on a REFERENCE_WIDTH panorama.
+
+    The reference loop samples a horizontal cross, so one is built first (untimed).
+    """
+    face_size = face_stack.shape[1]
+    cross = cs.build_layout(cs.layout_faces(face_stack, "column"), "horizontal_cross")
+    pano_height = REFERENCE_WIDTH // 2
+    seconds, _, _ = _timed(lambda: cs._panorama_reference(cross, face_size, REFERENCE_WIDTH, pano_height, False))
+    return REFERENCE_WIDTH * pano_height / 1e6 / seconds
+
+
+def benchmark_face_size(face_size, pano_widths=DEFAULT_PANO_WIDTHS, filters=cs.FILTERS,
+                        workers=DEFAULT_WORKERS, repeat=3, encoder=None, reference=True, plans=DEFAULT_PLANS):
+    """
+    Benchmark every stage for one face size.
+
+    validate reads and checks the six headers only; decode is the full
+    load_face_stack (headers included); stitch builds the 4x3 cross in memory
+    and encode saves it. project and save come from cubemap_to_panorama's own
+    timings, rendering the decoded stack, so decode is not counted twice.
+    Each case is the best of repeat runs. Every worker count uses the same
+    plan policy: plan=False cases start from an empty plan cache and render
+    on the fly; plan=True cases build the plan in an untimed warm-up run and
+    time the reuse, as in a batch, so neither their times nor their peak RSS
+    include building it. Plans that exceed the default memory budget are
+    skipped, since cubemap_to_panorama would not use them either.
+
+    Args:
+        face_size (int): Size of the synthetic faces
+        pano_widths (tuple): Panorama widths (heights are width/2)
+        filters (tuple): Sampling filters to time
+        workers (tuple): Worker counts to time
+        repeat (int): Runs per case; the fastest is kept
+        encoder: Encoder for the cross and panorama (see cs.resolve_encoder); default PNG
+        reference (bool): Also time the per-pixel reference loop and report speedups
+        plans (tuple): Plan policies to time (False: on the fly, True: reused plan)
+
+    Returns:
+        tuple: (list of result records, reference Mpix/s or None)
+    """
+    results = []
+    face_pixels = 6 * face_size * face_size
+    with tempfile.TemporaryDirectory(prefix="cubemap_bench_") as directory:
+        paths = write_synthetic_faces(directory, face_size)
+
+        seconds, rss, _ = _timed(lambda: cs.load_face_stack(paths, needed=()), repeat)
+        results.append(_result("validate", face_size, seconds, face_pixels, rss))
+        seconds, rss, face_stack = _timed(lambda: cs.load_face_stack(paths), repeat)
+        results.append(_result("decode", face_size, seconds, face_pixels, rss))
+        seconds, rss, cross = _timed(
+            lambda: cs.build_layout(cs.layout_faces(face_stack, "column"), "horizontal_cross"), repeat)
+        results.append(_result("stitch", face_size, seconds, face_pixels, rss))
+        cross_path = os.path.join(directory, "cubemap" + cs.encoder_extension(encoder))
+        seconds, rss, _ = _timed(lambda: cs.save_image(cross, cross_path, encoder), repeat)
+        results.append(_result("encode", face_size, seconds, face_pixels, rss))
+        del cross
+
+        reference_rate = reference_mpix_per_s(face_stack) if reference else None
+
+        pano_path = os.path.join(directory, "pano" + cs.encoder_extension(encoder))
+        for pano_width in pano_widths:
+            pano_pixels = pano_width * (pano_width // 2)
+            for filter in filters:
+                plan_fits = (cs.estimate_plan_nbytes(pano_width, pano_width // 2, filter)
+                             <= cs.DEFAULT_MAX_MEMORY_MB * (1 << 20))
+                for use_plan in plans:
+                    if use_plan and not plan_fits:
+                        print(f"  Skipping {face_size} -> {pano_width} {filter} with a plan: "
+                              f"it exceeds the {cs.DEFAULT_MAX_MEMORY_MB} MB budget")
+                        continue
+                    for worker_count in workers:
+                        stage_times = {"project": [], "save": []}
+                        config = {"pano_width": pano_width, "filter": filter, "workers": worker_count,
+                                  "plan": use_plan}
+
+                        def render(record=True):
+                            timings = {}
+                            cs.cubemap_to_panorama(face_stack, pano_path, pano_width, filter=filter,
+                                                   workers=worker_count, encoder=encoder, use_plan=use_plan,
+                                                   timings=timings)
+                            if record:
+                                for stage in stage_times:
+                                    stage_times[stage].append(timings[stage])
+
+                        # Drop plans left by earlier cases so each one starts from the same state
+                        cs._plan_cache.clear()
+                        if use_plan:
+                            with contextlib.redirect_stdout(io.StringIO()):
+                                render(record=False)
+                        _, rss, _ = _timed(render, repeat)
+                        cs._plan_cache.clear()
+                        for stage in PANORAMA_STAGES:
+                            record = _result(stage, face_size, min(stage_times[stage]), pano_pixels, rss, **config)
+                            if stage == "project" and reference_rate and record["mpix_per_s"]:
+                                record["speedup"] = round(record["mpix_per_s"] / reference_rate, 1)
+                            results.append(record)
+    return results, reference_rate
+
+
+def run_benchmark(face_sizes=DEFAULT_FACE_SIZES, pano_widths=DEFAULT_PANO_WIDTHS, filters=cs.FILTERS,
+                  workers=DEFAULT_WORKERS, repeat=3, encoder=None, reference=True, output_path=None,
+                  plans=DEFAULT_PLANS):
+    """
+    Benchmark every face size and collect the results into one report.
+
+    Args:
+        face_sizes (tuple): Face sizes to generate, from FACE_SIZES
+        output_path (str): Optional path the JSON report is written to
+        (the other arguments are passed to benchmark_face_size)
+
+    Returns:
+        dict: The report: run configuration, machine, reference throughput per
+              face size and the list of result records
+    """
+    for face_size in face_sizes:
+        if face_size not in FACE_SIZES:
+            raise ValueError(f"Unsupported face size {face_size} (expected one of "
+                             f"{', '.join(str(size) for size in FACE_SIZES)})")
+    for filter in filters:
+        if filter not in cs.FILTERS:
+            raise ValueError(f"Unknown filter '{filter}' (expected one of {', '.join(cs.FILTERS)})")
+
+    report = {
+        "version": BENCHMARK_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "numpy": np.__version__, "cpus": os.cpu_count()},
+        "config": {"face_sizes": list(face_sizes), "pano_widths": list(pano_widths), "filters": list(filters),
+                   "workers": list(workers), "plans": list(plans), "repeat": repeat,
+                   "encoder": cs.describe_encoder(cs.resolve_encoder(encoder, "pano.png"))},
+        "reference": {},
+        "results": [],
+    }
+    for face_size in face_sizes:
+        print(f"Benchmarking {face_size}x{face_size} faces...")
+        results, reference_rate = benchmark_face_size(face_size, pano_widths, filters, workers, repeat,
+                                                      encoder, reference, plans)
+        if reference_rate is not None:
+            report["reference"][str(face_size)] = round(reference_rate, 4)
+        for record in results:
+            print("  " + _describe_case(record) + f": {record['seconds']:.3f}s, {record['mpix_per_s']} Mpix/s"
+                  + (f", {record['speedup']}x reference" if "speedup" in record else ""))
+        report["results"].extend(results)
+
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to: {output_path}")
+    return report
+
+
+def _case_key(record):
+    return (record["stage"], record["face_size"], record.get("pano_width"), record.get("filter"),
+            record.get("workers"), record.get("plan"))
+
+
+def _describe_case(record):
+    text = f"{record['stage']} {record['face_size']}"
+    if "pano_width" in record:
+        text += f" -> {record['pano_width']} {record['filter']} x{record['workers']}"
+        text += " plan" if record.get("plan") else " no plan"
+    return text
+
+
+def compare_reports(report, baseline, threshold=DEFAULT_THRESHOLD, min_seconds=MIN_COMPARE_SECONDS):
+    """
+    Compare a report against a baseline report.
+
+    A case regresses when its Mpix/s falls below (1 - threshold) of the
+    baseline's, or its peak RSS exceeds (1 + threshold) of the baseline's.
+    Cases missing from either report are ignored, and so is the throughput of
+    cases that took less than min_seconds in the baseline.
+
+    Args:
+        report (dict): Current results (see run_benchmark)
+        baseline (dict): Stored results, e.g. loaded from a JSON file
+        threshold (float): Allowed relative change (default: 0.10)
+        min_seconds (float): Shortest baseline time whose throughput is compared
+
+    Returns:
+        list: One (case description, metric, baseline value, current value) per regression
+    """
+    baseline_cases = {_case_key(record): record for record in baseline.get("results", [])}
+    regressions = []
+    for record in report["results"]:
+        base = baseline_cases.get(_case_key(record))
+        if base is None:
+            continue
+        if base.get("mpix_per_s") and record.get("mpix_per_s") is not None and base["seconds"] >= min_seconds:
+            if record["mpix_per_s"] < base["mpix_per_s"] * (1 - threshold):
+                regressions.append((_describe_case(record), "mpix_per_s", base["mpix_per_s"], record["mpix_per_s"]))
+        if base.get("peak_rss_mb") and record.get("peak_rss_mb") is not None:
+            if record["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold):
+                regressions.append((_describe_case(record), "peak_rss_mb", base["peak_rss_mb"], record["peak_rss_mb"]))
+    return regressions
+
+
+def _parse_list(text, convert=str):
+    return tuple(convert(value) for value in text.split(",") if value)
+
+
+# Example usage
+if __name__ == "__main__":
+    if "--help" in sys.argv[1:] or "-h" in sys.argv[1:]:
+        print("Usage: python cubemap_benchmark.py [options]")
+        print("\nExample:")
+        print("  python cubemap_benchmark.py --output=baseline.json")
+        print("  python cubemap_benchmark.py --compare=baseline.json")
+        print("\nOptions:")
+        print("  --sizes=<n>,...     Face sizes (default: 256,1024; up to " + str(FACE_SIZES[-1]) + ")")
+        print("  --widths=<n>,...    Panorama widths (default: 1024,2048)")
+        print("  --filters=<name>,...  Sampling filters (default: " + ",".join(cs.FILTERS) + ")")
+        print("  --workers=<n>,...   Worker counts (default: 1,2)")
+        print("  --plans=<p>,...     Plan policies: off (render on the fly), on (reuse a prebuilt")
+        print("                      projection plan) (default: off,on)")
+        print("  --repeat=<n>        Runs per case, the fastest is kept (default: 3)")
+        print("  --encoder=<name>    Encoder for the cross and panorama (default: png)")
+        print("  --no-reference      Skip timing the per-pixel reference loop")
+        print("  --output=<file>     Write the JSON results to <file> (default: stdout)")
+        print("  --compare=<file>    Compare against a baseline JSON file; exits with status 1")
+        print("                      if any case regressed")
+        print("  --threshold=<x>     Relative change counted as a regression (default: 0.10)")
+        sys.exit(0)
+
+    face_sizes = DEFAULT_FACE_SIZES
+    pano_widths = DEFAULT_PANO_WIDTHS
+    filters = cs.FILTERS
+    workers = DEFAULT_WORKERS
+    plans = DEFAULT_PLANS
+    repeat = 3
+    encoder = None
+    reference = True
+    output_path = None
+    baseline_path = None
+    threshold = DEFAULT_THRESHOLD
+
+    try:
+        for arg in sys.argv[1:]:
+            if arg.startswith("--sizes="):
+                face_sizes = _parse_list(arg.split("=", 1)[1], int)
+            elif arg.startswith("--widths="):
+                pano_widths = _parse_list(arg.split("=", 1)[1], int)
+            elif arg.startswith("--filters="):
+                filters = _parse_list(arg.split("=", 1)[1])
+            elif arg.startswith("--workers="):
+                workers = _parse_list(arg.split("=", 1)[1], int)
+            elif arg.startswith("--plans="):
+                policies = {"off": False, "on": True}
+                plans = _parse_list(arg.split("=", 1)[1])
+                for policy in plans:
+                    if policy not in policies:
+                        raise ValueError(f"Unknown plan policy '{policy}' (expected off or on)")
+                plans = tuple(policies[policy] for policy in plans)
+            elif arg.startswith("--repeat="):
+                repeat = max(1, int(arg.split("=", 1)[1]))
+            elif arg.startswith("--encoder="):
+                encoder = cs.parse_encoder_option(arg.split("=", 1)[1])
+            elif arg == "--no-reference":
+                reference = False
+            elif arg.startswith("--output="):
+                output_path = arg.split("=", 1)[1]
+            elif arg.startswith("--compare="):
+                baseline_path = arg.split("=", 1)[1]
+            elif arg.startswith("--threshold="):
+                threshold = float(arg.split("=", 1)[1])
+            else:
+                raise ValueError(f"Unknown option '{arg}'")
+
+        baseline = None
+        if baseline_path is not None:
+            if not os.path.exists(baseline_path):
+                raise FileNotFoundError(f"Baseline not found: {baseline_path}")
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+
+        # Progress goes to stderr when the JSON itself is printed
+        with contextlib.redirect_stdout(sys.stderr if output_path is None else sys.stdout):
+            report = run_benchmark(face_sizes, pano_widths, filters, workers, repeat, encoder, reference,
+                                   output_path, plans)
+        if output_path is None:
+            print(json.dumps(report, indent=2))
+
+        if baseline is not None:
+            if baseline.get("config") != report["config"]:
+                print(f"Warning: {baseline_path} was run with a different configuration; "
+                      f"only matching cases are compared", file=sys.stderr)
+            regressions = compare_reports(report, baseline, threshold)
+            for case, metric, before, after in regressions:
+                print(f"REGRESSION {case}: {metric} {before} -> {after}", file=sys.stderr)
+            print(f"{len(regressions)} regression(s) against {baseline_path} "
+                  f"(threshold {threshold:.0%})", file=sys.stderr)
+            sys.exit(1 if regressions else 0)
+
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -7,13 +7,306 @@ stitches them into a standard cubemap layout. Also includes conversion
 from cubemap to equirectangular panorama.
 """
 
-from PIL import Image
+from PIL import Image, features
 import os
 import numpy as np
 import math
+import hashlib
+import json
+import shutil
+import struct
+import queue
+import tempfile
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 
 
-def stitch_cubemap(base_path, output_path="cubemap.png"):
+# Order of the faces in a face stack / face index array
+FACE_NAMES = ('right', 'left', 'up', 'down', 'front', 'back')
+
+# (column, row) of each face in the 4x3 cross, in units of face_size:
+#     [ ][ U ][ ][ ]
+#     [ L ][ F ][ R ][ B ]
+#     [ ][ D ][ ][ ]
+CROSS_POSITIONS = {
+    'right': (2, 1),
+    'left':  (0, 1),
+    'up':    (1, 0),
+    'down':  (1, 2),
+    'front': (1, 1),
+    'back':  (3, 1),
+}
+
+# (column, row) of each face in the 3x4 vertical cross. The back face hangs below
+# down and is stored rotated 180 degrees, so its bottom edge meets down's:
+#     [ ][ U ][ ]
+#     [ L ][ F ][ R ]
+#     [ ][ D ][ ]
+#     [ ][ B ][ ]
+VERTICAL_CROSS_POSITIONS = {
+    'right': (2, 1),
+    'left':  (0, 1),
+    'up':    (1, 0),
+    'down':  (1, 2),
+    'front': (1, 1),
+    'back':  (1, 3),
+}
+
+# Arrangements of the six faces inside a source array, as (columns, rows, {face: (column, row)})
+# in units of face_size. A (6, S, S, C) face stack is a "column" array viewed as (6 * S, S, C).
+# The strips and the 3x2 grid hold the faces in FACE_NAMES order and, unlike the
+# crosses, have no empty cells.
+SOURCE_LAYOUTS = {
+    'horizontal_cross': (4, 3, CROSS_POSITIONS),
+    'vertical_cross': (3, 4, VERTICAL_CROSS_POSITIONS),
+    'row': (6, 1, {name: (index, 0) for index, name in enumerate(FACE_NAMES)}),
+    'column': (1, 6, {name: (0, index) for index, name in enumerate(FACE_NAMES)}),
+    'grid': (3, 2, {name: (index % 3, index // 3) for index, name in enumerate(FACE_NAMES)}),
+}
+
+# Faces stored rotated 180 degrees in a layout
+ROTATED_FACES = {'vertical_cross': ('back',)}
+
+# Short names of the layouts ("columns x rows"), accepted wherever a layout is
+LAYOUT_ALIASES = {'4x3': 'horizontal_cross', '3x4': 'vertical_cross', '6x1': 'row', '1x6': 'column', '3x2': 'grid'}
+
+# Frame of each face, in FACE_NAMES order, as (normal, u_axis, v_axis) such that
+# direction = normal + u * u_axis + v * v_axis. This is the inverse of select_faces.
+FACE_BASIS = np.array([
+    [[1, 0, 0], [0, 0, -1], [0, -1, 0]],    # right
+    [[-1, 0, 0], [0, 0, 1], [0, -1, 0]],    # left
+    [[0, 1, 0], [1, 0, 0], [0, 0, 1]],      # up
+    [[0, -1, 0], [1, 0, 0], [0, 0, -1]],    # down
+    [[0, 0, 1], [1, 0, 0], [0, -1, 0]],     # front
+    [[0, 0, -1], [-1, 0, 0], [0, -1, 0]],   # back
+], dtype=np.float64)
+
+# Output projections of the projection engine. Equirect spends about a third of
+# its texels oversampling the poles; the others spread them more evenly:
+#   equirect:    longitude x latitude, 2:1 (the panorama)
+#   eac:         equi-angular cubemap, six faces in the 3x2 grid layout, 3:2
+#   octahedral:  the sphere folded onto one square, zenith at the centre
+#   fisheye:     angular fisheye, zenith at the centre; 180 degrees (a dome master)
+#                with hemisphere_only, else the whole sphere
+#   cylindrical: central cylindrical band around the horizon, 2:1
+PROJECTIONS = ('equirect', 'eac', 'octahedral', 'fisheye', 'cylindrical')
+
+# Camera angles rendered by render_views by default, as name -> (yaw, pitch, fov) in degrees.
+# Yaw follows the panorama's longitude (0 looks at the front face, 90 at the right one).
+VIEW_PRESETS = {
+    'front': (0.0, 0.0, 90.0),
+    'right': (90.0, 0.0, 90.0),
+    'back': (180.0, 0.0, 90.0),
+    'left': (270.0, 0.0, 90.0),
+    'zenith': (0.0, 90.0, 90.0),
+    'horizon': (0.0, 15.0, 120.0),
+}
+
+# Sampling filters understood by the projection engine
+FILTERS = ('nearest', 'bilinear', 'bicubic')
+
+# Number of source texels read per output sample for each filter
+FILTER_TAPS = {'nearest': 1, 'bilinear': 4, 'bicubic': 16}
+
+# Default working-memory budget of the strip engine
+DEFAULT_MAX_MEMORY_MB = 512
+
+
+# Incremental rebuilds: each output gets a <output>.manifest.json recording what it was built from
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+
+# Pillow mode of L, LA, RGB and RGBA pixel data, by channel count
+CHANNEL_MODES = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}
+
+# Extensions of face files, in order of preference
+FACE_EXTENSIONS = ('.png', '.hdr', '.npy')
+
+# Output encoders: format -> (file extensions, default settings). The PNG defaults
+# match Pillow's (zlib level 6, adaptive row filters); WebP/JPEG/AVIF options are
+# passed straight to Image.save. DDS is GPU block compression: BC1 for opaque
+# images and BC3 with alpha ("auto" picks), at "fast", "normal" or "high" quality.
+# PNG and HDR keep high-precision data: PNG is written at 16 bits per channel for
+# uint16/float32 pixels (a "bit_depth" option forces 8 or 16) and HDR stores
+# float radiance as Radiance RGBE. The other formats are 8-bit only, except NPY:
+# an uncompressed .npy array at the source precision, for intermediates that
+# downstream tools memory-map instead of decoding.
+ENCODERS = {
+    'png': (('.png',), {'compress_level': 6, 'filter': 'adaptive'}),
+    'webp': (('.webp',), {'lossless': True, 'quality': 80, 'method': 4}),
+    'jpeg': (('.jpg', '.jpeg'), {'quality': 90, 'subsampling': 0}),
+    'avif': (('.avif',), {'quality': 80, 'speed': 6}),
+    'dds': (('.dds',), {'compression': 'auto', 'quality': 'normal'}),
+    'hdr': (('.hdr',), {}),
+    'npy': (('.npy',), {}),
+}
+
+# Encoders with a strip writer, so output can be encoded while it is rendered
+STREAM_FORMATS = ('png', 'dds', 'hdr', 'npy')
+
+# Filters for mip generation, and the Kaiser window's shape parameter
+MIP_FILTERS = ('box', 'kaiser')
+KAISER_BETA = 4.0
+
+# Stages of run_pipeline, in order, and the threads serving each by default.
+# Encoding (zlib) is usually the slowest stage, so it gets a second thread.
+PIPELINE_STAGES = ('decode', 'project', 'encode')
+PIPELINE_WORKERS = {'decode': 1, 'project': 1, 'encode': 2}
+
+# Named encoder settings trading encode time against file size:
+#   fast-iterate: cheapest PNG that still compresses; for local preview loops
+#   ship:         lossy WebP, a fraction of the PNG size, for assets the game downloads
+#   archive:      lossless WebP at full compression effort; a third smaller than PNG.
+#                 (method 6 barely shrinks it further for an order of magnitude more time)
+ENCODER_PRESETS = {
+    'fast-iterate': {'format': 'png', 'compress_level': 1, 'filter': 'sub'},
+    'ship': {'format': 'webp', 'lossless': False, 'quality': 90, 'method': 6},
+    'archive': {'format': 'webp', 'lossless': True, 'quality': 100, 'method': 4},
+}
+
+
+def _cross_manifest_params(settings, layout="horizontal_cross", mode=None, mips=None, mip_filter="box"):
+    """
+    Build parameters recorded in the manifest of a cubemap written in a layout with the given encoder.
+
+    mode is the channel set requested for the faces; None when it follows the
+    inputs, whose hashes the manifest already records. The mip settings are
+    only recorded when mips are written, so existing manifests stay current.
+    """
+    params = {"layout": layout, "mode": mode, "encoder": settings}
+    if mips is not None:
+        params.update(mips=mips, mip_filter=mip_filter)
+    return params
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_record(path, known=None):
+    """
+    Size, mtime and content hash of a file.
+
+    The hash from a previous record is reused when size and mtime still match,
+    so unchanged inputs are never re-read.
+    """
+    stat = os.stat(path)
+    record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if known and known.get("size") == record["size"] and known.get("mtime_ns") == record["mtime_ns"]:
+        record["sha256"] = known["sha256"]
+    else:
+        record["sha256"] = file_digest(path)
+    return record
+
+
+def _load_manifest(output_path):
+    try:
+        with open(output_path + MANIFEST_SUFFIX) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+
+def _manifest_is_current(manifest, output_path, inputs, params):
+    """True if output_path exists untouched and was built from the same inputs and parameters."""
+    if manifest is None or manifest.get("params") != params:
+        return False
+    if {path: record["sha256"] for path, record in manifest.get("inputs", {}).items()} != \
+            {path: record["sha256"] for path, record in inputs.items()}:
+        return False
+    if not os.path.exists(output_path):
+        return False
+    stat = os.stat(output_path)
+    output = manifest.get("output", {})
+    return output.get("size") == stat.st_size and output.get("mtime_ns") == stat.st_mtime_ns
+
+
+def _write_manifest(output_path, inputs, params, source_digest):
+    stat = os.stat(output_path)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "inputs": inputs,
+        "params": params,
+        "source_digest": source_digest,
+        "output": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+    }
+    with open(output_path + MANIFEST_SUFFIX, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def _combined_digest(inputs, params):
+    """Identity of a build: hashes of all inputs plus the parameters used."""
+    digest = hashlib.sha256()
+    for path in sorted(inputs):
+        digest.update(inputs[path]["sha256"].encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def find_face_files(base_path, image_name=None):
+    """
+    Locate the six face files of a cubemap.
+
+    Args:
+        base_path (str): Directory path containing the cubemap images (e.g., "/path/to/images/")
+        image_name (str): Image name prefix of the faces; auto-detected when omitted
+
+    Returns:
+        tuple: (image_name, dict of face name -> file path), in FACE_NAMES order
+    """
+    # Define the face suffixes (PNG or Radiance HDR faces)
+    suffixes = [f"_{name}{extension}" for extension in FACE_EXTENSIONS for name in FACE_NAMES]
+
+    # Auto-detect image_name by scanning directory for files with the expected suffixes
+    if image_name is None:
+        # List all face image files in the directory
+        if os.path.isdir(base_path):
+            image_files = [f for f in os.listdir(base_path) if f.endswith(FACE_EXTENSIONS)]
+        else:
+            # If base_path is not a directory, get the directory part
+            directory = os.path.dirname(base_path) or '.'
+            image_files = [f for f in os.listdir(directory) if f.endswith(FACE_EXTENSIONS)]
+
+        # Try to find a file ending with one of our suffixes (sorted, so repeated runs agree)
+        for filename in sorted(image_files):
+            for suffix in suffixes:
+                if filename.endswith(suffix):
+                    # Extract the image_name by removing the suffix
+                    image_name = filename[:-len(suffix)]
+                    print(f"Auto-detected image name: '{image_name}'")
+                    break
+            if image_name:
+                break
+
+    if image_name is None:
+        raise FileNotFoundError(f"Could not find any files with expected suffixes (_right.png, _left.png, etc.) in {base_path}")
+
+    # All six faces share one extension; PNG wins if both kinds are present
+    for extension in FACE_EXTENSIONS:
+        face_files = {name: f"{base_path}{image_name}_{name}{extension}" for name in FACE_NAMES}
+        if any(os.path.exists(filepath) for filepath in face_files.values()):
+            break
+    else:
+        face_files = {name: f"{base_path}{image_name}_{name}{FACE_EXTENSIONS[0]}" for name in FACE_NAMES}
+    for filepath in face_files.values():
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(f"Missing cubemap face: {filepath}")
+
+    return image_name, face_files
+
+
+def stitch_cubemap(base_path, output_path="cubemap.png", image_name=None, incremental=False, encoder=None,
+                   layout="horizontal_cross", mips=None, mip_filter="box"):
     """
     Stitch 6 PNG files into a cubemap.
     
@@ -21,13 +314,27 @@ def stitch_cubemap(base_path, output_path="cubemap.png"):
         base_path (str): Directory path containing the cubemap images (e.g., "/path/to/images/")
                         The function will auto-detect the image name prefix
         output_path (str): Output filename for the stitched cubemap (default: "cubemap.png")
+        image_name (str): Image name prefix of the faces; auto-detected when omitted
+        incremental (bool): Keep a manifest (<output_path>.manifest.json) of the face hashes
+                            and skip the stitch when output_path is already up to date
+        encoder: Output encoder: a preset ("fast-iterate", "ship", "archive"), a format
+                 ("png", "webp", "jpeg", "avif", "dds", "hdr") or a settings dict; by default
+                 the format follows output_path's extension (see resolve_encoder)
+        layout (str): Arrangement of the faces (a SOURCE_LAYOUTS key or LAYOUT_ALIASES
+                      short name); default the 4x3 horizontal cross. The strips and the
+                      3x2 grid have no transparent padding, so they are half the size
+        mips (str): Also write the cubemap's mip pyramid (see cross_mips): "files" saves
+                    level n as <stem>_mip<n><ext>, "container" embeds the chain in DDS output
+        mip_filter (str): "box" (default) or "kaiser" (see generate_mips)
     
     Returns:
-        PIL.Image: The stitched cubemap image
+        PIL.Image: The stitched cubemap image, or a uint16/float32 array for 16-bit PNG
+                   or .hdr faces
         
     The function looks for 6 files with names like:
         <image_name>_right.png, <image_name>_left.png, <image_name>_up.png,
         <image_name>_down.png, <image_name>_front.png, <image_name>_back.png
+    (or the same names with a .hdr extension)
         
     The standard cubemap layout is:
         [ ][ U ][ ][ ]
@@ -37,147 +344,499 @@ def stitch_cubemap(base_path, output_path="cubemap.png"):
     Where: U=up, D=down, L=left, R=right, F=front, B=back
     """
     
-    # Define the face suffixes
-    faces = {
-        'right': '_right.png',
-        'left': '_left.png',
-        'up': '_up.png',
-        'down': '_down.png',
-        'front': '_front.png',
-        'back': '_back.png'
-    }
-    
-    # Auto-detect image_name by scanning directory for files with the expected suffixes
-    image_name = None
-    
-    # List all PNG files in the directory
-    if os.path.isdir(base_path):
-        png_files = [f for f in os.listdir(base_path) if f.endswith('.png')]
-    else:
-        # If base_path is not a directory, get the directory part
-        directory = os.path.dirname(base_path) or '.'
-        png_files = [f for f in os.listdir(directory) if f.endswith('.png')]
-    
-    # Try to find a file ending with one of our suffixes
-    for filename in png_files:
-        for suffix in faces.values():
-            if filename.endswith(suffix):
-                # Extract the image_name by removing the suffix
-                image_name = filename[:-len(suffix)]
-                print(f"Auto-detected image name: '{image_name}'")
-                break
-        if image_name:
-            break
-    
-    if image_name is None:
-        raise FileNotFoundError(f"Could not find any files with expected suffixes (_right.png, _left.png, etc.) in {base_path}")
-    
-    # Load all face images
-    images = {}
-    face_size = None
-    
-    for face_name, suffix in faces.items():
-        filepath = base_path + image_name + suffix
-        
-        if not os.path.exists(filepath):
-            raise FileNotFoundError(f"Missing cubemap face: {filepath}")
-        
-        img = Image.open(filepath)
-        
-        # Verify all faces are square and same size
-        if img.width != img.height:
-            raise ValueError(f"{filepath} is not square ({img.width}x{img.height})")
-        
-        if face_size is None:
-            face_size = img.width
-        elif img.width != face_size:
-            raise ValueError(f"Face size mismatch: {filepath} is {img.width}x{img.width}, expected {face_size}x{face_size}")
-        
-        images[face_name] = img
+    # Find the six face files (auto-detecting image_name if needed)
+    image_name, face_files = find_face_files(base_path, image_name)
+    settings = resolve_encoder(encoder, output_path)
+    layout = resolve_layout(layout)
     
-    # Create the cubemap layout (4x3 grid)
-    cubemap_width = face_size * 4
-    cubemap_height = face_size * 3
+    # Skip the whole stitch if the faces are unchanged since the last run
+    if incremental:
+        manifest = _load_manifest(output_path)
+        known = manifest.get("inputs", {}) if manifest else {}
+        inputs = {filepath: _file_record(filepath, known.get(filepath)) for filepath in face_files.values()}
+        params = _cross_manifest_params(settings, layout, mips=mips, mip_filter=mip_filter)
+        source_digest = _combined_digest(inputs, params)
+        if _manifest_is_current(manifest, output_path, inputs, params):
+            print(f"Cubemap up to date, skipping stitch: {output_path}")
+            cubemap = _open_output(output_path)
+            if isinstance(cubemap, Image.Image):
+                cubemap.info["source_digest"] = source_digest
+            return cubemap
     
-    # Create a new image with RGBA mode to support transparency
-    cubemap = Image.new('RGBA', (cubemap_width, cubemap_height), (0, 0, 0, 0))
+    # Decode the faces concurrently (headers are validated before any pixel data is read)
+    face_stack = load_face_stack(face_files)
+    face_size = face_stack.shape[1]
+    columns, rows, _ = SOURCE_LAYOUTS[layout]
+    cubemap_width = face_size * columns
+    cubemap_height = face_size * rows
     
-    # Paste faces in the standard cubemap layout:
+    # Place faces in the requested layout, by default the standard cubemap layout:
     #     [ ][ U ][ ][ ]
     #     [ L ][ F ][ R ][ B ]
     #     [ ][ D ][ ][ ]
-    
-    positions = {
-        'up':    (face_size * 1, face_size * 0),  # Row 0, Col 1
-        'left':  (face_size * 0, face_size * 1),  # Row 1, Col 0
-        'front': (face_size * 1, face_size * 1),  # Row 1, Col 1
-        'right': (face_size * 2, face_size * 1),  # Row 1, Col 2
-        'back':  (face_size * 3, face_size * 1),  # Row 1, Col 3
-        'down':  (face_size * 1, face_size * 2),  # Row 2, Col 1
-    }
-    
-    # Paste each face at its position
-    for face_name, (x, y) in positions.items():
-        # Convert to RGBA if needed
-        face_img = images[face_name]
-        if face_img.mode != 'RGBA':
-            face_img = face_img.convert('RGBA')
-        cubemap.paste(face_img, (x, y))
+    # Cells without a face stay transparent
+    cross = build_layout(layout_faces(face_stack, "column"), layout)
+    cubemap = _output_image(cross)
     
     # Save the cubemap
-    cubemap.save(output_path)
-    print(f"Cubemap saved to: {output_path}")
+    if mips is not None:
+        levels = cross_mips(face_stack, layout, mip_filter)
+        save_mips(levels, output_path, settings, mips)
+        print(f"Cubemap saved to: {output_path} [{describe_encoder(settings)}, {len(levels) - 1} mip levels]")
+    else:
+        save_image(cross, output_path, settings)
+        print(f"Cubemap saved to: {output_path} [{describe_encoder(settings)}]")
+    if incremental:
+        _write_manifest(output_path, inputs, params, source_digest)
+        if isinstance(cubemap, Image.Image):
+            cubemap.info["source_digest"] = source_digest
     print(f"Dimensions: {cubemap_width}x{cubemap_height} ({face_size}x{face_size} per face)")
     
     return cubemap
 
 
-def cubemap_to_panorama(cubemap_image, output_path="panorama.png", pano_width=4096, pano_height=None, hemisphere_only=False):
+class PanoramaGrid:
     """
-    Convert a cubemap to an equirectangular panorama.
-    
+    View directions of an equirect panorama, produced a strip of rows at a time.
+
+    The per-column longitude trig is evaluated once, and the cartesian output
+    buffers are allocated once for max_rows rows and reused by every strip, so
+    walking the whole panorama costs O(max_rows x width) memory. Grids that are
+    evaluated one after another (the sub-samples of SSAA) can share one pair of
+    buffers, passed as buffers. A yaw (degrees) turns the sky about the vertical
+    axis by shifting the longitudes, so whole-column yaws sample exactly the
+    same directions as the unrotated columns they land on. A window's pixels are
+    placed on the grid of the full panorama at the same spacing, so a window on
+    pixel boundaries samples exactly the directions of the pixels it crops.
+    """
+
+    def __init__(self, pano_width, pano_height, hemisphere_only=False, offset=(0.0, 0.0), max_rows=None,
+                 window=None, buffers=None, yaw=0.0):
+        self.pano_width = pano_width
+        self.pano_height = pano_height
+        self.hemisphere_only = hemisphere_only
+        self.window = window
+        self.offset_y = offset[1]
+
+        # Longitude: 0 to 2π (left to right), one value per column
+        x = np.arange(pano_width, dtype=np.float64)
+        if offset[0]:
+            x += offset[0]
+        full_width = pano_width
+        if window is not None:
+            # Only the window's columns of a full panorama at the window's spacing
+            full_width = pano_width * 360 / (window[3] - window[2])
+            x += window[2] / 360 * full_width
+        if yaw or window is not None:
+            # Wrap to [0, width) so whole-column shifts reuse the same trig inputs
+            x = (x + yaw / 360 * full_width) % full_width
+        theta = (x / full_width) * 2 * math.pi
+        self.sin_theta = np.sin(theta)[None, :]
+        self.cos_theta = np.cos(theta)[None, :]
+
+        self._buffers = buffers
+        if buffers is None and max_rows is not None:
+            self._buffers = grid_buffers(max_rows, pano_width)
+
+    def directions(self, row_start, row_stop):
+        """
+        Directions for rows [row_start, row_stop).
+
+        Returns:
+            tuple: (cart_x, cart_y, cart_z) float64 arrays of shape (rows, pano_width); with
+                   max_rows set they are views of shared buffers, valid until the next call
+        """
+        # Latitude, one value per row
+        y = np.arange(row_start, row_stop, dtype=np.float64)
+        if self.offset_y:
+            y += self.offset_y
+        if self.window is not None:
+            # The window's rows of a full panorama at the window's spacing
+            lat_min, lat_max = self.window[:2]
+            full_height = self.pano_height * 180 / (lat_max - lat_min)
+            y += (90 - lat_max) / 180 * full_height
+            phi = (math.pi / 2) - (y / full_height) * math.pi
+        elif self.hemisphere_only:
+            phi = (math.pi / 2) * (1 - y / self.pano_height)
+        else:
+            phi = (math.pi / 2) - (y / self.pano_height) * math.pi
+
+        out_x = out_z = None
+        rows = row_stop - row_start
+        if self._buffers is not None and rows <= len(self._buffers[0]):
+            out_x = self._buffers[0][:rows]
+            out_z = self._buffers[1][:rows]
+
+        # Spherical to cartesian; theta only varies along x and phi along y,
+        # so the trig is evaluated on 1D arrays and broadcast
+        cos_phi = np.cos(phi)[:, None]
+        cart_x = np.multiply(cos_phi, self.sin_theta, out=out_x)
+        cart_y = np.broadcast_to(np.sin(phi)[:, None], (rows, self.pano_width))
+        cart_z = np.multiply(cos_phi, self.cos_theta, out=out_z)
+
+        return cart_x, cart_y, cart_z
+
+    def coverage(self, row_start, row_stop):
+        """Mask of the pixels that show the sphere; None as every equirect pixel does."""
+        return None
+
+
+def grid_buffers(max_rows, width):
+    """The pair of float64 (max_rows, width) direction buffers a PanoramaGrid fills strip by strip."""
+    return np.empty((max_rows, width)), np.empty((max_rows, width))
+
+
+class ProjectionGrid:
+    """
+    View directions of the pixels of an EAC, octahedral, fisheye or cylindrical map.
+
+    The counterpart of PanoramaGrid for the other PROJECTIONS, also produced a
+    strip of rows at a time. Directions are not normalised, as select_faces
+    only needs their ratios.
+    """
+
+    def __init__(self, projection, width, height, hemisphere_only=False, offset=(0.0, 0.0), max_rows=None):
+        if projection not in PROJECTIONS or projection == "equirect":
+            raise ValueError(f"Unknown projection '{projection}' for ProjectionGrid")
+        if hemisphere_only and projection in ("eac", "octahedral"):
+            raise ValueError(f"The {projection} projection always covers the whole sphere")
+        self.projection = projection
+        self.width = width
+        self.height = height
+        self.hemisphere_only = hemisphere_only
+        self.offset_y = offset[1]
+
+        if projection == "cylindrical":
+            # Same columns as the equirect panorama; rows at equal scale, so the
+            # band reaches tan(latitude) = pi * height / width above the horizon
+            theta = ((np.arange(width) + offset[0]) / width) * 2 * math.pi
+            self.sin_theta = np.sin(theta)[None, :]
+            self.cos_theta = np.cos(theta)[None, :]
+        else:
+            # Pixel centres in [-1, 1] across the image (or across one EAC face)
+            x = np.arange(width) + 0.5 + offset[0]
+            if projection == "eac":
+                column = np.clip((x * 3 // width).astype(np.intp), 0, 2)
+                self.column = column[None, :]
+                self.a = (x * 3 / width - column) * 2 - 1
+            else:
+                self.a = x * 2 / width - 1
+
+    def _rows(self, row_start, row_stop):
+        return np.arange(row_start, row_stop, dtype=np.float64) + 0.5 + self.offset_y
+
+    def directions(self, row_start, row_stop):
+        """
+        Directions for rows [row_start, row_stop).
+
+        Returns:
+            tuple: (cart_x, cart_y, cart_z) float64 arrays of shape (rows, width)
+        """
+        rows = row_stop - row_start
+        if self.projection == "cylindrical":
+            y = self._rows(row_start, row_stop) - 0.5
+            horizon = self.height if self.hemisphere_only else self.height / 2
+            height = ((horizon - y) * (2 * math.pi / self.width))[:, None]
+            return (np.broadcast_to(self.sin_theta, (rows, self.width)),
+                    np.broadcast_to(height, (rows, self.width)),
+                    np.broadcast_to(self.cos_theta, (rows, self.width)))
+
+        if self.projection == "eac":
+            y = self._rows(row_start, row_stop)
+            row = np.clip((y * 2 // self.height).astype(np.intp), 0, 1)
+            face = row[:, None] * 3 + self.column
+            # Equal angles across the face: u = tan(a * pi / 4)
+            u = np.broadcast_to(np.tan(self.a * (math.pi / 4))[None, :], face.shape)
+            v = np.tan(((y * 2 / self.height - row) * 2 - 1) * (math.pi / 4))[:, None]
+            basis = FACE_BASIS[face]
+            direction = basis[..., 0, :] + u[..., None] * basis[..., 1, :] + v[..., None] * basis[..., 2, :]
+            return direction[..., 0], direction[..., 1], direction[..., 2]
+
+        a = np.broadcast_to(self.a[None, :], (rows, self.width))
+        b = np.broadcast_to((self._rows(row_start, row_stop) * 2 / self.height - 1)[:, None], (rows, self.width))
+        if self.projection == "octahedral":
+            # Upper hemisphere inside the central diamond, the lower one folded into the corners
+            cart_y = 1 - np.abs(a) - np.abs(b)
+            folded = cart_y < 0
+            cart_x = np.where(folded, (1 - np.abs(b)) * np.where(a < 0, -1, 1), a)
+            cart_z = np.where(folded, (1 - np.abs(a)) * np.where(b < 0, -1, 1), b)
+            return cart_x, cart_y, cart_z
+
+        # Fisheye: the angle from the zenith grows linearly with the radius; the
+        # bottom of the image faces front (+z)
+        half_fov = math.pi / 2 if self.hemisphere_only else math.pi
+        radius = np.hypot(a, b)
+        # sin(radius * half_fov) / radius, without dividing by zero at the centre
+        scale = half_fov * np.sinc(radius * (half_fov / math.pi))
+        return a * scale, np.cos(radius * half_fov), b * scale
+
+    def coverage(self, row_start, row_stop):
+        """Mask of the pixels that show the sphere (inside a fisheye's circle), or None for all."""
+        if self.projection != "fisheye":
+            return None
+        b = self._rows(row_start, row_stop) * 2 / self.height - 1
+        return np.hypot(self.a[None, :], b[:, None]) <= 1
+
+
+def orientation_matrix(orientation):
+    """
+    Normalise an orientation to the hashable form used in plan keys.
+
     Args:
-        cubemap_image: Either a PIL Image of the cubemap or a path to the cubemap file
-        output_path (str): Output filename for the panorama (default: "panorama.png")
-        pano_width (int): Width of the output panorama (default: 4096)
-        pano_height (int): Height of the output panorama (default: pano_width/2, or pano_width/4 if hemisphere_only)
-        hemisphere_only (bool): If True, only generate the top hemisphere (upper half of cubemap)
-    
+        orientation: None, (yaw, pitch, roll) in degrees or a 3x3 rotation matrix
+                     (also as the nine row-major entries this returns).
+                     Yaw turns about +y and follows the panorama's longitude (the
+                     source direction at longitude yaw lands on column 0, the
+                     front), pitch tilts the front up and roll turns about the
+                     front axis; they are applied as yaw * pitch * roll
+
     Returns:
-        PIL.Image: The equirectangular panorama image
-        
-    The cubemap should be in the standard layout:
-        [ ][ U ][ ][ ]
-        [ L ][ F ][ R ][ B ]
-        [ ][ D ][ ][ ]
+        tuple: The nine matrix entries, row-major, or None for no rotation. Entries
+               within round-off of 0 or +-1 are snapped, so quarter turns are exact
     """
-    
-    # Load cubemap if it's a path
-    if isinstance(cubemap_image, str):
-        cubemap = Image.open(cubemap_image)
+    if orientation is None:
+        return None
+    matrix = np.asarray(orientation, dtype=np.float64)
+    if matrix.shape == (9,):
+        matrix = matrix.reshape(3, 3)
+    if matrix.shape == (3,):
+        yaw, pitch, roll = (math.radians(angle) for angle in matrix)
+        cy, sy = math.cos(yaw), math.sin(yaw)
+        cp, sp = math.cos(pitch), math.sin(pitch)
+        cr, sr = math.cos(roll), math.sin(roll)
+        matrix = (np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+                  @ np.array([[1, 0, 0], [0, cp, sp], [0, -sp, cp]])
+                  @ np.array([[cr, -sr, 0], [sr, cr, 0], [0, 0, 1]]))
+    elif matrix.shape != (3, 3):
+        raise ValueError(f"Orientation must be (yaw, pitch, roll) or a 3x3 matrix, got shape {matrix.shape}")
+    elif not np.allclose(matrix @ matrix.T, np.eye(3), atol=1e-6):
+        raise ValueError("Orientation matrix is not a rotation")
+    if np.allclose(matrix, np.eye(3), rtol=0, atol=1e-12):
+        return None
+    snapped = np.round(matrix)
+    matrix = np.where(np.abs(matrix - snapped) < 1e-12, snapped, matrix) + 0.0
+    return tuple(float(value) for value in matrix.ravel())
+
+
+def orientation_yaw(orientation):
+    """The yaw in degrees if an orientation_matrix tuple only turns about +y, else None."""
+    if orientation is None:
+        return 0.0
+    matrix = np.array(orientation).reshape(3, 3)
+    if matrix[1, 1] != 1 or matrix[0, 1] or matrix[2, 1] or matrix[1, 0] or matrix[1, 2]:
+        return None
+    return math.degrees(math.atan2(matrix[0, 2], matrix[0, 0]))
+
+
+def rotate_directions(directions, orientation):
+    """Rotate (cart_x, cart_y, cart_z) arrays by an orientation_matrix tuple (None leaves them as they are)."""
+    if orientation is None:
+        return directions
+    matrix = np.array(orientation).reshape(3, 3)
+    cart_x, cart_y, cart_z = directions
+    return tuple(matrix[i, 0] * cart_x + matrix[i, 1] * cart_y + matrix[i, 2] * cart_z for i in range(3))
+
+
+class OrientedGrid:
+    """A PanoramaGrid or ProjectionGrid whose directions are rotated by an orientation_matrix tuple."""
+
+    def __init__(self, grid, orientation):
+        self.grid = grid
+        self.orientation = orientation
+
+    def directions(self, row_start, row_stop):
+        return rotate_directions(self.grid.directions(row_start, row_stop), self.orientation)
+
+    def coverage(self, row_start, row_stop):
+        return self.grid.coverage(row_start, row_stop)
+
+
+def projection_grid(projection, width, height, hemisphere_only=False, offset=(0.0, 0.0), max_rows=None,
+                    orientation=None, window=None, buffers=None):
+    """
+    The PanoramaGrid or ProjectionGrid producing the view directions of a projection.
+
+    With an orientation (see orientation_matrix) the directions are rotated before
+    they reach select_faces, so re-orienting a sky costs no extra resampling pass.
+    A window (see panorama_window) restricts an equirect grid to a lat/lon range.
+    buffers (see grid_buffers) lets several equirect grids share their direction buffers.
+    """
+    orientation = orientation_matrix(orientation)
+    if projection == "equirect":
+        yaw = orientation_yaw(orientation)
+        if yaw is not None:
+            # Turning about the vertical axis is a longitude shift of the equirect grid
+            return PanoramaGrid(width, height, hemisphere_only, offset, max_rows, window, buffers, yaw)
+        grid = PanoramaGrid(width, height, hemisphere_only, offset, max_rows, window, buffers)
+    elif window is not None:
+        raise ValueError("Latitude/longitude windows are only supported for equirect output")
     else:
-        cubemap = cubemap_image
-    
-    # Convert to RGBA if needed
-    if cubemap.mode != 'RGBA':
-        cubemap = cubemap.convert('RGBA')
-    
-    # Calculate face size (cubemap is 4 faces wide)
-    face_size = cubemap.width // 4
-    
-    # Default panorama height
-    if pano_height is None:
-        if hemisphere_only:
-            pano_height = pano_width // 4  # Quarter height for hemisphere
-        else:
-            pano_height = pano_width // 2  # Half height for full sphere
-    
-    # Convert cubemap to numpy array for faster processing
-    cubemap_array = np.array(cubemap)
-    
-    # Create output panorama array
-    panorama = np.zeros((pano_height, pano_width, 4), dtype=np.uint8)
-    
+        grid = ProjectionGrid(projection, width, height, hemisphere_only, offset, max_rows)
+    return grid if orientation is None else OrientedGrid(grid, orientation)
+
+
+def panorama_window(lat_range=None, lon_range=None):
+    """
+    Normalise a latitude/longitude window to the hashable form used in plan keys.
+
+    Args:
+        lat_range (tuple): (min, max) latitude in degrees, within [-90, 90] (default: all)
+        lon_range (tuple): (min, max) longitude in degrees, as the panorama's: 0 is its
+                           left edge, which faces front, and 90 faces right (default: all)
+
+    Returns:
+        tuple: (lat_min, lat_max, lon_min, lon_max), or None for the whole sphere
+    """
+    if lat_range is None and lon_range is None:
+        return None
+    lat_min, lat_max = (float(value) for value in (lat_range if lat_range is not None else (-90, 90)))
+    lon_min, lon_max = (float(value) for value in (lon_range if lon_range is not None else (0, 360)))
+    if not -90 <= lat_min < lat_max <= 90:
+        raise ValueError(f"Invalid latitude range ({lat_min:g}, {lat_max:g}): need -90 <= min < max <= 90")
+    if not lon_min < lon_max <= lon_min + 360:
+        raise ValueError(f"Invalid longitude range ({lon_min:g}, {lon_max:g}): need min < max <= min + 360")
+    return lat_min, lat_max, lon_min, lon_max
+
+
+def window_size(pano_width, pano_height, window):
+    """Size of the part of a pano_width x pano_height panorama that a window covers."""
+    if window is None:
+        return pano_width, pano_height
+    return (max(1, round(pano_width * (window[3] - window[2]) / 360)),
+            max(1, round(pano_height * (window[1] - window[0]) / 180)))
+
+
+def _hemisphere_window(hemisphere_only):
+    """The window a hemisphere_only panorama covers, for window_faces (None for the whole sphere)."""
+    return (0.0, 90.0, 0.0, 360.0) if hemisphere_only else None
+
+
+def _cap_edge_latitudes(lon_min, lon_max):
+    """(min, max) latitude in degrees of the up face's lower edge over a longitude interval."""
+    # The edge is atan(max(|sin|, |cos|)) of the longitude: 45 degrees at multiples of 90,
+    # highest (54.7) half way between, so only the ends and multiples of 45 need checking
+    lons = [lon_min, lon_max] + [45.0 * k for k in range(math.ceil(lon_min / 45), math.floor(lon_max / 45) + 1)]
+    theta = np.radians(lons)
+    edge = np.degrees(np.arctan(np.maximum(np.abs(np.sin(theta)), np.abs(np.cos(theta)))))
+    return float(edge.min()), float(edge.max())
+
+
+def window_faces(window, face_size, pano_width, pano_height, filter="nearest"):
+    """
+    Names of the faces that rendering an equirect window can read.
+
+    Works from the cube's face boundaries in latitude/longitude, after widening
+    the window by one output pixel and the filter's reach into the neighbouring
+    texels, so the faces it leaves out are never sampled.
+
+    Args:
+        window (tuple): As from panorama_window; None (the whole sphere) needs every face
+        face_size (int): Edge length of the faces
+        pano_width, pano_height (int): Size of the rendered window in pixels
+        filter (str): Sampling filter of the render
+
+    Returns:
+        tuple: The needed face names, in FACE_NAMES order
+    """
+    if window is None:
+        return FACE_NAMES
+    lat_min, lat_max, lon_min, lon_max = window
+    # A texel spans at most 2 / face_size radians (at the face centre)
+    reach = {'nearest': 1, 'bilinear': 2, 'bicubic': 3}[filter]
+    margin = max((lat_max - lat_min) / pano_height, (lon_max - lon_min) / pano_width)
+    margin += reach * math.degrees(2.0 / face_size)
+    lat_min -= margin
+    lat_max += margin
+    # Side faces reach 54.7 degrees of latitude, where a degree of longitude is sqrt(3) times shorter
+    lon_min -= margin * math.sqrt(3)
+    lon_max += margin * math.sqrt(3)
+    if lon_max - lon_min >= 360:
+        lon_min, lon_max = 0.0, 360.0
+
+    needed = set()
+    lowest_edge, _ = _cap_edge_latitudes(lon_min, lon_max)
+    if lat_max > lowest_edge:
+        needed.add('up')
+    if lat_min < -lowest_edge:
+        needed.add('down')
+    # Side faces cover 90 degree longitude sectors around their centres
+    for name, centre in (('front', 0), ('right', 90), ('back', 180), ('left', 270)):
+        for turn in range(math.floor((lon_min - centre - 45) / 360), math.ceil((lon_max - centre + 45) / 360) + 1):
+            low = max(lon_min, centre - 45 + 360 * turn)
+            high = min(lon_max, centre + 45 + 360 * turn)
+            if low <= high:
+                _, highest_edge = _cap_edge_latitudes(low, high)
+                if lat_min < highest_edge and lat_max > -highest_edge:
+                    needed.add(name)
+    return tuple(name for name in FACE_NAMES if name in needed)
+
+
+def default_projection_height(projection, width, hemisphere_only=False):
+    """Default output height of a projection: 2:1 (4:1 for a hemisphere), 3:2 for EAC, square otherwise."""
+    if projection in ("equirect", "cylindrical"):
+        return width // 4 if hemisphere_only else width // 2
+    if projection == "eac":
+        return width * 2 // 3
+    return width
+
+
+def panorama_directions(pano_width, pano_height, hemisphere_only=False, rows=None, offset=(0.0, 0.0)):
+    """
+    Compute the unit view direction of every panorama pixel.
+
+    Uses exactly the same spherical mapping as the per-pixel reference loop,
+    so the vectorized and reference paths agree bit for bit.
+
+    Args:
+        rows (tuple): Optional (start, stop) range of output rows to compute
+        offset (tuple): Sub-pixel (x, y) offset of the sample point, used for supersampling
+
+    Returns:
+        tuple: (cart_x, cart_y, cart_z) float64 arrays of shape (rows, pano_width)
+    """
+    row_start, row_stop = rows if rows is not None else (0, pano_height)
+    return PanoramaGrid(pano_width, pano_height, hemisphere_only, offset).directions(row_start, row_stop)
+
+
+def select_faces(cart_x, cart_y, cart_z):
+    """
+    Pick the cube face hit by each direction and the face-local (u, v) coordinates.
+
+    Vectorized version of the dominant-axis branch chain used by the reference
+    loop. Ties are broken the same way (x before y before z).
+
+    Returns:
+        tuple: (face, u, v) where face indexes FACE_NAMES and u, v are in [-1, 1]
+    """
+    abs_x = np.abs(cart_x)
+    abs_y = np.abs(cart_y)
+    abs_z = np.abs(cart_z)
+
+    x_major = (abs_x >= abs_y) & (abs_x >= abs_z)
+    y_major = ~x_major & (abs_y >= abs_z)
+
+    face = np.where(x_major, np.where(cart_x > 0, 0, 1),
+                    np.where(y_major, np.where(cart_y > 0, 2, 3),
+                             np.where(cart_z > 0, 4, 5))).astype(np.int8)
+    major = np.where(x_major, abs_x, np.where(y_major, abs_y, abs_z))
+
+    # right: (-z, -y)  left: (z, -y)  up: (x, z)  down: (x, -z)  front: (x, -y)  back: (-x, -y)
+    u = np.where(x_major, np.where(cart_x > 0, -cart_z, cart_z),
+                 np.where(y_major | (cart_z > 0), cart_x, -cart_x)) / major
+    v = np.where(y_major, np.where(cart_y > 0, cart_z, -cart_z), -cart_y) / major
+
+    return face, u, v
+
+
+def _panorama_reference(cubemap_array, face_size, pano_width, pano_height, hemisphere_only):
+    """
+    Per-pixel reference implementation of the cubemap to equirect projection.
+
+    This is the original nested loop. It is far too slow for production sizes
+    but is kept as the ground truth the vectorized path is checked against.
+    """
+    panorama = np.zeros((pano_height, pano_width, cubemap_array.shape[-1]), dtype=cubemap_array.dtype)
+
     # Face positions in the cubemap layout
     face_positions = {
         'up':    (face_size * 1, face_size * 0),
@@ -187,36 +846,32 @@ def cubemap_to_panorama(cubemap_image, output_path="panorama.png", pano_width=40
         'back':  (face_size * 3, face_size * 1),
         'down':  (face_size * 1, face_size * 2),
     }
-    
-    print(f"Converting cubemap to panorama ({pano_width}x{pano_height})...")
-    if hemisphere_only:
-        print("Hemisphere mode: Only rendering top half (sky)")
-    
+
     # For each pixel in the panorama
     for y in range(pano_height):
         for x in range(pano_width):
             # Convert pixel coordinates to spherical coordinates
             # Longitude: 0 to 2π (left to right)
             theta = (x / pano_width) * 2 * math.pi  # longitude
-            
+
             if hemisphere_only:
                 # Map y from 0 to pano_height to phi from π/2 (top) to 0 (horizon)
                 phi = (math.pi / 2) * (1 - y / pano_height)
             else:
                 # Latitude: π/2 to -π/2 (top to bottom) - inverted to fix upside down issue
                 phi = (math.pi / 2) - (y / pano_height) * math.pi  # latitude (inverted)
-            
+
             # Convert spherical to cartesian coordinates
             # Note: phi is measured from equator, positive up
             cart_x = math.cos(phi) * math.sin(theta)
             cart_y = math.sin(phi)
             cart_z = math.cos(phi) * math.cos(theta)
-            
+
             # Determine which face this pixel maps to
             abs_x = abs(cart_x)
             abs_y = abs(cart_y)
             abs_z = abs(cart_z)
-            
+
             # Find the dominant axis and corresponding face
             if abs_x >= abs_y and abs_x >= abs_z:
                 # Right or Left face
@@ -248,93 +903,3623 @@ def cubemap_to_panorama(cubemap_image, output_path="panorama.png", pano_width=40
                     face = 'back'
                     u = -cart_x / abs_z
                     v = -cart_y / abs_z
-            
+
             # Convert u, v from [-1, 1] to pixel coordinates
             face_x = int((u + 1) * 0.5 * face_size)
             face_y = int((v + 1) * 0.5 * face_size)
-            
+
             # Clamp to face boundaries
             face_x = max(0, min(face_size - 1, face_x))
             face_y = max(0, min(face_size - 1, face_y))
-            
+
             # Get the face offset in the cubemap
             offset_x, offset_y = face_positions[face]
-            
+
             # Sample the pixel from the cubemap
             pixel_x = offset_x + face_x
             pixel_y = offset_y + face_y
-            
+
             panorama[y, x] = cubemap_array[pixel_y, pixel_x]
-        
+
         # Progress indicator
-        if (y + 1) % (pano_height // 10) == 0:
+        if (y + 1) % max(1, pano_height // 10) == 0:
             print(f"Progress: {int((y + 1) / pano_height * 100)}%")
-    
-    # Convert back to PIL Image
-    panorama_image = Image.fromarray(panorama, 'RGBA')
-    panorama_image.save(output_path)
-    print(f"Panorama saved to: {output_path}")
-    
-    return panorama_image
 
+    return panorama
 
-# Example usage
-if __name__ == "__main__":
-    import sys
-    
-    if len(sys.argv) < 2:
-        print("Usage: python cubemap_stitcher.py <base_path> [pano_width] [--hemisphere]")
-        print("\nExample:")
-        print("  python cubemap_stitcher.py /path/to/images/ 4096")
-        print("  python cubemap_stitcher.py /path/to/images/ 4096 --hemisphere")
-        print("\nThis will:")
-        print("  1. Auto-detect image name from files ending with _right.png, _left.png, etc.")
-        print("  2. Stitch cubemap from the 6 detected faces")
-        print("  3. Save cubemap to: <base_path>cubemap.png")
-        print("  4. Convert to panorama: <base_path>pano.png")
-        print("\nOptions:")
-        print("  --hemisphere    Only render the top hemisphere (sky only)")
-        sys.exit(1)
-    
-    try:
-        # Get base path and optional panorama width
-        base_path = sys.argv[1]
-        pano_width = 4096
-        hemisphere_only = False
-        
-        # Parse additional arguments
-        for arg in sys.argv[2:]:
-            if arg == "--hemisphere":
-                hemisphere_only = True
-            elif arg.isdigit():
-                pano_width = int(arg)
-        
-        # Define output paths
-        cubemap_output = base_path + "cubemap.png"
+
+def _cubic_weights(t):
+    """Catmull-Rom weights for the taps at offsets -1, 0, 1, 2 given the fraction t."""
+    t2 = t * t
+    t3 = t2 * t
+    return np.stack([
+        0.5 * (-t3 + 2 * t2 - t),
+        0.5 * (3 * t3 - 5 * t2 + 2),
+        0.5 * (-3 * t3 + 4 * t2 + t),
+        0.5 * (t3 - t2),
+    ])
+
+
+def _texel_source_index(face, tx, ty, face_size, layout="horizontal_cross"):
+    """
+    Flat index of texel (tx, ty) of the given face in a source array with the given layout.
+
+    Texels that fall off the face (filter taps past an edge) are not clamped;
+    their centre is pushed through the face frame to a 3D direction and looked
+    up again, which lands on the matching texel of the neighbouring face.
+    """
+    face = face.copy()
+    outside = (tx < 0) | (tx >= face_size) | (ty < 0) | (ty >= face_size)
+    if outside.any():
+        f = face[outside]
+        u = (tx[outside] + 0.5) * (2.0 / face_size) - 1
+        v = (ty[outside] + 0.5) * (2.0 / face_size) - 1
+        basis = FACE_BASIS[f]
+        direction = basis[:, 0] + u[:, None] * basis[:, 1] + v[:, None] * basis[:, 2]
+        f, u, v = select_faces(direction[:, 0], direction[:, 1], direction[:, 2])
+        face[outside] = f
+        tx = tx.copy()
+        ty = ty.copy()
+        tx[outside] = np.floor((u + 1) * 0.5 * face_size)
+        ty[outside] = np.floor((v + 1) * 0.5 * face_size)
+        np.clip(tx, 0, face_size - 1, out=tx)
+        np.clip(ty, 0, face_size - 1, out=ty)
+
+    columns, rows, positions = SOURCE_LAYOUTS[layout]
+    if layout in ROTATED_FACES:
+        rotated = np.isin(face, [FACE_NAMES.index(name) for name in ROTATED_FACES[layout]])
+        tx = np.where(rotated, face_size - 1 - tx, tx)
+        ty = np.where(rotated, face_size - 1 - ty, ty)
+    offsets = np.array([positions[name] for name in FACE_NAMES], dtype=np.intp) * face_size
+    pixel_x = offsets[face, 0] + tx
+    pixel_y = offsets[face, 1] + ty
+
+    # 32-bit indices halve the plan size and are enough for faces up to ~13k
+    index_dtype = np.int32 if columns * rows * face_size * face_size < 2 ** 31 else np.int64
+    return (pixel_y * (columns * face_size) + pixel_x).astype(index_dtype)
+
+
+def sample_taps(face, u, v, face_size, filter="nearest", layout="horizontal_cross"):
+    """
+    Source texels and separable weights for sampling the cube at (face, u, v).
+
+    Args:
+        face, u, v: Output of select_faces (any shape; flattened here)
+        face_size (int): Edge length of a cube face in pixels
+        filter (str): "nearest", "bilinear" or "bicubic" (Catmull-Rom)
+        layout (str): Source layout the indices refer to (a SOURCE_LAYOUTS key)
+
+    Returns:
+        tuple: (indices, weights_x, weights_y) where indices has shape (ny * nx, N)
+               (flat source indices, row-major over the tap grid), weights_x is
+               (nx, N) and weights_y is (ny, N); both weights are None for nearest
+    """
+    if filter not in FILTERS:
+        raise ValueError(f"Unknown filter '{filter}' (expected one of {', '.join(FILTERS)})")
+
+    face = face.ravel()
+    u = u.ravel()
+    v = v.ravel()
+
+    if filter == "nearest":
+        # Truncation, like int() in the reference loop
+        face_x = np.clip(((u + 1) * 0.5 * face_size).astype(np.intp), 0, face_size - 1)
+        face_y = np.clip(((v + 1) * 0.5 * face_size).astype(np.intp), 0, face_size - 1)
+        return _texel_source_index(face, face_x, face_y, face_size, layout)[None], None, None
+
+    # Continuous texel coordinates with texel centres at integer + 0.5
+    px = (u + 1) * 0.5 * face_size - 0.5
+    py = (v + 1) * 0.5 * face_size - 0.5
+    x0 = np.floor(px)
+    y0 = np.floor(py)
+    fx = (px - x0).astype(np.float32)
+    fy = (py - y0).astype(np.float32)
+    x0 = x0.astype(np.intp)
+    y0 = y0.astype(np.intp)
+
+    if filter == "bilinear":
+        offsets = (0, 1)
+        weights_x = np.stack([1 - fx, fx])
+        weights_y = np.stack([1 - fy, fy])
+    else:
+        offsets = (-1, 0, 1, 2)
+        weights_x = _cubic_weights(fx)
+        weights_y = _cubic_weights(fy)
+
+    indices = np.stack([_texel_source_index(face, x0 + dx, y0 + dy, face_size, layout)
+                        for dy in offsets for dx in offsets])
+    return indices, weights_x, weights_y
+
+
+def gather_taps(source, indices, weights_x, weights_y, out):
+    """
+    Apply tap indices/weights from sample_taps to a flat (pixels, C) source.
+
+    Writes into out, a (N, C) array. Filtered results are accumulated in
+    float32 and, for integer outputs, rounded/clipped back to the valid range.
+    """
+    if weights_x is None:
+        if out.dtype == source.dtype:
+            np.take(source, indices[0], axis=0, out=out)
+        else:
+            out[...] = np.take(source, indices[0], axis=0)
+        return out
+
+    nx = weights_x.shape[0]
+    acc = np.zeros(out.shape, dtype=np.float32)
+    for tap in range(indices.shape[0]):
+        weight = weights_y[tap // nx] * weights_x[tap % nx]
+        acc += np.take(source, indices[tap], axis=0) * weight[:, None]
+
+    return _store_samples(acc, out)
+
+
+def _store_samples(acc, out):
+    """Write float samples into out, rounding and clipping for integer dtypes."""
+    if np.issubdtype(out.dtype, np.integer):
+        info = np.iinfo(out.dtype)
+        np.rint(acc, out=acc)
+        np.clip(acc, info.min, info.max, out=acc)
+    out[...] = acc
+    return out
+
+
+class ProjectionPlan:
+    """
+    Precomputed cubemap -> panorama lookup table.
+
+    A plan depends only on (face_size, pano_width, pano_height, hemisphere_only,
+    filter, layout, projection, orientation, window), never on pixel content, so one plan can convert any number of
+    same-size cubemaps; applying it is a single gather per image (one per
+    filter tap for bilinear/bicubic).
+    """
+
+    # Bump when the index layout changes so stale plan files are rebuilt
+    VERSION = 8
+
+    def __init__(self, face_size, pano_width, pano_height, hemisphere_only, filter, layout, projection, orientation,
+                 window, indices, weights_x=None, weights_y=None):
+        self.face_size = face_size
+        self.pano_width = pano_width
+        self.pano_height = pano_height
+        self.hemisphere_only = hemisphere_only
+        self.filter = filter
+        self.layout = layout
+        self.projection = projection
+        self.orientation = orientation
+        self.window = window
+        self.indices = indices
+        self.weights_x = weights_x
+        self.weights_y = weights_y
+        self._shared_paths = None
+
+    @property
+    def key(self):
+        return (self.face_size, self.pano_width, self.pano_height, self.hemisphere_only, self.filter, self.layout,
+                self.projection, self.orientation, self.window)
+
+    @classmethod
+    def build(cls, face_size, pano_width, pano_height, hemisphere_only=False, filter="nearest",
+              layout="horizontal_cross", projection="equirect", orientation=None, window=None, max_memory_mb=None):
+        """Compute the plan strip by strip, so only the tables themselves are full size."""
+        if filter not in FILTERS:
+            raise ValueError(f"Unknown filter '{filter}' (expected one of {', '.join(FILTERS)})")
+        if max_memory_mb is None:
+            max_memory_mb = DEFAULT_MAX_MEMORY_MB
+        # The tables being filled count against the budget too
+        max_memory_mb = max(0, max_memory_mb - estimate_plan_nbytes(pano_width, pano_height, filter) / (1 << 20))
+        strip_rows = strip_rows_for_budget(pano_width, 4, filter, 1, max_memory_mb)
+        grid = projection_grid(projection, pano_width, pano_height, hemisphere_only, max_rows=strip_rows,
+                               orientation=orientation, window=window)
+
+        indices = weights_x = weights_y = None
+        for row_start in range(0, pano_height, strip_rows):
+            row_stop = min(pano_height, row_start + strip_rows)
+            face, u, v = select_faces(*grid.directions(row_start, row_stop))
+            taps = sample_taps(face, u, v, face_size, filter, layout)
+            if indices is None:
+                # Allocate the full tables once the tap count and dtypes are known
+                size = pano_width * pano_height
+                indices = np.empty((taps[0].shape[0], size), dtype=taps[0].dtype)
+                if taps[1] is not None:
+                    weights_x = np.empty((taps[1].shape[0], size), dtype=np.float32)
+                    weights_y = np.empty((taps[2].shape[0], size), dtype=np.float32)
+            span = slice(row_start * pano_width, row_stop * pano_width)
+            indices[:, span] = taps[0]
+            if weights_x is not None:
+                weights_x[:, span] = taps[1]
+                weights_y[:, span] = taps[2]
+
+        return cls(face_size, pano_width, pano_height, hemisphere_only, filter, layout, projection, orientation,
+                   window, indices, weights_x, weights_y)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.indices, self.weights_x, self.weights_y) if a is not None)
+
+    def shared_paths(self):
+        """
+        Paths of .npy files holding the tables, for worker processes to memory-map.
+
+        On first use the tables are written once (to /dev/shm when available) and
+        the plan's own tables are replaced by maps of those files, so there is still
+        a single copy in memory and every later parallel render with this plan
+        attaches to the same files. The files go away with the plan. Tables that
+        already are whole memory-mapped .npy files are shared in place.
+
+        Returns:
+            list: Paths of the indices, weights_x and weights_y tables (None where absent)
+        """
+        if self._shared_paths is None:
+            shared_dir = None
+            paths = []
+            for name in ("indices", "weights_x", "weights_y"):
+                table = getattr(self, name)
+                path = None if table is None else _npy_backing_file(table)
+                if table is not None and path is None:
+                    if shared_dir is None:
+                        shared_dir = tempfile.mkdtemp(prefix="cubemap_plan_",
+                                                      dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+                        weakref.finalize(self, _remove_shared_dir, shared_dir, os.getpid())
+                    path = os.path.join(shared_dir, f"{name}.npy")
+                    np.save(path, table)
+                    setattr(self, name, np.load(path, mmap_mode='r'))
+                paths.append(path)
+            self._shared_paths = paths
+        return self._shared_paths
+
+    def apply(self, cubemap_array, out=None):
+        """
+        Project a cubemap array in the plan's layout to a (pano_height, pano_width, C) panorama.
+        """
+        if out is None:
+            out = np.empty((self.pano_height, self.pano_width, cubemap_array.shape[2]), dtype=cubemap_array.dtype)
+        for row_start, strip in render_panorama_strips(cubemap_array, self.face_size, self.pano_width,
+                                                       self.pano_height, plan=self, layout=self.layout):
+            out[row_start:row_start + len(strip)] = strip
+        return out
+
+    def filename(self):
+        """Default file name for this plan inside a plan cache directory."""
+        hemi = "hemi" if self.hemisphere_only else "full"
+        rotation = ""
+        if self.orientation is not None:
+            rotation = "_rot" + hashlib.sha256(np.array(self.orientation).tobytes()).hexdigest()[:12]
+        if self.window is not None:
+            rotation += "_win" + "_".join(f"{value:g}" for value in self.window)
+        return (f"plan_v{self.VERSION}_{self.projection}_{self.layout}_{self.face_size}_{self.pano_width}x{self.pano_height}_"
+                f"{hemi}_{self.filter}{rotation}.npz")
+
+    def save(self, path):
+        arrays = {"indices": self.indices}
+        if self.weights_x is not None:
+            arrays["weights_x"] = self.weights_x
+            arrays["weights_y"] = self.weights_y
+        np.savez(path, version=self.VERSION,
+                 key=np.array([self.face_size, self.pano_width, self.pano_height, int(self.hemisphere_only)]),
+                 filter=self.filter, layout=self.layout, projection=self.projection,
+                 orientation=np.array(self.orientation if self.orientation is not None else ()),
+                 window=np.array(self.window if self.window is not None else ()), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["version"]) != cls.VERSION:
+                raise ValueError(f"{path} is a version {int(data['version'])} plan, expected {cls.VERSION}")
+            face_size, pano_width, pano_height, hemisphere_only = (int(k) for k in data["key"])
+            weights_x = data["weights_x"] if "weights_x" in data else None
+            weights_y = data["weights_y"] if "weights_y" in data else None
+            orientation = tuple(float(value) for value in data["orientation"]) or None
+            window = tuple(float(value) for value in data["window"]) or None
+            return cls(face_size, pano_width, pano_height, bool(hemisphere_only), str(data["filter"]),
+                       str(data["layout"]), str(data["projection"]), orientation, window, data["indices"],
+                       weights_x, weights_y)
+
+
+def _remove_shared_dir(path, owner_pid):
+    """Delete a plan's shared table files, only from the process that created them (not forked children)."""
+    if os.getpid() == owner_pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# In-process LRU of recently used plans; a 4096x2048 nearest plan is 32 MB.
+# Plans are also evicted once together they exceed the memory budget they were fetched with
+PLAN_CACHE_SIZE = 4
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def estimate_plan_nbytes(pano_width, pano_height, filter="nearest"):
+    """Approximate size of a ProjectionPlan: int32 tap indices plus float32 separable weights."""
+    taps = FILTER_TAPS[filter]
+    weights = 0 if taps == 1 else 2 * math.isqrt(taps)
+    return (taps + weights) * 4 * pano_width * pano_height
+
+
+def get_projection_plan(face_size, pano_width, pano_height, hemisphere_only=False, filter="nearest", cache_dir=None,
+                        max_memory_mb=None, layout="horizontal_cross", projection="equirect", orientation=None,
+                        window=None):
+    """
+    Fetch a projection plan from the in-process LRU, the on-disk cache or by building it.
+
+    Args:
+        cache_dir (str): Optional directory where plans are stored as .npz files
+                         so that later runs skip the projection math entirely
+        max_memory_mb (float): Working-memory budget while building the plan; older
+                               plans are dropped from the LRU to keep the cached
+                               plans within it
+
+    Returns:
+        ProjectionPlan: The plan for the given configuration
+    """
+    key = (face_size, pano_width, pano_height, hemisphere_only, filter, layout, projection,
+           orientation_matrix(orientation), window)
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+            return plan
+
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, ProjectionPlan(*key, None).filename())
+        if os.path.exists(path):
+            try:
+                plan = ProjectionPlan.load(path)
+                print(f"Loaded projection plan: {path}")
+            except (ValueError, KeyError, OSError) as e:
+                print(f"Ignoring unusable projection plan {path}: {e}")
+
+    if plan is None or plan.key != key:
+        plan = ProjectionPlan.build(*key, max_memory_mb=max_memory_mb)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            plan.save(path)
+            print(f"Saved projection plan: {path}")
+
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        budget = None if max_memory_mb is None else max_memory_mb * (1 << 20)
+        while len(_plan_cache) > PLAN_CACHE_SIZE or (
+                budget is not None and len(_plan_cache) > 1
+                and sum(cached.nbytes for cached in _plan_cache.values()) > budget):
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+def ssaa_offsets(ssaa, jitter=False, seed=0):
+    """
+    Sub-pixel sample offsets for ssaa x ssaa supersampling.
+
+    Samples are stratified on a regular grid spanning the pixel footprint
+    [-0.5, 0.5). With jitter, each sample moves to a random point inside its
+    cell; the pattern comes from a fixed seed so output is reproducible.
+
+    Returns:
+        list: (offset_x, offset_y) tuples, ssaa * ssaa of them
+    """
+    cells = [(i, j) for j in range(ssaa) for i in range(ssaa)]
+    if jitter:
+        rng = np.random.default_rng(seed)
+        shifts = rng.random((len(cells), 2))
+    else:
+        shifts = np.full((len(cells), 2), 0.5)
+    return [((i + sx) / ssaa - 0.5, (j + sy) / ssaa - 0.5) for (i, j), (sx, sy) in zip(cells, shifts)]
+
+
+def strip_rows_for_budget(pano_width, channels, filter="nearest", ssaa=1, max_memory_mb=DEFAULT_MAX_MEMORY_MB,
+                          itemsize=1):
+    """
+    Number of output rows per strip that keeps the engine's working set within max_memory_mb.
+
+    The per-pixel cost covers the float64 direction grids and face selection
+    temporaries (~200 bytes), the tap indices/weights and texel coordinates,
+    and the output/accumulator buffers, whose size depends on the pixel
+    dtype's itemsize (1 for uint8, 2 for uint16, 4 for float32).
+    """
+    taps = FILTER_TAPS[filter]
+    per_pixel = 200 + taps * 32 + channels * (4 * itemsize if taps == 1 and ssaa == 1 else 12 + 4 * itemsize)
+    return max(1, int(max_memory_mb * (1 << 20)) // (per_pixel * pano_width))
+
+
+def flatten_source(cubemap_array, face_size, layout="horizontal_cross"):
+    """
+    View a cubemap array as the flat (pixels, C) table that tap indices refer to.
+
+    This is a reshape, so no pixel data is copied for contiguous input.
+    """
+    columns, rows, positions = SOURCE_LAYOUTS[layout]
+    if cubemap_array.ndim == 4:
+        # A (6, S, S, C) face stack is the column layout, six faces tall
+        cubemap_array = cubemap_array.reshape((-1,) + cubemap_array.shape[2:])
+    if cubemap_array.shape[:2] != (rows * face_size, columns * face_size):
+        raise ValueError(f"Cubemap array of shape {cubemap_array.shape} does not match a {layout} layout "
+                         f"with {face_size}x{face_size} faces")
+    return np.ascontiguousarray(cubemap_array).reshape(-1, cubemap_array.shape[2])
+
+
+def render_panorama_strips(cubemap_array, face_size, pano_width, pano_height, hemisphere_only=False,
+                           filter="nearest", ssaa=1, ssaa_jitter=False, plan=None, strip_rows=None,
+                           max_memory_mb=None, rows=None, layout="horizontal_cross", projection="equirect",
+                           orientation=None, window=None):
+    """
+    Render an equirect panorama (or another of PROJECTIONS) from a cubemap array, one strip of rows at a time.
+
+    Peak memory is O(strip_rows x pano_width) on top of the source (and the plan,
+    if one is given): direction grids, tap tables and the strip buffer are all
+    sized to one strip and reused. A plan's tables count against max_memory_mb,
+    so the strips get what is left of the budget.
+
+    Args:
+        cubemap_array (np.ndarray): Source faces arranged as described by layout: the
+                                    (3 * face_size, 4 * face_size, C) cross by default, or
+                                    a (6, face_size, face_size, C) stack for "column"
+        plan (ProjectionPlan): Optional precomputed plan; when given, the strips are plain
+                               gathers and hemisphere_only/filter/projection come from the plan
+        strip_rows (int): Rows per strip; chosen from max_memory_mb when omitted
+        max_memory_mb (float): Working-memory budget used to size strips (default: 512)
+        rows (tuple): Optional (start, stop) band of output rows to render (default: all)
+        layout (str): Arrangement of the faces in cubemap_array (a SOURCE_LAYOUTS key)
+        projection (str): Output projection (one of PROJECTIONS); pixels outside a
+                          fisheye's circle are zero (transparent with alpha)
+        orientation: Rotation of the sky, as accepted by orientation_matrix
+        window (tuple): Latitude/longitude window of an equirect render (see panorama_window);
+                        pano_width x pano_height then covers just the window
+
+    Yields:
+        tuple: (row_start, strip) where strip is a (rows, pano_width, C) array. The
+               strip buffer is reused, so copy it before advancing the generator.
+    """
+    source = flatten_source(cubemap_array, face_size, layout)
+    channels = source.shape[1]
+
+    if plan is not None:
+        filter = plan.filter
+        layout = plan.layout
+        projection = plan.projection
+        hemisphere_only = plan.hemisphere_only
+        orientation = plan.orientation
+        window = plan.window
+        ssaa = 1
+    if strip_rows is None:
+        budget = DEFAULT_MAX_MEMORY_MB if max_memory_mb is None else max_memory_mb
+        if plan is not None:
+            budget = max(0, budget - plan.nbytes / (1 << 20))
+        strip_rows = strip_rows_for_budget(pano_width, channels, filter, ssaa, budget, source.itemsize)
+    band_start, band_stop = rows if rows is not None else (0, pano_height)
+    strip_rows = max(1, min(strip_rows, band_stop - band_start))
+
+    # With a plan the grid is only asked for coverage, so it needs no direction buffers.
+    # The SSAA sub-sample grids are evaluated one after another, so they share one pair
+    orientation = orientation_matrix(orientation)
+    buffers = grid_buffers(strip_rows, pano_width) if plan is None else None
+    grids = [projection_grid(projection, pano_width, pano_height, hemisphere_only, offset,
+                             strip_rows if plan is None else None, orientation, window, buffers)
+             for offset in ssaa_offsets(ssaa, ssaa_jitter)]
+
+    strip_buffer = np.empty((strip_rows, pano_width, channels), dtype=cubemap_array.dtype)
+    if len(grids) > 1:
+        acc_buffer = np.empty((strip_rows * pano_width, channels), dtype=np.float32)
+        sample_buffer = np.empty_like(acc_buffer)
+
+    for row_start in range(band_start, band_stop, strip_rows):
+        row_stop = min(band_stop, row_start + strip_rows)
+        pixels = (row_stop - row_start) * pano_width
+        out = strip_buffer[:row_stop - row_start].reshape(-1, channels)
+
+        if plan is not None:
+            span = slice(row_start * pano_width, row_stop * pano_width)
+            weights_x = plan.weights_x[:, span] if plan.weights_x is not None else None
+            weights_y = plan.weights_y[:, span] if plan.weights_y is not None else None
+            gather_taps(source, plan.indices[:, span], weights_x, weights_y, out)
+        elif len(grids) == 1:
+            face, u, v = select_faces(*grids[0].directions(row_start, row_stop))
+            gather_taps(source, *sample_taps(face, u, v, face_size, filter, layout), out)
+        if len(grids) == 1:
+            covered = grids[0].coverage(row_start, row_stop)
+            if covered is not None:
+                out[~covered.ravel()] = 0
+        else:
+            # Supersampling: average the sub-sample renders of this strip
+            acc = acc_buffer[:pixels]
+            sample = sample_buffer[:pixels]
+            acc[...] = 0
+            for grid in grids:
+                face, u, v = select_faces(*grid.directions(row_start, row_stop))
+                gather_taps(source, *sample_taps(face, u, v, face_size, filter, layout), sample)
+                covered = grid.coverage(row_start, row_stop)
+                if covered is not None:
+                    sample[~covered.ravel()] = 0
+                acc += sample
+            acc *= 1.0 / len(grids)
+            _store_samples(acc, out)
+
+        yield row_start, strip_buffer[:row_stop - row_start]
+
+
+def _render_panorama_serial(cubemap_array, face_size, pano_width, pano_height, hemisphere_only, filter, ssaa,
+                            ssaa_jitter, plan, strip_rows, max_memory_mb, layout="horizontal_cross",
+                            projection="equirect", orientation=None, window=None, writer=None):
+    """
+    Collect the strips of render_panorama_strips into one panorama array, reporting progress.
+
+    With a writer (e.g. PNGStreamWriter) the strips are streamed to it instead and None is returned.
+    """
+    panorama = None
+    if writer is None:
+        panorama = np.empty((pano_height, pano_width, cubemap_array.shape[-1]), dtype=cubemap_array.dtype)
+    strips = render_panorama_strips(cubemap_array, face_size, pano_width, pano_height, hemisphere_only,
+                                    filter, ssaa, ssaa_jitter, plan, strip_rows, max_memory_mb, layout=layout,
+                                    projection=projection, orientation=orientation, window=window)
+    next_report = 0.1
+    for row_start, strip in strips:
+        row_stop = row_start + len(strip)
+        if writer is None:
+            panorama[row_start:row_stop] = strip
+        else:
+            writer.write(strip)
+        if row_stop / pano_height >= next_report:
+            print(f"Progress: {int(row_stop / pano_height * 100)}%")
+            next_report = row_stop / pano_height + 0.1
+    return panorama
+
+
+def _render_band(task):
+    """Process-pool worker: render one band of rows into the shared output file."""
+    source_path, output_path, plan_info, args, rows, max_memory_mb, layout, projection, orientation, window = task
+    source = np.load(source_path, mmap_mode='r')
+    output = np.load(output_path, mmap_mode='r+')
+
+    plan = None
+    if plan_info is not None:
+        key, paths = plan_info
+        tables = [np.load(path, mmap_mode='r') if path else None for path in paths]
+        plan = ProjectionPlan(*key, *tables)
+
+    for row_start, strip in render_panorama_strips(source, *args, plan=plan, max_memory_mb=max_memory_mb,
+                                                   rows=rows, layout=layout, projection=projection,
+                                                   orientation=orientation, window=window):
+        output[row_start:row_start + len(strip)] = strip
+    output.flush()
+    return rows
+
+
+def _npy_backing_file(array):
+    """Path of the .npy file that array is a complete memory map of (as from np.load(mmap_mode='r')), else None."""
+    if not isinstance(array, np.memmap) or not array.filename or not array.flags.c_contiguous:
+        return None
+    try:
+        on_disk = np.load(array.filename, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if (on_disk.shape, on_disk.dtype, on_disk.offset) != (array.shape, array.dtype, array.offset):
+        return None
+    return array.filename
+
+
+def render_panorama_parallel(cubemap_array, face_size, pano_width, pano_height, hemisphere_only=False,
+                             filter="nearest", ssaa=1, ssaa_jitter=False, plan=None, workers=None,
+                             max_memory_mb=None, layout="horizontal_cross", projection="equirect", orientation=None,
+                             window=None, writer=None):
+    """
+    Render an equirect panorama (or another of PROJECTIONS) on a process pool, one band of rows per task.
+
+    The source cubemap, the plan tables and the output are handed to workers as
+    memory-mapped .npy files (on /dev/shm when available) rather than pickled,
+    so each is written once and then shared through the page cache (a source
+    that is already a memory-mapped .npy file is mapped in place, and a plan
+    keeps its table files for later calls, see ProjectionPlan.shared_paths). Every row
+    is computed exactly as in the single-process engine, so the result is
+    byte-identical whatever the worker count.
+
+    Args:
+        workers (int): Number of worker processes (default: os.cpu_count())
+        max_memory_mb (float): Working-memory budget, split evenly between workers after
+                               the plan's tables
+        writer: Optional strip sink (e.g. PNGStreamWriter); bands are written to it in
+                order as they finish, overlapping the encode with the remaining bands
+
+    Returns:
+        np.ndarray: The (pano_height, pano_width, C) panorama, or None with a writer
+    """
+    workers = workers or os.cpu_count() or 1
+    max_memory_mb = DEFAULT_MAX_MEMORY_MB if max_memory_mb is None else max_memory_mb
+    # The plan is shared, so it counts once; each worker's strips get an even share of the rest
+    # (render_panorama_strips takes the plan back off the budget it is given)
+    plan_mb = 0 if plan is None else plan.nbytes / (1 << 20)
+    max_memory_mb = max(0, max_memory_mb - plan_mb) / workers + plan_mb
+    channels = cubemap_array.shape[-1]
+
+    # A few bands per worker evens out the load between pole and equator rows
+    band_count = min(pano_height, workers * 4)
+    edges = [pano_height * i // band_count for i in range(band_count + 1)]
+    bands = [(start, stop) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+    shared_dir = tempfile.mkdtemp(prefix="cubemap_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    try:
+        # A source that is already a whole .npy file on disk is mapped by the workers directly
+        source_path = _npy_backing_file(cubemap_array)
+        if source_path is None:
+            source_path = os.path.join(shared_dir, "source.npy")
+            np.save(source_path, np.ascontiguousarray(cubemap_array))
+        output_path = os.path.join(shared_dir, "output.npy")
+        np.lib.format.open_memmap(output_path, mode='w+', dtype=cubemap_array.dtype,
+                                  shape=(pano_height, pano_width, channels)).flush()
+
+        # The plan's table files outlive this call, so a cached plan is only written once
+        plan_info = None if plan is None else (plan.key, plan.shared_paths())
+
+        args = (face_size, pano_width, pano_height, hemisphere_only, filter, ssaa, ssaa_jitter)
+        tasks = [(source_path, output_path, plan_info, args, band, max_memory_mb, layout, projection,
+                  orientation_matrix(orientation), window) for band in bands]
+
+        done_rows = 0
+        output = np.load(output_path, mmap_mode='r')
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # pool.map yields in band order, so finished bands can be streamed straight out
+            for row_start, row_stop in pool.map(_render_band, tasks):
+                done_rows += row_stop - row_start
+                print(f"Progress: {int(done_rows / pano_height * 100)}%")
+                if writer is not None:
+                    writer.write(output[row_start:row_stop])
+
+        return None if writer is not None else np.array(output)
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+def _opaque_alpha(dtype):
+    """Fully opaque alpha value for a pixel dtype (255, 65535 or 1.0)."""
+    return np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else 1.0
+
+
+def convert_pixels(array, dtype):
+    """
+    Convert pixel data between uint8, uint16 and float32, rescaling the range.
+
+    Integer types span [0, max]; floats span [0, 1] (values above 1, as in HDR
+    data, are clipped when converting to an integer type).
+    """
+    dtype = np.dtype(dtype)
+    if array.dtype == dtype:
+        return array
+    if np.issubdtype(array.dtype, np.integer) and np.issubdtype(dtype, np.integer):
+        if array.dtype == np.uint8 and dtype == np.uint16:
+            return array.astype(np.uint16) * 257
+        if array.dtype == np.uint16 and dtype == np.uint8:
+            return ((array.astype(np.uint32) + 128) // 257).astype(np.uint8)
+    if np.issubdtype(array.dtype, np.integer):
+        scaled = array.astype(np.float32) / np.iinfo(array.dtype).max
+    else:
+        scaled = array.astype(np.float32, copy=False)
+    if np.issubdtype(dtype, np.floating):
+        return scaled.astype(dtype, copy=False)
+    return np.rint(np.clip(scaled, 0, 1) * np.iinfo(dtype).max).astype(dtype)
+
+
+def has_alpha(channels):
+    """True for the LA and RGBA channel counts (2 and 4)."""
+    return channels in (2, 4)
+
+
+def convert_channels(array, channels):
+    """
+    Expand (..., C) L, LA, RGB or RGBA pixel data of any dtype to the given channel count.
+
+    Grey is replicated into RGB and missing alpha is filled in opaque; an
+    existing alpha channel is dropped only when the target has none. Data that
+    already has the requested channels is returned as is.
+    """
+    current = array.shape[-1]
+    if current == channels:
+        return array
+    color = array[..., :3] if current >= 3 else array[..., :1]
+    if color.shape[-1] == 3 and channels < 3:
+        raise ValueError(f"Cannot convert {CHANNEL_MODES[current]} pixels to {CHANNEL_MODES[channels]}")
+    if channels >= 3 and color.shape[-1] == 1:
+        color = np.repeat(color, 3, axis=-1)
+    if not has_alpha(channels):
+        return np.ascontiguousarray(color)
+    if has_alpha(current):
+        alpha = array[..., -1:]
+    else:
+        alpha = np.full(array.shape[:-1] + (1,), _opaque_alpha(array.dtype), dtype=array.dtype)
+    return np.concatenate([color, alpha], axis=-1)
+
+
+def to_rgba(array):
+    """Expand (H, W[, C]) L, LA, RGB or RGBA pixel data of any dtype to RGBA, adding opaque alpha."""
+    return convert_channels(array if array.ndim == 3 else array[..., None], 4)
+
+
+def drop_opaque_alpha(array, mask=None):
+    """
+    Remove the alpha channel of LA/RGBA pixel data whose texels are all fully opaque.
+
+    Args:
+        mask (np.ndarray): Optional boolean (H, W) selection of the texels that count
+                           (e.g. the face cells of a cross, whose padding is transparent)
+
+    Returns:
+        np.ndarray: The L/RGB data, or array itself if it has no alpha or some texel is transparent
+    """
+    if not has_alpha(array.shape[-1]):
+        return array
+    alpha = array[..., -1] if mask is None else array[..., -1][mask]
+    if not (alpha >= _opaque_alpha(array.dtype)).all():
+        return array
+    return np.ascontiguousarray(array[..., :-1])
+
+
+def read_hdr_header(path):
+    """
+    Parse the header of a Radiance RGBE (.hdr) file.
+
+    Returns:
+        tuple: (width, height, data_offset)
+    """
+    with open(path, "rb") as f:
+        if not f.readline().startswith((b"#?RADIANCE", b"#?RGBE")):
+            raise ValueError(f"{path} is not a Radiance HDR file")
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{path}: truncated HDR header")
+            if line.strip() == b"":
+                break
+            if line.startswith(b"FORMAT=") and line.strip() != b"FORMAT=32-bit_rle_rgbe":
+                raise ValueError(f"{path}: unsupported HDR format {line.strip().decode()}")
+        resolution = f.readline().split()
+        if len(resolution) != 4 or resolution[0] != b"-Y" or resolution[2] != b"+X":
+            raise ValueError(f"{path}: only the standard '-Y <height> +X <width>' orientation is supported")
+        return int(resolution[3]), int(resolution[1]), f.tell()
+
+
+def rgbe_to_float(rgbe):
+    """Decode (..., 4) uint8 RGBE texels to (..., 3) float32 linear radiance."""
+    exponent = rgbe[..., 3:4].astype(np.int32)
+    scale = np.where(exponent > 0, np.ldexp(np.float32(1), exponent - 136), 0).astype(np.float32)
+    return (rgbe[..., :3].astype(np.float32) + 0.5) * scale
+
+
+def float_to_rgbe(rgb):
+    """Encode (..., 3) float radiance as (..., 4) uint8 RGBE texels (shared exponent)."""
+    rgb = np.maximum(rgb, 0).astype(np.float32, copy=False)
+    brightest = rgb.max(axis=-1)
+    mantissa, exponent = np.frexp(brightest)
+    visible = brightest > 1e-32
+    scale = np.where(visible, mantissa * 256 / np.where(visible, brightest, 1), 0).astype(np.float32)
+    rgbe = np.empty(rgb.shape[:-1] + (4,), dtype=np.uint8)
+    rgbe[..., :3] = np.minimum(rgb * scale[..., None], 255)
+    rgbe[..., 3] = np.where(visible, exponent + 128, 0)
+    return rgbe
+
+
+def read_hdr(path):
+    """
+    Read a Radiance RGBE (.hdr) file, flat or run-length encoded.
+
+    Returns:
+        np.ndarray: (H, W, 3) float32 linear radiance
+    """
+    width, height, offset = read_hdr_header(path)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+
+    rgbe = np.empty((height, width, 4), dtype=np.uint8)
+    pos = 0
+    for y in range(height):
+        if 8 <= width < 0x8000 and data[pos:pos + 2] == b"\x02\x02" and not data[pos + 2] & 0x80:
+            # New-style RLE: the scanline is stored as four runs-encoded channel planes
+            pos += 4
+            for channel in range(4):
+                plane = bytearray()
+                while len(plane) < width:
+                    count = data[pos]
+                    if count > 128:
+                        plane += data[pos + 1:pos + 2] * (count - 128)
+                        pos += 2
+                    else:
+                        plane += data[pos + 1:pos + 1 + count]
+                        pos += 1 + count
+                if len(plane) != width:
+                    raise ValueError(f"{path}: corrupt run-length data in scanline {y}")
+                rgbe[y, :, channel] = np.frombuffer(plane, dtype=np.uint8)
+        else:
+            # Flat scanline (old-style run-length repeats are not supported)
+            rgbe[y] = np.frombuffer(data, dtype=np.uint8, count=width * 4, offset=pos).reshape(width, 4)
+            pos += width * 4
+    return rgbe_to_float(rgbe)
+
+
+class HDRStreamWriter:
+    """
+    Incremental Radiance RGBE (.hdr) writer with per-scanline run-length encoding.
+
+    Takes rows of any pixel dtype (integers are rescaled to [0, 1]); only the
+    first three channels are stored, since RGBE has no alpha. Like the other
+    stream writers, the file is written to a temporary name and moved into
+    place by close().
+    """
+
+    def __init__(self, path, width, height):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.encode_seconds = 0.0
+        self._temp_path = path + ".partial"
+        self._file = open(self._temp_path, "wb")
+        self._file.write(b"#?RADIANCE\nFORMAT=32-bit_rle_rgbe\n\n" + f"-Y {height} +X {width}\n".encode())
+
+    @staticmethod
+    def _encode_plane(plane):
+        """Run-length encode one channel plane of a scanline (runs of 4+ become repeat codes)."""
+        change = np.flatnonzero(np.diff(plane)) + 1
+        starts = np.concatenate([[0], change])
+        lengths = np.diff(np.concatenate([starts, [len(plane)]]))
+        out = bytearray()
+        literal_start = 0
+        for start, length in zip(starts.tolist(), lengths.tolist()):
+            if length < 4:
+                continue
+            for chunk in range(literal_start, start, 128):
+                stop = min(start, chunk + 128)
+                out.append(stop - chunk)
+                out += plane[chunk:stop].tobytes()
+            value = int(plane[start])
+            for remaining in range(length, 0, -127):
+                out += bytes((128 + min(127, remaining), value))
+            literal_start = start + length
+        for chunk in range(literal_start, len(plane), 128):
+            stop = min(len(plane), chunk + 128)
+            out.append(stop - chunk)
+            out += plane[chunk:stop].tobytes()
+        return out
+
+    def write(self, rows):
+        """Append a (n, width, C) strip of rows."""
+        if rows.shape[1] != self.width:
+            raise ValueError(f"Strip of {rows.shape[1]} pixels per row does not match a {self.width} pixel "
+                             f"wide image")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError(f"Too many rows for a {self.height} row image")
+        start_time = time.perf_counter()
+        rgbe = float_to_rgbe(to_rgba(convert_pixels(np.asarray(rows), np.float32))[..., :3])
+        rle = 8 <= self.width < 0x8000
+        for row in rgbe:
+            if not rle:
+                self._file.write(row.tobytes())
+                continue
+            line = bytearray(struct.pack(">BBH", 2, 2, self.width))
+            for channel in range(4):
+                line += self._encode_plane(np.ascontiguousarray(row[:, channel]))
+            self._file.write(line)
+        self.rows_written += len(rows)
+        self.encode_seconds += time.perf_counter() - start_time
+
+    def close(self):
+        """Finish the file and move it into place."""
+        if self._file is None:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"HDR closed after {self.rows_written} of {self.height} rows")
+            self._file.close()
+            os.replace(self._temp_path, self.path)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Discard a partially written file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if os.path.exists(self._temp_path):
+                os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class NPYStreamWriter:
+    """
+    Raw .npy strip writer, for intermediates handed to other tools.
+
+    The (height, width, C) array is memory-mapped on disk and strips are copied
+    straight into it, so there is no encode cost; consumers np.load(path,
+    mmap_mode='r') it and only page in the rows they touch. Rows of another
+    dtype are converted to the file's. Like the other stream writers, the file
+    is written to a temporary name and moved into place by close().
+    """
+
+    def __init__(self, path, width, height, mode="RGBA", dtype=np.uint8):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.encode_seconds = 0.0
+        self._temp_path = path + ".partial"
+        self._array = np.lib.format.open_memmap(self._temp_path, mode="w+", dtype=dtype,
+                                                shape=(height, width, len(mode)))
+
+    def write(self, rows):
+        """Append a (n, width[, C]) strip of rows."""
+        rows = np.asarray(rows)
+        if rows.ndim == 2:
+            rows = rows[:, :, None]
+        if rows.shape[1:] != self._array.shape[1:]:
+            raise ValueError(f"Strip of shape {rows.shape[1:]} per row does not match {self._array.shape[1:]}")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError(f"Too many rows for a {self.height} row image")
+        start_time = time.perf_counter()
+        self._array[self.rows_written:self.rows_written + len(rows)] = convert_pixels(rows, self._array.dtype)
+        self.rows_written += len(rows)
+        self.encode_seconds += time.perf_counter() - start_time
+
+    def close(self):
+        """Flush the array and move the file into place."""
+        if self._array is None:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"NPY closed after {self.rows_written} of {self.height} rows")
+            self._array.flush()
+            self._array = None
+            os.replace(self._temp_path, self.path)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Discard a partially written file."""
+        self._array = None
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# Channels of each PNG colour type (grey, RGB, grey + alpha, RGBA)
+PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+
+def _png_header(path):
+    """(width, height, bit_depth, color_type) from a PNG's IHDR chunk, or None if path isn't a PNG."""
+    with open(path, "rb") as f:
+        head = f.read(33)
+    if len(head) < 33 or head[:8] != b"\x89PNG\r\n\x1a\n" or head[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">IIBB", head[16:26])
+
+
+# Pillow (mode, rawmode) decodes whose unfiltered bytes rebuild a PNG scanline with bpp bytes
+# per pixel: a byte-for-byte unpacker where Pillow has a mode of the same pixel size, else
+# two passes for the high and low bytes of the 16-bit samples ("16L" keeps the second byte
+# of each big-endian pair, which is the low one)
+PNG_UNFILTER_PASSES = {
+    1: (("L", "L"),),
+    2: (("LA", "LA"),),
+    3: (("RGB", "RGB"),),
+    4: (("RGBA", "RGBA"),),
+    6: (("RGB", "RGB;16B"), ("RGB", "RGB;16L")),
+    8: (("RGBA", "RGBA;16B"), ("RGBA", "RGBA;16L")),
+}
+
+
+def _png_unfilter_pillow(inflated, width, height, bpp):
+    """
+    Undo PNG row filters with Pillow's C decoder, returning (H, W * bpp) uint8, or None if it can't.
+
+    The inflated scanlines are re-wrapped as a stored (uncompressed) zlib stream,
+    so each pass only unfilters; Pillow releases the GIL while it does.
+    """
+    passes = PNG_UNFILTER_PASSES.get(bpp)
+    if passes is None or not features.check_codec("zlib"):
+        return None
+    stored = zlib.compress(inflated, 0)
+    try:
+        planes = [np.asarray(Image.frombytes(mode, (width, height), stored, "zip", rawmode))
+                  for mode, rawmode in passes]
+    except (ValueError, OSError):
+        return None
+    if len(planes) == 1:
+        return planes[0].reshape(height, -1)
+    pixels = np.empty((height, width, bpp // 2, 2), dtype=np.uint8)
+    pixels[..., 0] = planes[0]
+    pixels[..., 1] = planes[1]
+    return pixels.reshape(height, -1)
+
+
+def _png_unfilter(filtered, bpp):
+    """
+    Undo PNG row filters on (H, 1 + stride) bytes, returning (H, stride) uint8.
+
+    The NumPy fallback of _png_unfilter_pillow.
+
+    Each byte depends on its left, upper and upper-left neighbours, so pixels are
+    reconstructed one anti-diagonal at a time: every pixel on a diagonal only
+    needs pixels from earlier diagonals, so each step is a single array operation
+    over up to H pixels, whatever mix of filters the rows use.
+    """
+    height = len(filtered)
+    types = filtered[:, 0].astype(np.int16)
+    data = filtered[:, 1:].reshape(height, -1, bpp).astype(np.int16)
+    width = data.shape[1]
+    if not types.any():
+        return filtered[:, 1:]
+
+    # One row/column of zero padding above and to the left
+    out = np.zeros((height + 1, width + 1, bpp), dtype=np.int16)
+    rows = np.arange(height)
+    for diagonal in range(height + width - 1):
+        r = rows[max(0, diagonal - width + 1):min(height, diagonal + 1)]
+        c = diagonal - r
+        a = out[r + 1, c]
+        b = out[r, c + 1]
+        corner = out[r, c]
+        pa = np.abs(b - corner)
+        pb = np.abs(a - corner)
+        pc = np.abs(a + b - 2 * corner)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, corner))
+        t = types[r][:, None]
+        predictor = np.select([t == 1, t == 2, t == 3, t == 4], [a, b, (a + b) >> 1, paeth], 0)
+        out[r + 1, c + 1] = (data[r, c] + predictor) & 0xFF
+    return out[1:, 1:].astype(np.uint8).reshape(height, -1)
+
+
+def read_png(path):
+    """
+    Read a non-interlaced 8 or 16-bit greyscale/RGB PNG (with or without alpha) at full precision.
+
+    Pillow decodes 16-bit colour PNGs to 8 bits per channel; this reader keeps
+    them as uint16. It still lets Pillow's decoder undo the row filters (see
+    _png_unfilter_pillow), so it is about as fast as an 8-bit decode.
+
+    Returns:
+        np.ndarray: (H, W, C) uint8 or uint16
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 8
+    idat = []
+    while pos < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        if chunk_type == b"IHDR":
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", body)
+        elif chunk_type == b"IDAT":
+            idat.append(body)
+        elif chunk_type == b"IEND":
+            break
+        pos += 12 + length
+    if bit_depth not in (8, 16) or color_type not in PNG_CHANNELS or interlace:
+        raise ValueError(f"{path}: unsupported PNG (bit depth {bit_depth}, colour type {color_type}, "
+                         f"interlace {interlace})")
+
+    channels = PNG_CHANNELS[color_type]
+    bpp = channels * bit_depth // 8
+    inflated = zlib.decompress(b"".join(idat))
+    pixels = _png_unfilter_pillow(inflated, width, height, bpp)
+    if pixels is None:
+        pixels = _png_unfilter(np.frombuffer(inflated, dtype=np.uint8).reshape(height, 1 + width * bpp), bpp)
+    dtype = np.dtype(">u2") if bit_depth == 16 else np.dtype(np.uint8)
+    return pixels.view(dtype).reshape(height, width, channels).astype(dtype.newbyteorder("="))
+
+
+def _high_precision_file(path):
+    """True for files whose pixels Pillow would truncate to 8 bits (.hdr, 16-bit PNG)."""
+    if path.lower().endswith(".hdr"):
+        return True
+    header = _png_header(path) if path.lower().endswith(".png") else None
+    return header is not None and header[2] == 16
+
+
+def read_image(image):
+    """
+    Load pixel data at its native precision.
+
+    Args:
+        image: A path, a PIL Image or an array. .hdr files load as float32 and
+               16-bit PNGs as uint16; 8-bit images as uint8 and Pillow's
+               "I;16"/"F" modes as uint16/float32. Raw .npy intermediates are
+               memory-mapped read-only, so nothing is decoded or copied up front
+
+    Returns:
+        np.ndarray: (H, W, C) pixel array
+    """
+    if isinstance(image, np.ndarray):
+        return image if image.ndim == 3 else image[..., None]
+    if isinstance(image, str):
+        if image.lower().endswith(".npy"):
+            return read_image(np.load(image, mmap_mode='r'))
+        if image.lower().endswith(".hdr"):
+            return read_hdr(image)
+        if _high_precision_file(image):
+            return read_png(image)
+        image = Image.open(image)
+    mode = _decode_mode(image)
+    array = np.asarray(image if image.mode == mode else image.convert(mode))
+    return array if array.ndim == 3 else array[..., None]
+
+
+def _decode_mode(image):
+    """
+    Pillow mode read_image decodes a PIL Image to: L, LA, RGB, RGBA, "I;16" and "F" as they are;
+    bilevel to L; palette and other modes to RGBA if they carry transparency, else RGB.
+    """
+    if image.mode in ("L", "LA", "RGB", "RGBA") or image.mode in PIL_MODE_DTYPES:
+        return image.mode
+    if image.mode == "1":
+        return "L"
+    return "RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB"
+
+
+def _output_image(array):
+    """A PIL Image for 8-bit pixel arrays; other dtypes have no lossless PIL mode and stay arrays."""
+    if array.dtype != np.uint8:
+        return array
+    return Image.fromarray(array if array.shape[-1] != 1 else array[..., 0])
+
+
+def _open_output(output_path):
+    """
+    Open a written output: lazily through PIL when it holds 8-bit data, else read at full
+    precision (.npy intermediates as a read-only memory map).
+    """
+    if output_path.lower().endswith(".npy") or _high_precision_file(output_path):
+        return read_image(output_path)
+    return Image.open(output_path)
+
+
+class PNGStreamWriter:
+    """
+    Incremental PNG encoder: rows are written strip by strip and compressed as they arrive.
+
+    Only the strip being written (plus one previous row for the filters) is held
+    in memory, and IDAT chunks are flushed to disk as zlib produces them, so an
+    arbitrarily tall image can be encoded while it is still being rendered.
+    The file is written to a temporary name and moved into place by close().
+
+    Usage:
+        with PNGStreamWriter("pano.png", width, height) as writer:
+            for row_start, strip in render_panorama_strips(...):
+                writer.write(strip)
+    """
+
+    COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+    ROW_FILTERS = ('none', 'sub', 'up', 'average', 'paeth')
+
+    # Rows filtered per batch; bounds the int16 filter temporaries for very wide strips
+    FILTER_BATCH_BYTES = 4 << 20
+
+    def __init__(self, path, width, height, mode="RGBA", compress_level=6, filter="adaptive",
+                 chunk_size=1 << 16, bit_depth=8):
+        """
+        Args:
+            path (str): Output PNG path
+            width (int), height (int): Image size in pixels
+            mode (str): "L", "LA", "RGB" or "RGBA"
+            compress_level (int): zlib level 0-9 (default: 6, as PIL)
+            filter (str): PNG row filter: one of ROW_FILTERS, or "adaptive" (default) to pick
+                          the filter per row with the minimum-sum-of-residuals heuristic
+            chunk_size (int): Compressed bytes collected before an IDAT chunk is written
+            bit_depth (int): 8 (default) or 16 bits per channel; rows of other dtypes
+                             are rescaled to it
+        """
+        if bit_depth not in (8, 16):
+            raise ValueError(f"Unsupported PNG bit depth {bit_depth} (expected 8 or 16)")
+        if mode not in self.COLOR_TYPES:
+            raise ValueError(f"Unsupported PNG mode '{mode}' (expected one of {', '.join(self.COLOR_TYPES)})")
+        if filter != "adaptive" and filter not in self.ROW_FILTERS:
+            raise ValueError(f"Unknown PNG filter '{filter}'")
+        self.path = path
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.filter = filter
+        self.chunk_size = chunk_size
+        self.channels = len(mode)
+        self.bit_depth = bit_depth
+        self.rows_written = 0
+        self.encode_seconds = 0.0
+
+        # Filters work on bytes, comparing each with the same byte of the previous pixel
+        self._bpp = self.channels * bit_depth // 8
+        self._prev = np.zeros(width * self._bpp, dtype=np.uint8)
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = bytearray()
+        self._temp_path = path + ".partial"
+        self._file = open(self._temp_path, "wb")
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, self.COLOR_TYPES[mode], 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def _filter_rows(self, rows):
+        """Apply the PNG row filters to a (n, width * channels) uint8 block, prefixing the filter bytes."""
+        bpp = self._bpp
+        filtered = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+        if self.filter == "none":
+            filtered[:, 0] = 0
+            filtered[:, 1:] = rows
+            return filtered
+
+        # x: current byte, a: byte to the left, b: byte above, c: byte above-left
+        x = rows.astype(np.int16)
+        b = np.empty_like(x)
+        b[0] = self._prev
+        b[1:] = x[:-1]
+        a = np.zeros_like(x)
+        a[:, bpp:] = x[:, :-bpp]
+        c = np.zeros_like(x)
+        c[:, bpp:] = b[:, :-bpp]
+
+        def paeth():
+            pa = np.abs(b - c)
+            pb = np.abs(a - c)
+            pc = np.abs(a + b - 2 * c)
+            return x - np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+        residuals = {
+            'none': lambda: x,
+            'sub': lambda: x - a,
+            'up': lambda: x - b,
+            'average': lambda: x - ((a + b) >> 1),
+            'paeth': paeth,
+        }
+        if self.filter != "adaptive":
+            filtered[:, 0] = self.ROW_FILTERS.index(self.filter)
+            filtered[:, 1:] = residuals[self.filter]() & 0xFF
+            return filtered
+
+        # Adaptive: per row, the filter whose residuals (as signed bytes) have the smallest sum
+        best_score = None
+        for filter_type, name in enumerate(self.ROW_FILTERS):
+            residual = (residuals[name]() & 0xFF).astype(np.uint8)
+            score = np.abs(residual.view(np.int8).astype(np.int32)).sum(axis=1)
+            if best_score is None:
+                best_score = score
+                filtered[:, 0] = filter_type
+                filtered[:, 1:] = residual
+            else:
+                better = score < best_score
+                best_score = np.where(better, score, best_score)
+                filtered[better, 0] = filter_type
+                filtered[better, 1:] = residual[better]
+        return filtered
+
+    def write(self, rows):
+        """Append a (n, width[, channels]) strip of rows (uint8, uint16 or float in [0, 1])."""
+        rows = convert_pixels(np.asarray(rows), np.uint8 if self.bit_depth == 8 else np.uint16)
+        if self.bit_depth == 16:
+            rows = rows.astype(">u2")
+        rows = np.ascontiguousarray(rows).view(np.uint8).reshape(len(rows), -1)
+        if rows.shape[1] != self.width * self._bpp:
+            raise ValueError(f"Strip of {rows.shape[1]} bytes per row does not match a {self.width} pixel "
+                             f"wide {self.mode} image")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError(f"Too many rows for a {self.height} row image")
+
+        start_time = time.perf_counter()
+        batch = max(1, self.FILTER_BATCH_BYTES // rows.shape[1])
+        for start in range(0, len(rows), batch):
+            block = rows[start:start + batch]
+            self._pending += self._compressor.compress(self._filter_rows(block))
+            self._prev = block[-1].copy()
+            if len(self._pending) >= self.chunk_size:
+                self._write_chunk(b"IDAT", bytes(self._pending))
+                self._pending.clear()
+        self.rows_written += len(rows)
+        self.encode_seconds += time.perf_counter() - start_time
+
+    def close(self):
+        """Flush the compressor, finish the file and move it into place."""
+        if self._file is None:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"PNG closed after {self.rows_written} of {self.height} rows")
+            start_time = time.perf_counter()
+            self._pending += self._compressor.flush()
+            self._write_chunk(b"IDAT", bytes(self._pending))
+            self._write_chunk(b"IEND", b"")
+            self.encode_seconds += time.perf_counter() - start_time
+            self._file.close()
+            os.replace(self._temp_path, self.path)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Discard a partially written file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if os.path.exists(self._temp_path):
+                os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _expand_565(packed):
+    """Decode RGB565 values to (..., 3) float32 colours the way GPUs do (bit replication)."""
+    r = (packed >> 11) & 31
+    g = (packed >> 5) & 63
+    b = packed & 31
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1).astype(np.float32)
+
+
+def _quantize_565(colors):
+    """Round (..., 3) colours in [0, 255] to packed RGB565 (uint32 for headroom)."""
+    q = np.rint(np.clip(colors, 0, 255) * (np.array([31, 63, 31], dtype=np.float32) / 255)).astype(np.uint32)
+    return (q[..., 0] << 11) | (q[..., 1] << 5) | q[..., 2]
+
+
+def _bc1_indices(colors, c0, c1):
+    """Nearest 4-colour palette entry (c0, c1, 2/3 c0 + 1/3 c1, 1/3 c0 + 2/3 c1) for each texel."""
+    p0 = _expand_565(c0)
+    p1 = _expand_565(c1)
+    palette = np.stack([p0, p1, (2 * p0 + p1) / 3, (p0 + 2 * p1) / 3], axis=1)    # (N, 4, 3)
+    distances = ((colors[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)  # (N, 16, 4)
+    return distances.argmin(axis=-1)
+
+
+def _bc1_color_blocks(colors, quality):
+    """
+    Compress (N, 16, 3) float32 texel blocks to (N, 8) BC1 colour blocks.
+
+    quality:
+        "fast":   endpoints from the per-channel bounding box, inset by 1/16
+        "normal": endpoints along the principal axis of each block (power iteration)
+        "high":   "normal" followed by two least-squares endpoint refinements
+    """
+    if quality == "fast":
+        lo = colors.min(axis=1)
+        hi = colors.max(axis=1)
+        inset = (hi - lo) / 16
+        e0, e1 = hi - inset, lo + inset
+    else:
+        mean = colors.mean(axis=1, keepdims=True)
+        centered = colors - mean
+        cov = np.einsum('nki,nkj->nij', centered, centered)
+        axis = colors.max(axis=1) - colors.min(axis=1) + 1e-3
+        for _ in range(8):
+            axis = np.einsum('nij,nj->ni', cov, axis)
+            axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-12)
+        proj = np.einsum('nki,ni->nk', centered, axis)
+        e0 = mean[:, 0] + axis * proj.max(axis=1, keepdims=True)
+        e1 = mean[:, 0] + axis * proj.min(axis=1, keepdims=True)
+
+    c0 = _quantize_565(e0)
+    c1 = _quantize_565(e1)
+    indices = _bc1_indices(colors, c0, c1)
+
+    if quality == "high":
+        # Solve for the endpoints that best reproduce the block given the current
+        # index assignment: weight of c0 per palette entry is 1, 0, 2/3, 1/3
+        c0_weight = np.array([1, 0, 2 / 3, 1 / 3], dtype=np.float32)
+        for _ in range(2):
+            w = c0_weight[indices]                                  # (N, 16)
+            aa = (w * w).sum(axis=1)
+            ab = (w * (1 - w)).sum(axis=1)
+            bb = ((1 - w) * (1 - w)).sum(axis=1)
+            wx = np.einsum('nk,nki->ni', w, colors)
+            vx = np.einsum('nk,nki->ni', 1 - w, colors)
+            det = aa * bb - ab * ab
+            solvable = np.abs(det) > 1e-6
+            det = np.where(solvable, det, 1)[:, None]
+            r0 = (bb[:, None] * wx - ab[:, None] * vx) / det
+            r1 = (aa[:, None] * vx - ab[:, None] * wx) / det
+            c0 = np.where(solvable, _quantize_565(r0), c0)
+            c1 = np.where(solvable, _quantize_565(r1), c1)
+            indices = _bc1_indices(colors, c0, c1)
+
+    # Four-colour mode needs c0 > c1; swapping the endpoints swaps indices 0<->1 and 2<->3
+    swap = c0 < c1
+    c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+    indices = np.where(swap[:, None], indices ^ 1, indices)
+    # Flat blocks (c0 == c1) would select the 3-colour mode; index 0 is exact for them
+    indices = np.where((c0 == c1)[:, None], 0, indices)
+
+    blocks = np.empty((len(colors), 8), dtype=np.uint8)
+    blocks[:, 0:2] = c0.astype('<u2')[:, None].view(np.uint8)
+    blocks[:, 2:4] = c1.astype('<u2')[:, None].view(np.uint8)
+    packed = (indices.astype(np.uint32) << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+    blocks[:, 4:8] = packed.astype('<u4')[:, None].view(np.uint8)
+    return blocks
+
+
+def _bc3_alpha_blocks(alpha):
+    """Compress (N, 16) float32 alpha blocks to (N, 8) BC3 alpha blocks (8-value mode)."""
+    a0 = alpha.max(axis=1)
+    a1 = alpha.min(axis=1)
+    steps = np.arange(8, dtype=np.float32) / 7
+    # Palette order of the 8-value mode: a0, a1, then six interpolants from a0 towards a1
+    order = np.array([0, 7, 1, 2, 3, 4, 5, 6])
+    palette = np.floor(a0[:, None] * (1 - steps[order]) + a1[:, None] * steps[order] + 0.5)
+    indices = np.abs(alpha[:, :, None] - palette[:, None, :]).argmin(axis=-1)
+
+    blocks = np.empty((len(alpha), 8), dtype=np.uint8)
+    blocks[:, 0] = a0
+    blocks[:, 1] = a1
+    packed = (indices.astype(np.uint64) << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    blocks[:, 2:8] = packed.astype('<u8')[:, None].view(np.uint8)[:, :6]
+    return blocks
+
+
+def compress_bc_blocks(pixels, compression="bc1", quality="normal"):
+    """
+    Block-compress an RGBA image region whose sides are multiples of 4.
+
+    Every 4x4 block is encoded at once with array operations.
+
+    Args:
+        pixels (np.ndarray): (H, W, 4) uint8 RGBA, with H and W multiples of 4
+        compression (str): "bc1" (DXT1, opaque colour) or "bc3" (DXT5, colour + alpha)
+        quality (str): "fast", "normal" or "high" (see _bc1_color_blocks)
+
+    Returns:
+        np.ndarray: (H / 4 * W / 4, 8 or 16) uint8 blocks in row-major block order
+    """
+    height, width = pixels.shape[:2]
+    blocks = (pixels.reshape(height // 4, 4, width // 4, 4, 4).swapaxes(1, 2)
+              .reshape(-1, 16, 4).astype(np.float32))
+    color = _bc1_color_blocks(blocks[:, :, :3], quality)
+    if compression == "bc1":
+        return color
+    return np.concatenate([_bc3_alpha_blocks(blocks[:, :, 3]), color], axis=1)
+
+
+class DDSStreamWriter:
+    """
+    Incremental DDS writer: BC1/BC3-compresses rows strip by strip as they arrive.
+
+    Rows are buffered until whole 4-row block rows are available; partial
+    blocks at the right and bottom edges are padded by repeating the edge
+    texels. Like PNGStreamWriter, the file is written to a temporary name
+    and moved into place by close().
+    """
+
+    COMPRESSIONS = {'bc1': b"DXT1", 'bc3': b"DXT5"}
+    QUALITIES = ('fast', 'normal', 'high')
+
+    # Block rows compressed per batch; bounds the float32 block temporaries
+    BATCH_PIXELS = 1 << 18
+
+    def __init__(self, path, width, height, compression="bc1", quality="normal"):
+        """
+        Args:
+            path (str): Output DDS path
+            width (int), height (int): Image size in pixels
+            compression (str): "bc1" (opaque, 4 bits per texel) or "bc3" (with alpha, 8 bits per texel)
+            quality (str): "fast", "normal" (default) or "high"; higher is slower but
+                           picks better block endpoints
+        """
+        if compression not in self.COMPRESSIONS:
+            raise ValueError(f"Unknown DDS compression '{compression}' (expected bc1 or bc3)")
+        if quality not in self.QUALITIES:
+            raise ValueError(f"Unknown DDS quality '{quality}' (expected one of {', '.join(self.QUALITIES)})")
+        self.path = path
+        self.width = width
+        self.height = height
+        self.compression = compression
+        self.quality = quality
+        self.rows_written = 0
+        self.encode_seconds = 0.0
+
+        self._pending = np.empty((0, width, 4), dtype=np.uint8)
+        self._temp_path = path + ".partial"
+        self._file = open(self._temp_path, "wb")
+        self._file.write(_dds_header(width, height, compression))
+
+    def _encode(self, rows):
+        """Compress whole block rows (len(rows) is a multiple of 4)."""
+        if self.width % 4:
+            rows = np.pad(rows, ((0, 0), (0, 4 - self.width % 4), (0, 0)), mode='edge')
+        batch = max(4, self.BATCH_PIXELS // rows.shape[1] // 4 * 4)
+        for start in range(0, len(rows), batch):
+            self._file.write(compress_bc_blocks(rows[start:start + batch], self.compression, self.quality))
+
+    def write(self, rows):
+        """Append a (n, width[, channels]) strip of rows; L/LA/RGB are expanded to RGBA, other dtypes to 8 bits."""
+        rows = np.asarray(rows)
+        if rows.ndim == 2:
+            rows = rows[:, :, None]
+        if rows.shape[1] != self.width:
+            raise ValueError(f"Strip of {rows.shape[1]} pixels per row does not match a {self.width} pixel "
+                             f"wide image")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError(f"Too many rows for a {self.height} row image")
+
+        start_time = time.perf_counter()
+        count = len(rows)
+        rows = to_rgba(convert_pixels(rows, np.uint8))
+
+        # Copies the rows (the caller may reuse its strip buffer); only a partial block row stays behind
+        rows = np.concatenate([self._pending, rows])
+        whole = len(rows) // 4 * 4
+        self._encode(rows[:whole])
+        self._pending = rows[whole:]
+        self.rows_written += count
+        self.encode_seconds += time.perf_counter() - start_time
+
+    def close(self):
+        """Compress the last (edge-padded) block row, finish the file and move it into place."""
+        if self._file is None:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"DDS closed after {self.rows_written} of {self.height} rows")
+            start_time = time.perf_counter()
+            if len(self._pending):
+                self._encode(np.pad(self._pending, ((0, 4 - len(self._pending)), (0, 0), (0, 0)), mode='edge'))
+            self.encode_seconds += time.perf_counter() - start_time
+            self._file.close()
+            os.replace(self._temp_path, self.path)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Discard a partially written file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if os.path.exists(self._temp_path):
+                os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _srgb_to_linear(c):
+    """sRGB-encoded values in [0, 1] to linear light in [0, 1]."""
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4).astype(np.float32)
+
+
+def _linear_to_srgb(c):
+    """Linear light in [0, 1] to sRGB-encoded values in [0, 1]."""
+    c = np.clip(c, 0, 1)
+    return np.where(c <= 0.0031308, c * 12.92, 1.055 * c ** (1 / 2.4) - 0.055).astype(np.float32)
+
+
+def _downsample_taps(size, filter, wrap):
+    """
+    Source indices and weights, (size // 2, taps) each, that halve one axis.
+
+    Output sample j covers source interval [j * r, (j + 1) * r) with r = size / (size // 2),
+    so odd sizes are handled without dropping the last texel.
+    """
+    out_size = max(1, size // 2)
+    ratio = size / out_size
+    centers = (np.arange(out_size) + 0.5) * ratio    # in source texel-edge coordinates
+    if filter == "box":
+        radius = ratio / 2
+    else:
+        radius = 2 * ratio    # Kaiser-windowed sinc, two lobes each side
+    first = np.floor(centers - radius - 0.5).astype(np.intp)
+    taps = int(np.ceil(2 * radius)) + 2
+    index = first[:, None] + np.arange(taps)
+    distance = (index + 0.5 - centers[:, None]) / ratio    # in output texels
+
+    if filter == "box":
+        # Overlap of each source texel with the output footprint
+        lo = np.maximum(index, centers[:, None] - radius)
+        hi = np.minimum(index + 1, centers[:, None] + radius)
+        weights = np.clip(hi - lo, 0, None)
+    else:
+        window = np.clip(1 - (distance / 2) ** 2, 0, None)
+        weights = np.sinc(distance) * np.i0(KAISER_BETA * np.sqrt(window)) / np.i0(KAISER_BETA)
+        weights[np.abs(distance) >= 2] = 0
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    index = index % size if wrap else np.clip(index, 0, size - 1)
+    return index, weights.astype(np.float32)
+
+
+def downsample(level, filter="box", wrap_x=False):
+    """
+    Halve a float (H, W, C) image in both directions with a separable filter.
+
+    Args:
+        filter (str): "box" (2x2 average) or "kaiser" (Kaiser-windowed sinc, sharper)
+        wrap_x (bool): Wrap horizontally instead of clamping (equirect longitude seam)
+
+    Returns:
+        np.ndarray: The (max(1, H // 2), max(1, W // 2), C) float32 level
+    """
+    for axis, wrap in ((0, False), (1, wrap_x)):
+        if level.shape[axis] == 1:
+            continue
+        index, weights = _downsample_taps(level.shape[axis], filter, wrap)
+        moved = np.moveaxis(level, axis, 0)
+        out = np.zeros((len(index),) + moved.shape[1:], dtype=np.float32)
+        for tap in range(index.shape[1]):
+            out += weights[:, tap].reshape((-1,) + (1,) * (moved.ndim - 1)) * moved[index[:, tap]]
+        level = np.moveaxis(out, 0, axis)
+    return level
+
+
+def generate_mips(pixels, filter="box", wrap_x=False, srgb=True):
+    """
+    Build the full mip pyramid of an image, down to 1x1.
+
+    Each level is filtered from the previous one, which is kept in float so the
+    rounding of one level doesn't feed into the next. Colour is filtered in
+    linear light (srgb=True) so mips don't darken; alpha is filtered as is.
+    Float pixels (HDR radiance) are already linear and are filtered unclipped.
+
+    Args:
+        pixels (np.ndarray): (H, W, C) uint8, uint16 or float32 level 0 (L, LA, RGB or RGBA)
+        filter (str): "box" or "kaiser" (see downsample)
+        wrap_x (bool): Wrap at the left/right edge, for equirect panoramas
+
+    Returns:
+        list: Levels in the dtype of pixels, level 0 (pixels itself) first
+    """
+    if filter not in MIP_FILTERS:
+        raise ValueError(f"Unknown mip filter '{filter}' (expected one of {', '.join(MIP_FILTERS)})")
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+    color_channels = 3 if pixels.shape[2] >= 3 else 1
+    srgb = srgb and np.issubdtype(pixels.dtype, np.integer)
+
+    levels = [pixels]
+    level = np.array(convert_pixels(pixels, np.float32))
+    if srgb:
+        level[..., :color_channels] = _srgb_to_linear(level[..., :color_channels])
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        level = downsample(level, filter, wrap_x)
+        stored = level.copy()
+        if srgb:
+            stored[..., :color_channels] = _linear_to_srgb(stored[..., :color_channels])
+        levels.append(convert_pixels(stored, pixels.dtype))
+    return levels
+
+
+def mip_path(output_path, level):
+    """File name of mip level n >= 1 written next to output_path: <stem>_mip<n><ext>."""
+    stem, extension = os.path.splitext(output_path)
+    return f"{stem}_mip{level}{extension}"
+
+
+def save_mips(levels, output_path, encoder=None, mips="files"):
+    """
+    Save a mip chain from generate_mips.
+
+    Args:
+        levels (list): (H, W, C) levels, level 0 first
+        output_path (str): Level 0 path; with mips="files" level n goes to mip_path(output_path, n)
+        encoder: Encoder choice, as accepted by resolve_encoder
+        mips (str): "files" (one image per level) or "container" (one DDS holding the chain)
+
+    Returns:
+        dict: The resolved encoder settings
+    """
+    settings = resolve_encoder(encoder, output_path)
+    if mips == "container":
+        if settings["format"] != "dds":
+            raise ValueError("Mip chains can only be embedded in DDS output; use mips='files' for "
+                             f"{settings['format']}")
+        write_dds(output_path, levels, settings["compression"], settings["quality"])
+    elif mips == "files":
+        for index, level in enumerate(levels):
+            path = output_path if index == 0 else mip_path(output_path, index)
+            save_image(level, path, settings)
+    else:
+        raise ValueError(f"Unknown mips mode '{mips}' (expected 'files' or 'container')")
+    return settings
+
+
+def cross_mips(face_stack, layout="horizontal_cross", filter="box"):
+    """
+    Build the mip pyramid of a cubemap in a layout, down to 1x1 faces.
+
+    Each face is filtered on its own (see generate_mips) and the levels are then
+    assembled as build_layout would, so the transparent cells of the crosses
+    never bleed into the faces' edges.
+
+    Args:
+        face_stack (np.ndarray): (6, S, S, C) faces in FACE_NAMES order
+        layout (str): Arrangement of the faces (default: the 4x3 horizontal cross)
+        filter (str): "box" or "kaiser" (see downsample)
+
+    Returns:
+        list: One layout image per level, level 0 first
+    """
+    face_levels = [generate_mips(face, filter) for face in face_stack]
+    return [build_layout(layout_faces(np.stack([levels[index] for levels in face_levels]), "column"), layout)
+            for index in range(len(face_levels[0]))]
+
+
+def _dds_header(width, height, compression, mip_count=1, cubemap=False):
+    """The "DDS " magic and DDS_HEADER for a BC1/BC3 texture, optionally with mips or six cube faces."""
+    block_bytes = 8 if compression == "bc1" else 16
+    linear_size = ((width + 3) // 4) * ((height + 3) // 4) * block_bytes
+    # caps|height|width|pixelformat|linearsize, plus mipmapcount when there is a chain
+    flags = 0x81007 | (0x20000 if mip_count > 1 else 0)
+    caps = 0x1000 | (0x400008 if mip_count > 1 else 0) | (0x8 if cubemap else 0)
+    caps2 = 0xFE00 if cubemap else 0   # DDSCAPS2_CUBEMAP with all six faces
+    header = b"DDS " + struct.pack("<7I44x", 124, flags, height, width, linear_size, 0, mip_count)
+    header += struct.pack("<II4s5I", 32, 0x4, DDSStreamWriter.COMPRESSIONS[compression], 0, 0, 0, 0, 0)
+    header += struct.pack("<5I", caps, caps2, 0, 0, 0)
+    return header
+
+
+def write_dds(path, surfaces, compression="auto", quality="normal", cubemap=False):
+    """
+    Write a DDS texture with a full mip chain, or a cubemap of six chains.
+
+    Args:
+        path (str): Output .dds path
+        surfaces (list): Mip levels (H, W, C), largest first, converted to 8-bit RGBA; for a cubemap,
+                         six such lists in FACE_NAMES order (+X, -X, +Y, -Y, +Z, -Z,
+                         the order DDS stores cube faces in)
+        compression (str): "bc1", "bc3" or "auto" (BC1 unless some texel is transparent)
+        quality (str): Block compressor quality, "fast", "normal" or "high"
+    """
+    chains = surfaces if cubemap else [surfaces]
+    chains = [[to_rgba(convert_pixels(level, np.uint8)) for level in chain] for chain in chains]
+    if compression == "auto":
+        compression = "bc1" if all((chain[0][..., 3] == 255).all() for chain in chains) else "bc3"
+    height, width = chains[0][0].shape[:2]
+    with open(path + ".partial", "wb") as f:
+        f.write(_dds_header(width, height, compression, len(chains[0]), cubemap))
+        for chain in chains:
+            for level in chain:
+                # Levels smaller than a block are padded like the edges of larger ones
+                pad_y, pad_x = -len(level) % 4, -level.shape[1] % 4
+                if pad_y or pad_x:
+                    level = np.pad(level, ((0, pad_y), (0, pad_x), (0, 0)), mode='edge')
+                f.write(compress_bc_blocks(level, compression, quality))
+    os.replace(path + ".partial", path)
+
+
+def avif_available():
+    """True if this Pillow build (or the pillow-avif-plugin package) can write AVIF."""
+    try:
+        if features.check_module("avif"):
+            return True
+    except ValueError:
+        pass  # Pillow older than 11.2 has no built-in AVIF support
+    try:
+        import pillow_avif  # noqa: F401 - registers the AVIF plugin with Pillow
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_encoder(encoder=None, output_path=None):
+    """
+    Turn an encoder choice into a full settings dict with a "format" key.
+
+    Args:
+        encoder: A preset name (see ENCODER_PRESETS), a format name (see ENCODERS),
+                 a dict with a "format" key and any encoder options, or None to
+                 pick the format from output_path's extension (PNG if there is none)
+        output_path (str): Output filename, only used when encoder is None
+
+    Returns:
+        dict: The format's default options overridden by the given ones, e.g.
+              {"format": "png", "compress_level": 6, "filter": "adaptive"}.
+              The format is None for extensions no encoder handles; such files are
+              saved with Pillow's defaults.
+    """
+    if encoder is None:
+        extension = os.path.splitext(output_path or "")[1].lower() or ".png"
+        formats = [name for name, (extensions, _) in ENCODERS.items() if extension in extensions]
+        settings = {"format": formats[0] if formats else None}
+    elif isinstance(encoder, dict):
+        settings = dict(encoder)
+    elif encoder in ENCODER_PRESETS:
+        settings = dict(ENCODER_PRESETS[encoder])
+    else:
+        settings = {"format": encoder}
+
+    image_format = settings.get("format")
+    if image_format is None:
+        return settings
+    if image_format not in ENCODERS:
+        raise ValueError(f"Unknown encoder '{image_format}' (expected a preset ({', '.join(ENCODER_PRESETS)}) "
+                         f"or one of {', '.join(ENCODERS)})")
+    if image_format == "avif" and not avif_available():
+        raise ValueError("AVIF output needs Pillow 11.2+ or the pillow-avif-plugin package")
+    return {"format": image_format, **ENCODERS[image_format][1], **settings}
+
+
+def encoder_extension(encoder=None):
+    """File extension (".png", ".webp", ...) written by an encoder choice."""
+    return ENCODERS[resolve_encoder(encoder)["format"]][0][0]
+
+
+def default_encoder(source_path, encoder=None):
+    """
+    Encoder for outputs made from source_path: encoder itself if given, else "hdr" for .hdr
+    sources, so their radiance is not clipped to 8 bits, else None (PNG).
+    """
+    if encoder is None and source_path.lower().endswith(".hdr"):
+        return "hdr"
+    return encoder
+
+
+def describe_encoder(settings):
+    """One-line summary of resolved encoder settings, for logs and timing output."""
+    options = ", ".join(f"{key}={value}" for key, value in settings.items() if key != "format")
+    return f"{settings['format'] or 'default'}" + (f" ({options})" if options else "")
+
+
+def open_stream_writer(output_path, width, height, mode, settings, opaque=False, dtype=np.uint8):
+    """
+    Strip writer (PNG, DDS, HDR or NPY) configured from resolved encoder settings.
+
+    Args:
+        opaque (bool): The image is known to have no transparency; lets DDS "auto"
+                       compression pick BC1 over BC3
+        dtype: Pixel dtype of the rows to be written; PNG defaults to 16 bits per
+               channel for anything but uint8
+    """
+    if settings["format"] == "png":
+        bit_depth = settings.get("bit_depth", 8 if np.dtype(dtype) == np.uint8 else 16)
+        return PNGStreamWriter(output_path, width, height, mode, compress_level=settings["compress_level"],
+                               filter=settings["filter"], bit_depth=bit_depth)
+    if settings["format"] == "hdr":
+        return HDRStreamWriter(output_path, width, height)
+    if settings["format"] == "npy":
+        return NPYStreamWriter(output_path, width, height, mode, dtype)
+    if settings["format"] == "dds":
+        compression = settings["compression"]
+        if compression == "auto":
+            compression = "bc1" if opaque else "bc3"
+        return DDSStreamWriter(output_path, width, height, compression, settings["quality"])
+    raise ValueError(f"The {settings['format']} encoder cannot stream")
+
+
+def parse_encoder_option(text):
+    """
+    Parse a command-line encoder choice: "<preset or format>[:key=value,...]".
+
+    For example "png:compress_level=9,filter=paeth" or "dds:compression=bc1,quality=high".
+    Numbers and true/false are converted; other values stay strings.
+    """
+    name, _, overrides = text.partition(":")
+    if not overrides:
+        return name
+    settings = dict(ENCODER_PRESETS[name]) if name in ENCODER_PRESETS else {"format": name}
+    for item in overrides.split(","):
+        key, _, value = item.partition("=")
+        if value.lower() in ("true", "false"):
+            value = value.lower() == "true"
+        elif value.lstrip("-").isdigit():
+            value = int(value)
+        settings[key.strip()] = value
+    return settings
+
+
+def save_image(image, output_path, encoder=None):
+    """
+    Save a PIL Image or an (H, W, C) pixel array with the chosen encoder.
+
+    PNG goes through PNGStreamWriter, so the compress level and row filter
+    strategy both apply, and DDS through the BC1/BC3 block compressor; the
+    other formats use Pillow's encoders. JPEG has no alpha channel, so RGBA
+    images are flattened to RGB for it. uint16 and float32 arrays keep their
+    precision in PNG (16-bit), HDR and NPY; other formats get them as 8-bit.
+
+    Args:
+        encoder: Encoder choice, as accepted by resolve_encoder
+
+    Returns:
+        dict: The resolved encoder settings
+    """
+    settings = resolve_encoder(encoder, output_path)
+    image_format = settings["format"]
+    options = {key: value for key, value in settings.items() if key != "format"}
+
+    if image_format == "npy" and not isinstance(image, np.ndarray):
+        image = read_image(image)
+    if isinstance(image, np.ndarray):
+        pixels = image if image.ndim == 3 else image[..., None]
+        height, width, channels = pixels.shape
+        if image_format in ("png", "hdr", "npy"):
+            with open_stream_writer(output_path, width, height, CHANNEL_MODES[channels], settings,
+                                    dtype=pixels.dtype) as writer:
+                writer.write(pixels)
+            return settings
+        image = _output_image(convert_pixels(pixels, np.uint8))
+
+    if image_format is None:
+        image.save(output_path)
+    elif image_format == "png" and image.mode in PNGStreamWriter.COLOR_TYPES:
+        with open_stream_writer(output_path, image.width, image.height, image.mode, settings) as writer:
+            writer.write(np.asarray(image))
+    elif image_format == "dds":
+        pixels = to_rgba(read_image(image))
+        opaque = bool((pixels[..., 3] == 255).all())
+        with open_stream_writer(output_path, image.width, image.height, "RGBA", settings, opaque) as writer:
+            writer.write(pixels)
+    elif image_format == "png":
+        # Modes the streaming writer doesn't cover (palette, 16-bit, ...)
+        image.save(output_path, format="PNG", compress_level=options["compress_level"])
+    else:
+        if image_format == "jpeg" and image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+        image.save(output_path, format=image_format.upper(), **options)
+    return settings
+
+
+# Pixel dtype of the Pillow modes read_image keeps as they are; other modes decode to uint8
+PIL_MODE_DTYPES = {"I;16": np.uint16, "F": np.float32}
+
+
+def _face_header(face):
+    """
+    Size, pixel dtype and channel count of a face without decoding it.
+
+    Returns:
+        tuple: (source, width, height, dtype, channels); source is what read_image should
+               decode: the path for high-precision files, otherwise a lazily opened PIL
+               Image or the array
+    """
+    if isinstance(face, str) and face.lower().endswith(".npy"):
+        face = np.load(face, mmap_mode='r')
+    if isinstance(face, np.ndarray):
+        return face, face.shape[1], face.shape[0], face.dtype, face.shape[2] if face.ndim == 3 else 1
+    if isinstance(face, str):
+        if face.lower().endswith(".hdr"):
+            width, height, _ = read_hdr_header(face)
+            return face, width, height, np.dtype(np.float32), 3
+        if _high_precision_file(face):
+            width, height, _, color_type = _png_header(face)
+            return face, width, height, np.dtype(np.uint16), PNG_CHANNELS[color_type]
+        face = Image.open(face)
+    mode = _decode_mode(face)
+    channels = 1 if mode in PIL_MODE_DTYPES else len(mode)
+    return face, face.width, face.height, np.dtype(PIL_MODE_DTYPES.get(mode, np.uint8)), channels
+
+
+def _face_size(face):
+    """Width of a face read from its header, closing any file _face_header opened for it."""
+    source, width = _face_header(face)[:2]
+    if isinstance(face, str) and isinstance(source, Image.Image):
+        source.close()
+    return width
+
+
+def load_face_stack(faces, workers=6, mode=None, needed=None):
+    """
+    Decode six faces into one (6, S, S, C) stack, in FACE_NAMES order.
+
+    All headers are read and validated before any pixel data is decoded, so a
+    bad face fails fast. The faces are then decoded concurrently on a thread
+    pool (PIL releases the GIL while inflating), and each file is closed as
+    soon as its face is in the stack.
+
+    The stack keeps the faces' precision: it is float32 if any face is (.hdr
+    files, float arrays), else uint16 if any face is (16-bit PNGs), else uint8.
+    It also keeps their channels: L, LA, RGB or RGBA, the smallest set that
+    holds every face (grey faces are expanded only next to colour ones), and
+    an alpha channel that turns out fully opaque is dropped.
+
+    Args:
+        faces (dict): Face name -> path, PIL Image or (S, S[, C]) array; or the path of a
+                      .npy face stack, which is memory-mapped as is (see open_face_stack)
+        workers (int): Number of faces decoded concurrently (default: 6)
+        mode (str): Force the stack's channels to "L", "LA", "RGB" or "RGBA" instead
+        needed (tuple): Names of the faces to decode (default: all). The others are
+                        validated but never decoded, and stay zero in the stack
+
+    Returns:
+        np.ndarray: The face stack; stack[i] is a view of face FACE_NAMES[i]
+    """
+    if mode is not None and mode not in CHANNEL_MODES.values():
+        raise ValueError(f"Unknown mode '{mode}' (expected one of {', '.join(CHANNEL_MODES.values())})")
+    if isinstance(faces, str):
+        stack = open_face_stack(faces)
+        return stack if mode is None else convert_channels(stack, len(mode))
+    missing = [name for name in FACE_NAMES if name not in faces]
+    if missing:
+        raise ValueError(f"Missing cubemap faces: {', '.join(missing)}")
+
+    # Only headers are parsed here; pixel data is read on first access
+    sources = {}
+    try:
+        face_size = None
+        dtypes = set()
+        face_channels = set()
+        for name in FACE_NAMES:
+            sources[name], width, height, dtype, channels = _face_header(faces[name])
+            dtypes.add(dtype)
+            face_channels.add(channels)
+            label = faces[name] if isinstance(faces[name], str) else f"Face '{name}'"
+
+            # Verify all faces are square and same size
+            if width != height:
+                raise ValueError(f"{label} is not square ({width}x{height})")
+            if face_size is None:
+                face_size = width
+            elif width != face_size:
+                raise ValueError(f"Face size mismatch: {label} is {width}x{width}, "
+                                 f"expected {face_size}x{face_size}")
+    except Exception:
+        _close_face_sources(faces, sources)
+        raise
+
+    if any(np.issubdtype(dtype, np.floating) for dtype in dtypes):
+        stack_dtype = np.float32
+    else:
+        stack_dtype = np.uint16 if np.dtype(np.uint16) in dtypes else np.uint8
+    if mode is not None:
+        stack_channels = len(mode)
+    else:
+        stack_channels = (3 if max(face_channels) >= 3 else 1) + any(has_alpha(c) for c in face_channels)
+    if needed is None:
+        needed = FACE_NAMES
+    else:
+        _close_face_sources(faces, {name: sources[name] for name in FACE_NAMES if name not in needed})
+    allocate = np.empty if len(needed) == len(FACE_NAMES) else np.zeros
+    stack = allocate((len(FACE_NAMES), face_size, face_size, stack_channels), dtype=stack_dtype)
+
+    def decode(index, name):
+        try:
+            # Expand grey or add alpha only where another face needs it
+            stack[index] = convert_pixels(convert_channels(read_image(sources[name]), stack_channels), stack_dtype)
+        finally:
+            _close_face_sources(faces, {name: sources[name]})
+
+    workers = max(1, min(workers, len(FACE_NAMES)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first decode error
+        list(pool.map(decode, [FACE_NAMES.index(name) for name in needed], needed))
+
+    if mode is not None:
+        return stack
+    return drop_opaque_alpha(stack, np.array([name in needed for name in FACE_NAMES]))
+
+
+def _close_face_sources(faces, sources):
+    """Close the PIL Images that _face_header opened from paths."""
+    for name, source in sources.items():
+        if isinstance(faces[name], str) and isinstance(source, Image.Image):
+            source.close()
+
+
+def save_face_stack(face_stack, output_path):
+    """
+    Write a (6, S, S, C) face stack as a raw .npy intermediate, at its own precision.
+
+    Nothing is compressed, so the write is a copy; open_face_stack (or
+    np.load(path, mmap_mode='r')) maps it back without decoding anything.
+    """
+    with open(output_path + ".partial", "wb") as f:
+        np.save(f, np.ascontiguousarray(face_stack))
+    os.replace(output_path + ".partial", output_path)
+    print(f"Face stack saved to: {output_path}")
+
+
+def open_face_stack(path):
+    """
+    Memory-map a face stack written by save_face_stack, read-only.
+
+    Returns:
+        np.ndarray: The (6, S, S, C) stack; pages are read from disk as faces are sampled
+    """
+    stack = np.load(path, mmap_mode='r')
+    if stack.ndim != 4 or stack.shape[0] != len(FACE_NAMES) or stack.shape[1] != stack.shape[2]:
+        raise ValueError(f"{path} is not a face stack (expected shape (6, S, S, C), got {stack.shape})")
+    return stack
+
+
+def save_cross(face_stack, output_path, inputs=None, encoder=None, layout="horizontal_cross", mode=None, mips=None,
+               mip_filter="box"):
+    """
+    Write a (6, S, S, C) face stack as a cubemap image, at the stack's precision where the encoder allows.
+
+    The crosses have an alpha channel for their transparent empty cells (see build_layout).
+
+    Args:
+        inputs (dict): Face file records; when given, a manifest is written next to
+                       the cross as stitch_cubemap(incremental=True) would
+        encoder: Output encoder, as accepted by resolve_encoder
+        layout (str): Arrangement of the faces (default: the 4x3 horizontal cross)
+        mode (str): Channel set the faces were requested in (see load_face_stack); the stack
+                    is converted to it if needed, and it is recorded in the manifest
+        mips (str): Also write the cubemap's mip pyramid (see cross_mips): "files" or
+                    "container", as for save_mips. The levels are assembled in memory
+        mip_filter (str): "box" (default) or "kaiser" (see generate_mips)
+    """
+    settings = resolve_encoder(encoder, output_path)
+    if mode is not None and face_stack.shape[-1] != len(mode):
+        face_stack = convert_channels(face_stack, len(mode))
+    layout = resolve_layout(layout)
+    columns, rows, positions = SOURCE_LAYOUTS[layout]
+    face_size = face_stack.shape[1]
+    if mips is not None:
+        levels = cross_mips(face_stack, layout, mip_filter)
+        save_mips(levels, output_path, settings, mips)
+    elif settings["format"] not in STREAM_FORMATS:
+        save_image(build_layout(layout_faces(face_stack, "column"), layout), output_path, settings)
+    else:
+        # Streamed one row of faces at a time, so the full cubemap is never assembled in memory
+        channels = face_stack.shape[-1]
+        if columns * rows > len(FACE_NAMES) and not has_alpha(channels):
+            channels += 1
+        with open_stream_writer(output_path, columns * face_size, rows * face_size, CHANNEL_MODES[channels],
+                                settings, dtype=face_stack.dtype) as writer:
+            strip = np.empty((face_size, columns * face_size, channels), dtype=face_stack.dtype)
+            for row in range(rows):
+                strip[...] = 0
+                for name, face in layout_faces(face_stack, "column").items():
+                    col, face_row = positions[name]
+                    if face_row == row:
+                        if name in ROTATED_FACES.get(layout, ()):
+                            face = face[::-1, ::-1]
+                        strip[:, col * face_size:(col + 1) * face_size] = convert_channels(face, channels)
+                writer.write(strip)
+    print(f"Cubemap saved to: {output_path} [{describe_encoder(settings)}"
+          + (f", {len(levels) - 1} mip levels]" if mips is not None else "]"))
+    if inputs is not None:
+        params = _cross_manifest_params(settings, layout, mode, mips, mip_filter)
+        _write_manifest(output_path, inputs, params, _combined_digest(inputs, params))
+
+
+def _image_layout(width, height, layout=None):
+    """(layout, face_size) of a width x height cubemap image, detected unless layout is given."""
+    if layout is None:
+        return detect_layout(width, height)
+    layout = resolve_layout(layout)
+    columns, rows, _ = SOURCE_LAYOUTS[layout]
+    if width % columns or width // columns * rows != height:
+        raise ValueError(f"A {width}x{height} image is not a {layout} layout")
+    return layout, width // columns
+
+
+def cubemap_to_panorama(cubemap_image, output_path="panorama.png", pano_width=4096, pano_height=None, hemisphere_only=False,
+                        method="vectorized", plan_cache_dir=None, filter="nearest", ssaa=1, ssaa_jitter=False,
+                        strip_rows=None, max_memory_mb=DEFAULT_MAX_MEMORY_MB, workers=1, incremental=False,
+                        cross_output=None, timings=None, stream=True, encoder=None, mips=None, mip_filter="box",
+                        stack_output=None, mode=None, layout=None, cross_layout="horizontal_cross",
+                        projection="equirect", orientation=None, lat_range=None, lon_range=None, use_plan=False):
+    """
+    Convert a cubemap to an equirectangular panorama (or another sphere projection).
+
+    Args:
+        cubemap_image: The cubemap, as any of:
+                       - a PIL Image of the cubemap in any layout, or a path to the file
+                       - a dict of face name -> path, PIL Image or array for the six faces
+                       - a (6, S, S, C) face stack array in FACE_NAMES order (or a cubemap array)
+                       - a path to a .npy face stack or cross (see save_face_stack), which
+                         is memory-mapped instead of decoded
+                       Faces are projected directly; no cross is built for them
+        output_path (str): Output filename for the panorama (default: "panorama.png")
+        pano_width (int): Width of the output panorama (default: 4096)
+        pano_height (int): Height of the output panorama (default: pano_width/2, or pano_width/4 if hemisphere_only;
+                           see default_projection_height for the other projections)
+        hemisphere_only (bool): If True, only generate the top hemisphere (upper half of cubemap)
+        method (str): "vectorized" (default) or "reference" for the original per-pixel loop,
+                      which produces identical output and is kept for testing
+        plan_cache_dir (str): Optional directory for saved projection plans, so repeated
+                              conversions at the same size only pay for the gather
+        use_plan (bool): Build a projection plan and keep it in the in-process LRU, for
+                         callers converting several same-size cubemaps in one process
+                         (run_batch does this for more than one set). Off by default:
+                         a plan is O(width x height), so a one-shot conversion is
+                         cheaper rendered on the fly
+        filter (str): "nearest" (default), "bilinear" or "bicubic"; filter taps that cross
+                      a face edge are read from the neighbouring face instead of clamped
+        ssaa (int): Supersampling factor; ssaa x ssaa samples are averaged per output pixel
+                    (default: 1, no supersampling)
+        ssaa_jitter (bool): Jitter the supersampling pattern instead of a regular grid
+        strip_rows (int): Output rows rendered per strip (default: derived from max_memory_mb)
+        max_memory_mb (float): Working-memory budget of the projection engine (default: 512).
+                               With use_plan, a projection plan is only built and kept if
+                               it fits in this budget, and the strips get the rest of it
+        workers (int): Number of processes rendering row bands in parallel (default: 1);
+                       the output is identical for any worker count
+        incremental (bool): Keep a manifest (<output_path>.manifest.json) of the source cubemap
+                            and conversion parameters and skip the projection when output_path
+                            is already up to date
+        cross_output (str): When converting separate faces, also write them as a cubemap
+                            in cross_layout to this path; the image is encoded on a background
+                            thread while the projection runs
+        timings (dict): Optional dict that receives the seconds spent per stage, and the
+                        encoder settings under "encoder"
+        stream (bool): Encode PNG output strip by strip while it is rendered (default: True),
+                       so the full panorama is never held in memory; the returned image is
+                       then opened lazily from output_path
+        encoder: Encoder for the panorama and cross: a preset ("fast-iterate", "ship",
+                 "archive"), a format ("png", "webp", "jpeg", "avif", "dds", "hdr") or a
+                 settings dict; by default each output's format follows its own extension, so
+                 output_path and cross_output may differ (see resolve_encoder). PNG output of a
+                 uint16/float32 cubemap is 16-bit
+        mips (str): Also write the panorama's mip pyramid: "files" saves level n as
+                    <stem>_mip<n><ext>, "container" embeds the chain in DDS output.
+                    Mips wrap at the longitude seam; they need the whole panorama in
+                    memory, so streaming is off when they are requested. The
+                    cross_output cubemap gets its own mips (see cross_mips)
+        mip_filter (str): "box" (default) or "kaiser" (see generate_mips)
+        stack_output (str): When converting separate faces, also write the decoded face
+                            stack as a raw .npy intermediate (see save_face_stack) whenever
+                            the projection runs, so later steps can skip the decode
+        mode (str): Channels of the panorama: "L", "LA", "RGB" or "RGBA". By default the
+                    source's channels are kept, minus an alpha channel that is opaque
+                    over every face (a cross's transparent padding is never sampled),
+                    so opaque RGB skies are projected and encoded without alpha
+        layout (str): Arrangement of the faces in a cubemap image or array: a SOURCE_LAYOUTS
+                      key or LAYOUT_ALIASES short name (4x3, 3x4, 6x1, 1x6, 3x2). By default
+                      it is detected from the aspect ratio (see detect_layout). The faces
+                      are sampled where they lie; no face stack is copied out
+        cross_layout (str): Layout of cross_output (default: the 4x3 horizontal cross)
+        projection (str): Output projection, one of PROJECTIONS: "equirect" (default),
+                          "eac" (equi-angular faces in the 3x2 grid layout), "octahedral",
+                          "fisheye" (a 180 degree dome master with hemisphere_only, else
+                          the whole sphere; pixels outside the circle are zero) or
+                          "cylindrical". All share the face selection and filters of
+                          the equirect path, and plans are cached per projection
+        orientation: Rotation of the sky, so its north matches the game world: (yaw, pitch,
+                     roll) in degrees or a 3x3 matrix (see orientation_matrix). It rotates
+                     the view directions before face selection and is baked into the
+                     projection plan, so it costs no extra resampling pass
+        lat_range (tuple): Render only this (min, max) latitude band in degrees, e.g.
+                           (-10, 90) for a sky band (equirect only; default: all)
+        lon_range (tuple): Render only this (min, max) longitude range in degrees, 0 being
+                           the panorama's left edge (default: all). With either range,
+                           pano_width and pano_height give the full sphere's resolution and
+                           the output covers just the window at that resolution. Separate
+                           faces the window cannot sample are not decoded at all (as is
+                           "down" with hemisphere_only)
+
+    Returns:
+        PIL.Image: The equirectangular panorama image, or an (H, W, C) uint16/float32
+                   array when the cubemap is high precision (16-bit PNG, .hdr, arrays)
+
+    The standard cubemap layout is the horizontal cross:
+        [ ][ U ][ ][ ]
+        [ L ][ F ][ R ][ B ]
+        [ ][ D ][ ][ ]
+    """
+
+    if method not in ("vectorized", "reference"):
+        raise ValueError(f"Unknown method '{method}' (expected 'vectorized' or 'reference')")
+    if filter not in FILTERS:
+        raise ValueError(f"Unknown filter '{filter}' (expected one of {', '.join(FILTERS)})")
+    if method == "reference" and filter != "nearest":
+        raise ValueError("The reference method only supports nearest sampling")
+    if ssaa < 1 or (method == "reference" and ssaa != 1):
+        raise ValueError(f"Invalid ssaa factor {ssaa} for method '{method}'")
+    settings = resolve_encoder(encoder, output_path)
+    if mips not in (None, "files", "container"):
+        raise ValueError(f"Unknown mips mode '{mips}' (expected 'files' or 'container')")
+    cross_settings = resolve_encoder(encoder, cross_output) if cross_output is not None else None
+    if mips == "container" and (settings["format"] != "dds"
+                                or (cross_settings is not None and cross_settings["format"] != "dds")):
+        raise ValueError("Mip chains can only be embedded in DDS output")
+    if mips is not None and mip_filter not in MIP_FILTERS:
+        raise ValueError(f"Unknown mip filter '{mip_filter}' (expected one of {', '.join(MIP_FILTERS)})")
+    if mode is not None and mode not in CHANNEL_MODES.values():
+        raise ValueError(f"Unknown mode '{mode}' (expected one of {', '.join(CHANNEL_MODES.values())})")
+    if projection not in PROJECTIONS:
+        raise ValueError(f"Unknown projection '{projection}' (expected one of {', '.join(PROJECTIONS)})")
+    if method == "reference" and projection != "equirect":
+        raise ValueError("The reference method only renders equirect panoramas")
+    orientation = orientation_matrix(orientation)
+    if method == "reference" and orientation is not None:
+        raise ValueError("The reference method does not support orientation")
+    window = panorama_window(lat_range, lon_range)
+    if window is not None and (projection != "equirect" or hemisphere_only or method == "reference"):
+        raise ValueError("Latitude/longitude windows need vectorized equirect output without hemisphere_only")
+    if hemisphere_only and projection in ("eac", "octahedral"):
+        raise ValueError(f"The {projection} projection always covers the whole sphere")
+    cross_layout = resolve_layout(cross_layout)
+    if timings is None:
+        timings = {}
+    timings["encoder"] = describe_encoder(settings)
+    stage_start = time.perf_counter()
+
+    # Raw .npy intermediates (a face stack or a cross) are memory-mapped rather than decoded
+    source_path = None
+    if isinstance(cubemap_image, str) and cubemap_image.lower().endswith(".npy"):
+        source_path, cubemap_image = cubemap_image, np.load(cubemap_image, mmap_mode='r')
+
+    # Work out what we were given: separate faces (a face stack) or a cubemap image in some layout
+    cubemap = None
+    face_files = None
+    if isinstance(cubemap_image, dict):
+        layout = "column"
+        face_size = _face_size(cubemap_image[FACE_NAMES[0]])
+        if all(isinstance(cubemap_image.get(name), str) for name in FACE_NAMES):
+            face_files = {name: cubemap_image[name] for name in FACE_NAMES}
+    elif isinstance(cubemap_image, np.ndarray) and cubemap_image.ndim == 4:
+        layout = "column"
+        face_size = cubemap_image.shape[-2]
+    elif isinstance(cubemap_image, np.ndarray):
+        layout, face_size = _image_layout(cubemap_image.shape[1], cubemap_image.shape[0], layout)
+    else:
+        # Load cubemap if it's a path (high-precision files are decoded straight to an array)
+        if isinstance(cubemap_image, str):
+            cubemap = _open_output(cubemap_image)
+        else:
+            cubemap = cubemap_image
+
+        # Face size and layout follow from the image size unless the layout is given
+        width, height = (cubemap.shape[1], cubemap.shape[0]) if isinstance(cubemap, np.ndarray) else cubemap.size
+        layout, face_size = _image_layout(width, height, layout)
+
+    if cross_output is not None and layout != "column":
+        raise ValueError("cross_output is only supported when converting separate faces")
+    if stack_output is not None and layout != "column":
+        raise ValueError("stack_output is only supported when converting separate faces")
+
+    # Default panorama height (quarter of the width for a hemisphere, half for the full sphere)
+    if pano_height is None:
+        pano_height = default_projection_height(projection, pano_width, hemisphere_only)
+    pano_width, pano_height = window_size(pano_width, pano_height, window)
+
+    # Only decode the faces the output can sample; the others stay zero in the stack
+    needed = FACE_NAMES
+    if (isinstance(cubemap_image, dict) and projection == "equirect" and orientation is None
+            and cross_output is None and stack_output is None):
+        needed = window_faces(window if window is not None else _hemisphere_window(hemisphere_only),
+                              face_size, pano_width, pano_height, filter)
+
+    # Skip the projection if neither the cubemap nor the parameters changed since the last run
+    write_cross = cross_output is not None
+    face_stack = None
+    if incremental:
+        manifest = _load_manifest(output_path)
+        known = manifest.get("inputs", {}) if manifest else {}
+        inputs = {}
+        if face_files is not None:
+            inputs = {path: _file_record(path, known.get(path)) for path in face_files.values()}
+            source_digest = _combined_digest(inputs, {})
+        elif source_path is not None:
+            inputs[source_path] = _file_record(source_path, known.get(source_path))
+            source_digest = inputs[source_path]["sha256"]
+        elif isinstance(cubemap_image, str):
+            inputs[cubemap_image] = _file_record(cubemap_image, known.get(cubemap_image))
+            source_digest = inputs[cubemap_image]["sha256"]
+        elif isinstance(cubemap, Image.Image) and "source_digest" in cubemap.info:
+            # Stitched by stitch_cubemap(incremental=True): identified by its face hashes
+            source_digest = cubemap.info["source_digest"]
+        elif cubemap is not None:
+            source_digest = hashlib.sha256(cubemap.tobytes()).hexdigest()
+        elif isinstance(cubemap_image, dict):
+            # Faces given as images or arrays are identified by their pixels; the decoded
+            # stack is kept for the projection (or the cross) so they are decoded only once
+            face_stack = load_face_stack(cubemap_image, mode=mode, needed=needed)
+            source_digest = hashlib.sha256(face_stack.tobytes()).hexdigest()
+        else:
+            source_digest = hashlib.sha256(np.ascontiguousarray(cubemap_image).tobytes()).hexdigest()
+        params = {"source": source_digest, "pano_width": pano_width, "pano_height": pano_height,
+                  "hemisphere_only": hemisphere_only, "filter": filter, "ssaa": ssaa, "ssaa_jitter": ssaa_jitter,
+                  "encoder": settings, "mips": mips, "mip_filter": mip_filter if mips else None, "mode": mode,
+                  "layout": layout, "projection": projection,
+                  "orientation": list(orientation) if orientation is not None else None,
+                  "window": list(window) if window is not None else None}
+
+        if write_cross and face_files is not None:
+            write_cross = not _manifest_is_current(_load_manifest(cross_output), cross_output, inputs,
+                                                   _cross_manifest_params(cross_settings, cross_layout, mode,
+                                                                          mips, mip_filter))
+            if not write_cross:
+                print(f"Cubemap up to date, skipping cross: {cross_output}")
+        if _manifest_is_current(manifest, output_path, inputs, params):
+            if write_cross:
+                if face_stack is None:
+                    face_stack = load_face_stack(cubemap_image, mode=mode)
+                save_cross(face_stack, cross_output, inputs, cross_settings, cross_layout, mode, mips,
+                           mip_filter)
+            print(f"Panorama up to date, skipping projection: {output_path}")
+            return _open_output(output_path)
+
+    # Decode the source into an array at its native precision
+    if cubemap is not None:
+        cubemap_array = read_image(cubemap)
+        if mode is None:
+            # A cross's empty cells are transparent; only the faces decide whether alpha is needed
+            face_cells = build_layout({name: np.ones((face_size, face_size, 1), dtype=bool) for name in FACE_NAMES},
+                                      layout, alpha=False)[..., 0]
+            cubemap_array = drop_opaque_alpha(cubemap_array, face_cells)
+    elif isinstance(cubemap_image, dict):
+        if len(needed) < len(FACE_NAMES):
+            print("Skipping faces the output never samples: "
+                  + ", ".join(name for name in FACE_NAMES if name not in needed))
+        cubemap_array = face_stack if face_stack is not None else load_face_stack(cubemap_image, mode=mode,
+                                                                                     needed=needed)
+    else:
+        cubemap_array = cubemap_image
+    if mode is not None:
+        cubemap_array = convert_channels(cubemap_array, len(mode))
+    channels = cubemap_array.shape[-1]
+    timings["load"] = time.perf_counter() - stage_start
+    if stack_output is not None:
+        stage_start = time.perf_counter()
+        save_face_stack(cubemap_array, stack_output)
+        timings["stack"] = time.perf_counter() - stage_start
+
+    # Encode the optional cross in the background while the projection runs. Worker processes
+    # must not be forked while that thread may hold a lock (zlib, PIL, a file), so parallel
+    # renders start it once their pool is done; it then overlaps the panorama's save
+    cross_pool = cross_future = None
+    if write_cross:
+        cross_pool = ThreadPoolExecutor(max_workers=1)
+        cross_args = (save_cross, cubemap_array, cross_output,
+                      inputs if incremental and face_files is not None else None,
+                      cross_settings, cross_layout, mode, mips, mip_filter)
+        if workers == 1 or method == "reference":
+            cross_future = cross_pool.submit(*cross_args)
+
+    try:
+        stage_start = time.perf_counter()
+        if projection == "equirect":
+            print(f"Converting cubemap to panorama ({pano_width}x{pano_height})...")
+        else:
+            print(f"Converting cubemap to {projection} projection ({pano_width}x{pano_height})...")
         if hemisphere_only:
-            pano_output = base_path + "pano_hemisphere.png"
+            print("Hemisphere mode: Only rendering top half (sky)")
+
+        if ssaa > 1:
+            print(f"Supersampling: {ssaa}x{ssaa} samples per pixel")
+
+        writer = None
+        if method == "reference":
+            if layout != "horizontal_cross":
+                cubemap_array = build_cross(layout_faces(cubemap_array, layout), alpha=False)
+            panorama = _panorama_reference(cubemap_array, face_size, pano_width, pano_height, hemisphere_only)
+        else:
+            if stream and mips is None and settings["format"] in STREAM_FORMATS:
+                # Interpolating opaque texels gives opaque pixels, so the source decides BC1 vs BC3
+                opaque = (settings["format"] == "dds" and settings["compression"] == "auto"
+                          and (not has_alpha(channels)
+                               or (projection != "fisheye"
+                                   and bool((cubemap_array[..., -1] >= _opaque_alpha(cubemap_array.dtype)).all()))))
+                writer = open_stream_writer(output_path, pano_width, pano_height, CHANNEL_MODES[channels], settings,
+                                            opaque, cubemap_array.dtype)
+
+            # Plans pay off for repeated conversions but are O(width x height) themselves.
+            # Parallel renders share a plan's tables with the workers as memory-mapped files
+            plan = None
+            plan_fits = estimate_plan_nbytes(pano_width, pano_height, filter) <= max_memory_mb * (1 << 20)
+            if ssaa == 1 and (plan_cache_dir is not None or (use_plan and plan_fits)):
+                plan = get_projection_plan(face_size, pano_width, pano_height, hemisphere_only, filter,
+                                           cache_dir=plan_cache_dir, max_memory_mb=max_memory_mb, layout=layout,
+                                           projection=projection, orientation=orientation, window=window)
+
+            if workers > 1:
+                print(f"Rendering with {workers} worker processes")
+                render = render_panorama_parallel
+                render_args = (plan, workers, max_memory_mb, layout, projection, orientation, window)
+            else:
+                render = _render_panorama_serial
+                render_args = (plan, strip_rows, max_memory_mb, layout, projection, orientation, window)
+            try:
+                panorama = render(cubemap_array, face_size, pano_width, pano_height, hemisphere_only, filter,
+                                  ssaa, ssaa_jitter, *render_args, writer=writer)
+                if writer is not None:
+                    writer.close()
+            except BaseException:
+                if writer is not None:
+                    writer.abort()
+                raise
+            if cross_pool is not None and cross_future is None:
+                cross_future = cross_pool.submit(*cross_args)
+
+        if writer is not None:
+            # Encoding overlapped the projection; report the two shares separately
+            timings["project"] = time.perf_counter() - stage_start - writer.encode_seconds
+            timings["save"] = writer.encode_seconds
+            panorama_image = _open_output(output_path)
+        else:
+            timings["project"] = time.perf_counter() - stage_start
+
+            # Convert back to PIL Image (uint16/float32 panoramas stay arrays)
+            panorama_image = _output_image(panorama)
+            if mips is not None:
+                stage_start = time.perf_counter()
+                levels = generate_mips(panorama, mip_filter, wrap_x=projection in ("equirect", "cylindrical")
+                                       and (window is None or window[3] - window[2] == 360))
+                timings["mips"] = time.perf_counter() - stage_start
+                print(f"Generated {len(levels) - 1} mip levels ({mip_filter} filter)")
+
+            stage_start = time.perf_counter()
+            if mips is not None:
+                save_mips(levels, output_path, settings, mips)
+            else:
+                save_image(panorama, output_path, settings)
+            timings["save"] = time.perf_counter() - stage_start
+        print(f"Panorama saved to: {output_path} [{timings['encoder']}, {timings['save']:.2f}s]")
+    finally:
+        if cross_pool is not None:
+            # Only the time spent waiting for the background encode is on the critical path
+            stage_start = time.perf_counter()
+            cross_pool.shutdown(wait=True)
+            timings["cross_wait"] = time.perf_counter() - stage_start
+    if cross_future is not None:
+        cross_future.result()
+
+    if incremental:
+        _write_manifest(output_path, inputs, params, _combined_digest(inputs, params))
+
+    return panorama_image
+
+
+def load_cubemap_array(cubemap_image, layout=None, mode=None):
+    """
+    Decode a cubemap given in any form cubemap_to_panorama accepts, ready for the projection engine.
+
+    Args:
+        cubemap_image: A path, PIL Image or array of a cubemap in any layout, a dict of
+                       six faces, a (6, S, S, C) face stack or a .npy path to either
+        layout (str): Layout of a cubemap image (default: detected from its aspect ratio)
+        mode (str): Channels to convert to (default: the source's, minus opaque alpha)
+
+    Returns:
+        tuple: (cubemap_array, layout, face_size); separate faces give a "column" stack
+    """
+    if isinstance(cubemap_image, dict):
+        cubemap_array = load_face_stack(cubemap_image, mode=mode)
+        layout = "column"
+    else:
+        if isinstance(cubemap_image, str) and cubemap_image.lower().endswith(".npy"):
+            cubemap_image = np.load(cubemap_image, mmap_mode='r')
+        if isinstance(cubemap_image, np.ndarray) and cubemap_image.ndim == 4:
+            cubemap_array = cubemap_image
+            layout = "column"
+        else:
+            cubemap_array = read_image(cubemap_image)
+            layout, face_size = _image_layout(cubemap_array.shape[1], cubemap_array.shape[0], layout)
+            if mode is None:
+                # A cross's empty cells are transparent; only the faces decide whether alpha is needed
+                face_cells = build_layout({name: np.ones((face_size, face_size, 1), dtype=bool)
+                                           for name in FACE_NAMES}, layout, alpha=False)[..., 0]
+                cubemap_array = drop_opaque_alpha(cubemap_array, face_cells)
+    if mode is not None:
+        cubemap_array = convert_channels(cubemap_array, len(mode))
+    columns = SOURCE_LAYOUTS[layout][0]
+    face_size = cubemap_array.shape[-2] if cubemap_array.ndim == 4 else cubemap_array.shape[1] // columns
+    return cubemap_array, layout, face_size
+
+
+def view_directions(yaw, pitch, fov, width, height, roll=0.0):
+    """
+    View directions through the pixel centres of a pinhole camera.
+
+    Args:
+        yaw (float): Heading in degrees, as the panorama's longitude: 0 looks at the
+                     front face (+z) and 90 at the right face (+x)
+        pitch (float): Elevation in degrees, positive up
+        fov (float): Horizontal field of view in degrees (below 180)
+        width, height (int): Image size; the vertical field of view follows the aspect ratio
+        roll (float): Camera roll in degrees (see orientation_matrix)
+
+    Returns:
+        tuple: (cart_x, cart_y, cart_z) float64 arrays of shape (height, width), not normalized
+    """
+    if not 0 < fov < 180:
+        raise ValueError(f"Field of view must be between 0 and 180 degrees, got {fov}")
+    # The camera frame is the orientation's image of the front view: right +x, up +y, forward +z
+    frame = orientation_matrix((yaw, pitch, roll))
+    right, up, forward = np.eye(3) if frame is None else np.array(frame).reshape(3, 3).T
+
+    # Image plane at distance 1: x spans tan(fov / 2) each way, y the same scale
+    half_width = math.tan(math.radians(fov) / 2)
+    a = ((np.arange(width) + 0.5) * (2.0 / width) - 1) * half_width
+    b = (1 - (np.arange(height) + 0.5) * (2.0 / height)) * half_width * height / width
+    return tuple(forward[i] + a[None, :] * right[i] + b[:, None] * up[i] for i in range(3))
+
+
+def render_views(cubemap_image, views=None, width=512, height=288, output_base=None, filter="bilinear",
+                 layout=None, encoder=None, mode=None):
+    """
+    Render perspective views of a cubemap, decoding it once for all of them.
+
+    Each view is ray-cast straight into the cube faces with the face selection
+    and filters of cubemap_to_panorama, vectorized over the output pixels, so
+    previews cost milliseconds instead of a full panorama render.
+
+    Args:
+        cubemap_image: The cubemap, in any form load_cubemap_array accepts
+        views (dict): Name -> (yaw, pitch, fov) in degrees (default: VIEW_PRESETS);
+                      see view_directions for the angles
+        width, height (int): Size of every view (default: 512x288)
+        output_base (str): When given, view <name> is saved as <output_base><name><ext>
+                           with the extension of the encoder (default: PNG)
+        filter (str): "nearest", "bilinear" (default) or "bicubic"
+        layout (str): Layout of a cubemap image (default: detected from its aspect ratio)
+        encoder: Output encoder, as accepted by resolve_encoder
+        mode (str): Channels of the views (default: the cubemap's, minus opaque alpha)
+
+    Returns:
+        dict: View name -> PIL.Image (uint16/float32 arrays for a high-precision cubemap)
+    """
+    if filter not in FILTERS:
+        raise ValueError(f"Unknown filter '{filter}' (expected one of {', '.join(FILTERS)})")
+    if views is None:
+        views = VIEW_PRESETS
+    cubemap_array, layout, face_size = load_cubemap_array(cubemap_image, layout, mode)
+    source = flatten_source(cubemap_array, face_size, layout)
+
+    images = {}
+    for name, (yaw, pitch, fov) in views.items():
+        face, u, v = select_faces(*view_directions(yaw, pitch, fov, width, height))
+        view = np.empty((height, width, source.shape[1]), dtype=source.dtype)
+        gather_taps(source, *sample_taps(face, u, v, face_size, filter, layout), view.reshape(-1, source.shape[1]))
+        images[name] = _output_image(view)
+        if output_base is not None:
+            view_path = f"{output_base}{name}{encoder_extension(encoder)}"
+            settings = save_image(view, view_path, encoder)
+            print(f"View saved to: {view_path} [{describe_encoder(settings)}]")
+    return images
+
+
+def render_view(cubemap_image, yaw=0.0, pitch=0.0, fov=90.0, width=512, height=288, output_path=None,
+                filter="bilinear", layout=None, encoder=None, mode=None):
+    """
+    Render one perspective view of a cubemap (see render_views).
+
+    Args:
+        yaw, pitch, fov (float): Camera heading, elevation and horizontal field of view
+                                 in degrees (see view_directions)
+        output_path (str): Optional path to save the view to
+
+    Returns:
+        PIL.Image: The view (a uint16/float32 array for a high-precision cubemap)
+    """
+    view = render_views(cubemap_image, {"view": (yaw, pitch, fov)}, width, height, None, filter, layout,
+                        mode=mode)["view"]
+    if output_path is not None:
+        settings = save_image(view, output_path, encoder)
+        print(f"View saved to: {output_path} [{describe_encoder(settings)}]")
+    return view
+
+
+def face_directions(face, face_size, rows=None):
+    """
+    View directions through the texel centres of one cube face.
+
+    The inverse of select_faces: direction = normal + u * u_axis + v * v_axis
+    from FACE_BASIS, so faces produced from these directions project back onto
+    the same texels.
+
+    Args:
+        face (int): Index into FACE_NAMES
+        face_size (int): Edge length of the face in pixels
+        rows (tuple): Optional (start, stop) range of face rows
+
+    Returns:
+        tuple: (cart_x, cart_y, cart_z) float64 arrays of shape (rows, face_size), not normalized
+    """
+    row_start, row_stop = rows if rows is not None else (0, face_size)
+    u = (np.arange(face_size) + 0.5) * (2.0 / face_size) - 1
+    v = (np.arange(row_start, row_stop) + 0.5) * (2.0 / face_size) - 1
+    normal, u_axis, v_axis = FACE_BASIS[face]
+    return tuple(normal[i] + u[None, :] * u_axis[i] + v[:, None] * v_axis[i] for i in range(3))
+
+
+def _panorama_taps(cart_x, cart_y, cart_z, pano_width, pano_height, hemisphere_only=False, filter="nearest"):
+    """
+    Source pixels and separable weights for sampling an equirect panorama along directions.
+
+    Inverts the mapping of PanoramaGrid (pixel x sits at longitude x / width * 2π),
+    wraps horizontally across the seam and clamps vertically.
+
+    Returns:
+        tuple: (indices, weights_x, weights_y) in the same form as sample_taps
+    """
+    if filter not in FILTERS:
+        raise ValueError(f"Unknown filter '{filter}' (expected one of {', '.join(FILTERS)})")
+
+    cart_x = cart_x.ravel()
+    cart_y = cart_y.ravel()
+    cart_z = cart_z.ravel()
+    theta = np.arctan2(cart_x, cart_z) % (2 * math.pi)
+    phi = np.arctan2(cart_y, np.hypot(cart_x, cart_z))
+
+    px = theta / (2 * math.pi) * pano_width
+    if hemisphere_only:
+        py = (1 - phi / (math.pi / 2)) * pano_height
+    else:
+        py = (math.pi / 2 - phi) / math.pi * pano_height
+
+    def index(x, y):
+        x = np.mod(x, pano_width)
+        y = np.clip(y, 0, pano_height - 1)
+        index_dtype = np.int32 if pano_width * pano_height < 2 ** 31 else np.int64
+        return (y * pano_width + x).astype(index_dtype)
+
+    if filter == "nearest":
+        return index(np.floor(px + 0.5).astype(np.intp), np.floor(py + 0.5).astype(np.intp))[None], None, None
+
+    x0 = np.floor(px)
+    y0 = np.floor(py)
+    fx = (px - x0).astype(np.float32)
+    fy = (py - y0).astype(np.float32)
+    x0 = x0.astype(np.intp)
+    y0 = y0.astype(np.intp)
+
+    if filter == "bilinear":
+        offsets = (0, 1)
+        weights_x = np.stack([1 - fx, fx])
+        weights_y = np.stack([1 - fy, fy])
+    else:
+        offsets = (-1, 0, 1, 2)
+        weights_x = _cubic_weights(fx)
+        weights_y = _cubic_weights(fy)
+
+    indices = np.stack([index(x0 + dx, y0 + dy) for dy in offsets for dx in offsets])
+    return indices, weights_x, weights_y
+
+
+def render_face(panorama_array, face, face_size, hemisphere_only=False, filter="bilinear", max_memory_mb=None):
+    """
+    Resample one cube face from an equirect panorama array, a strip of rows at a time.
+
+    Returns:
+        np.ndarray: The (face_size, face_size, C) face
+    """
+    pano_height, pano_width, channels = panorama_array.shape
+    source = np.ascontiguousarray(panorama_array).reshape(-1, channels)
+    face_array = np.empty((face_size, face_size, channels), dtype=panorama_array.dtype)
+
+    strip_rows = strip_rows_for_budget(face_size, channels, filter, 1,
+                                       DEFAULT_MAX_MEMORY_MB if max_memory_mb is None else max_memory_mb,
+                                       source.itemsize)
+    for row_start in range(0, face_size, strip_rows):
+        row_stop = min(face_size, row_start + strip_rows)
+        directions = face_directions(face, face_size, (row_start, row_stop))
+        taps = _panorama_taps(*directions, pano_width, pano_height, hemisphere_only, filter)
+        gather_taps(source, *taps, face_array[row_start:row_stop].reshape(-1, channels))
+
+    return face_array
+
+
+def resolve_layout(layout):
+    """The SOURCE_LAYOUTS key of a layout name or short name ("4x3", "6x1", "3x2", ...)."""
+    layout = LAYOUT_ALIASES.get(layout, layout)
+    if layout not in SOURCE_LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}' (expected one of "
+                         f"{', '.join(list(SOURCE_LAYOUTS) + list(LAYOUT_ALIASES))})")
+    return layout
+
+
+def detect_layout(width, height):
+    """
+    Work out the layout of a cubemap image from its aspect ratio.
+
+    Every layout has a distinct ratio (4:3, 3:4, 6:1, 1:6, 3:2), so the size
+    alone identifies it.
+
+    Returns:
+        tuple: (layout, face_size)
+    """
+    for layout, (columns, rows, _) in SOURCE_LAYOUTS.items():
+        if width % columns == 0 and width // columns * rows == height and width:
+            return layout, width // columns
+    raise ValueError(f"Cannot detect the cubemap layout of a {width}x{height} image (expected the aspect "
+                     f"ratio of one of {', '.join(LAYOUT_ALIASES)}); pass the layout explicitly")
+
+
+def layout_faces(cubemap_array, layout):
+    """
+    Views of the six faces in a cubemap array with the given layout.
+
+    Nothing is copied: each face is a slice of cubemap_array (reversed on both
+    axes for faces the layout stores rotated), so faces of a memory-mapped
+    cubemap are only read when used. A (6, S, S, C) face stack is a "column".
+
+    Returns:
+        dict: Face name -> (S, S, C) array view
+    """
+    columns, rows, positions = SOURCE_LAYOUTS[layout]
+    if cubemap_array.ndim == 4:
+        cubemap_array = cubemap_array.reshape((-1,) + cubemap_array.shape[2:])
+    face_size = cubemap_array.shape[1] // columns
+    if cubemap_array.shape[:2] != (rows * face_size, columns * face_size):
+        raise ValueError(f"Cubemap array of shape {cubemap_array.shape} does not match a {layout} layout")
+    faces = {}
+    for name in FACE_NAMES:
+        col, row = positions[name]
+        face = cubemap_array[row * face_size:(row + 1) * face_size, col * face_size:(col + 1) * face_size]
+        faces[name] = face[::-1, ::-1] if name in ROTATED_FACES.get(layout, ()) else face
+    return faces
+
+
+def build_layout(face_arrays, layout="horizontal_cross", alpha=True):
+    """
+    Assemble six (S, S, C) face arrays, keyed by face name, in the given layout.
+
+    Cells without a face (the crosses have six) are left transparent (zero). For
+    that the cubemap gets an alpha channel (L faces give LA, RGB faces RGBA) unless
+    alpha is False, in which case the faces' channels are kept and the empty cells
+    are black. The strips and the grid have no empty cells and keep the faces' channels.
+    """
+    columns, rows, positions = SOURCE_LAYOUTS[layout]
+    first = face_arrays[FACE_NAMES[0]]
+    face_size = first.shape[0]
+    channels = first.shape[2]
+    if alpha and columns * rows > len(FACE_NAMES) and not has_alpha(channels):
+        channels += 1
+    cubemap = np.zeros((rows * face_size, columns * face_size, channels), dtype=first.dtype)
+    for name, face in layout_faces(cubemap, layout).items():
+        face[...] = convert_channels(face_arrays[name], channels)
+    return cubemap
+
+
+def build_cross(face_arrays, alpha=True):
+    """Assemble six (S, S, C) face arrays, keyed by face name, into the 4x3 cross (see build_layout)."""
+    return build_layout(face_arrays, "horizontal_cross", alpha)
+
+
+def panorama_to_cubemap(panorama_image, output_base="cubemap", face_size=None, filter="bilinear",
+                        hemisphere_only=False, cross_output=None, workers=6, max_memory_mb=DEFAULT_MAX_MEMORY_MB,
+                        encoder=None, mips=None, mip_filter="box", mode=None, cross_layout="horizontal_cross"):
+    """
+    Convert an equirectangular panorama to six cube faces.
+
+    Uses the same axis conventions as cubemap_to_panorama, so a round trip
+    lands on the original texels.
+
+    Args:
+        panorama_image: A PIL Image of the panorama, a path to the panorama file or an (H, W, C)
+                        array; 16-bit PNG and .hdr panoramas keep their precision
+        output_base (str): Faces are saved as <output_base>_right.png, <output_base>_left.png, etc.
+                           (default: "cubemap"); None to skip writing the faces. The extension
+                           follows the encoder
+        face_size (int): Edge length of the faces (default: panorama width / 4)
+        filter (str): "nearest", "bilinear" (default) or "bicubic"
+        hemisphere_only (bool): The panorama holds only the top hemisphere (as written by
+                                cubemap_to_panorama with hemisphere_only=True)
+        cross_output (str): Optional path to also save the faces as a cubemap in cross_layout
+        workers (int): Number of faces rendered concurrently (default: 6)
+        max_memory_mb (float): Working-memory budget, split between concurrent faces
+        encoder: Encoder for the faces and cross, as accepted by resolve_encoder (default: PNG,
+                 or the format of cross_output's extension for the cross)
+        mips (str): Also write each face's mip pyramid: "files" saves level n of a face as
+                    <output_base>_<face>_mip<n><ext>; "container" writes all six faces with
+                    their chains as one DDS cubemap, <output_base>_cube.dds, instead of
+                    separate face files (needs a DDS encoder). cross_output gets the
+                    same chains assembled per level, saved as save_mips would
+        mip_filter (str): "box" (default) or "kaiser" (see generate_mips); faces are
+                          filtered independently, clamping at their edges
+        mode (str): Channels of the faces: "L", "LA", "RGB" or "RGBA" (default: the
+                    panorama's, without alpha if it is fully opaque)
+        cross_layout (str): Layout of cross_output (default: the 4x3 horizontal cross;
+                            see SOURCE_LAYOUTS and LAYOUT_ALIASES)
+
+    Returns:
+        dict: Face name -> PIL.Image (uint16/float32 arrays for a high-precision panorama)
+    """
+    if filter not in FILTERS:
+        raise ValueError(f"Unknown filter '{filter}' (expected one of {', '.join(FILTERS)})")
+    if mips not in (None, "files", "container"):
+        raise ValueError(f"Unknown mips mode '{mips}' (expected 'files' or 'container')")
+    if mips == "container" and resolve_encoder(encoder, ".dds")["format"] != "dds":
+        raise ValueError("Mip chains can only be embedded in DDS output")
+
+    if mode is not None and mode not in CHANNEL_MODES.values():
+        raise ValueError(f"Unknown mode '{mode}' (expected one of {', '.join(CHANNEL_MODES.values())})")
+    cross_layout = resolve_layout(cross_layout)
+
+    # Load panorama if it's a path, keeping 16-bit and float data at full precision
+    panorama_array = read_image(panorama_image)
+    if mode is None:
+        panorama_array = drop_opaque_alpha(panorama_array)
+    else:
+        panorama_array = convert_channels(panorama_array, len(mode))
+    pano_height, pano_width = panorama_array.shape[:2]
+
+    if face_size is None:
+        face_size = pano_width // 4
+
+    print(f"Converting panorama ({pano_width}x{pano_height}) to cubemap faces ({face_size}x{face_size})...")
+
+    # NumPy releases the GIL in the heavy loops, so faces render concurrently on threads
+    workers = max(1, min(workers, len(FACE_NAMES)))
+    face_budget = max_memory_mb / workers
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(render_face, panorama_array, index, face_size, hemisphere_only, filter,
+                                     face_budget)
+                   for index, name in enumerate(FACE_NAMES)}
+        face_arrays = {name: future.result() for name, future in futures.items()}
+
+        face_mips = {}
+        if mips is not None:
+            futures = {name: pool.submit(generate_mips, face_arrays[name], mip_filter) for name in FACE_NAMES}
+            face_mips = {name: future.result() for name, future in futures.items()}
+            print(f"Generated {len(face_mips[FACE_NAMES[0]]) - 1} mip levels per face ({mip_filter} filter)")
+
+    faces = {name: _output_image(face_arrays[name]) for name in FACE_NAMES}
+
+    if output_base is not None and mips == "container":
+        settings = resolve_encoder(encoder, ".dds")
+        cube_path = f"{output_base}_cube.dds"
+        write_dds(cube_path, [face_mips[name] for name in FACE_NAMES], settings["compression"],
+                  settings["quality"], cubemap=True)
+        print(f"Cubemap saved to: {cube_path} [{describe_encoder(settings)}, with mips]")
+    elif output_base is not None and mips == "files":
+        for name in FACE_NAMES:
+            face_path = f"{output_base}_{name}{encoder_extension(encoder)}"
+            settings = save_mips(face_mips[name], face_path, encoder)
+            print(f"Face saved to: {face_path} [{describe_encoder(settings)}, with mips]")
+    elif output_base is not None:
+        for name in FACE_NAMES:
+            face_path = f"{output_base}_{name}{encoder_extension(encoder)}"
+            settings = save_image(face_arrays[name], face_path, encoder)
+            print(f"Face saved to: {face_path} [{describe_encoder(settings)}]")
+
+    if cross_output is not None and mips is not None:
+        levels = [build_layout({name: face_mips[name][index] for name in FACE_NAMES}, cross_layout)
+                  for index in range(len(face_mips[FACE_NAMES[0]]))]
+        settings = save_mips(levels, cross_output, encoder, mips)
+        print(f"Cubemap saved to: {cross_output} [{describe_encoder(settings)}, with mips]")
+    elif cross_output is not None:
+        settings = save_image(build_layout(face_arrays, cross_layout), cross_output, encoder)
+        print(f"Cubemap saved to: {cross_output} [{describe_encoder(settings)}]")
+
+    return faces
+
+
+def reorient_panorama(panorama_image, output_path=None, orientation=None, filter="bilinear", hemisphere_only=False,
+                      max_memory_mb=DEFAULT_MAX_MEMORY_MB, encoder=None):
+    """
+    Rotate an existing equirect panorama, resampling it once.
+
+    Each output direction is rotated as in cubemap_to_panorama(orientation=...) and
+    looked up in the source panorama directly, a strip of rows at a time, so a
+    panorama that was rendered with the wrong north costs one gather to fix.
+
+    Args:
+        panorama_image: A PIL Image of the panorama, a path to the panorama file or an (H, W, C) array
+        output_path (str): Optional path to save the rotated panorama to
+        orientation: (yaw, pitch, roll) in degrees or a 3x3 matrix (see orientation_matrix)
+        filter (str): "nearest", "bilinear" (default) or "bicubic"
+        hemisphere_only (bool): Source and output hold only the top hemisphere
+        max_memory_mb (float): Working-memory budget used to size strips
+        encoder: Output encoder, as accepted by resolve_encoder
+
+    Returns:
+        PIL.Image: The rotated panorama (a uint16/float32 array for high-precision input)
+    """
+    if filter not in FILTERS:
+        raise ValueError(f"Unknown filter '{filter}' (expected one of {', '.join(FILTERS)})")
+    orientation = orientation_matrix(orientation)
+    panorama_array = read_image(panorama_image)
+    pano_height, pano_width, channels = panorama_array.shape
+
+    if orientation is None:
+        # Nothing to rotate; keep the pixels as they are rather than resampling them
+        rotated = np.array(panorama_array)
+    else:
+        print(f"Re-orienting panorama ({pano_width}x{pano_height})...")
+        source = np.ascontiguousarray(panorama_array).reshape(-1, channels)
+        rotated = np.empty_like(panorama_array)
+        strip_rows = strip_rows_for_budget(pano_width, channels, filter, 1, max_memory_mb, source.itemsize)
+        grid = PanoramaGrid(pano_width, pano_height, hemisphere_only, max_rows=strip_rows)
+        for row_start in range(0, pano_height, strip_rows):
+            row_stop = min(pano_height, row_start + strip_rows)
+            directions = rotate_directions(grid.directions(row_start, row_stop), orientation)
+            taps = _panorama_taps(*directions, pano_width, pano_height, hemisphere_only, filter)
+            gather_taps(source, *taps, rotated[row_start:row_stop].reshape(-1, channels))
+
+    if output_path is not None:
+        settings = save_image(rotated, output_path, encoder)
+        print(f"Panorama saved to: {output_path} [{describe_encoder(settings)}]")
+    return _output_image(rotated)
+
+
+def find_face_sets(root):
+    """
+    Find every complete set of six cube faces under a directory tree.
+
+    A directory may hold several sets side by side (sky2_right.png, sky6_right.png, ...);
+    each prefix that has all six _right/_left/_up/_down/_front/_back files (all .png or
+    all .hdr) is one set.
+
+    Returns:
+        list: Sorted (directory, image_name) tuples
+    """
+    face_sets = []
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        present = set(filenames)
+        prefixes = set()
+        for extension in FACE_EXTENSIONS:
+            suffixes = [f"_{name}{extension}" for name in FACE_NAMES]
+            prefixes.update(filename[:-len(suffixes[0])] for filename in filenames
+                            if filename.endswith(suffixes[0])
+                            and all(filename[:-len(suffixes[0])] + suffix in present for suffix in suffixes))
+        face_sets.extend((directory, prefix) for prefix in sorted(prefixes))
+    return face_sets
+
+
+def _batch_outputs(directory, image_name, encoder=None, hemisphere_only=False, projection="equirect"):
+    """
+    Face files and output paths of one batch job.
+
+    Returns:
+        tuple: (face_files, encoder, cubemap_output, pano_output); the encoder defaults
+               to HDR for .hdr faces (see default_encoder)
+    """
+    base_path = os.path.join(directory, "")
+    _, face_files = find_face_files(base_path, image_name)
+    encoder = default_encoder(face_files[FACE_NAMES[0]], encoder)
+    extension = encoder_extension(encoder)
+    cubemap_output = f"{base_path}{image_name}_cubemap{extension}"
+    pano_suffix = "_pano" if projection == "equirect" else f"_{projection}"
+    if hemisphere_only:
+        pano_suffix += "_hemisphere"
+    pano_output = f"{base_path}{image_name}{pano_suffix}{extension}"
+    return face_files, encoder, cubemap_output, pano_output
+
+
+def _batch_job(directory, image_name, pano_width, options):
+    """Process-pool worker: project one face set and write its cross, returning its timings."""
+    timing = {"job": os.path.join(directory, image_name), "stages": {}, "error": None}
+    start = time.perf_counter()
+    try:
+        face_files, encoder, cubemap_output, pano_output = _batch_outputs(
+            directory, image_name, options.get("encoder"), options.get("hemisphere_only"),
+            options.get("projection", "equirect"))
+        cubemap_to_panorama(face_files, pano_output, pano_width, cross_output=cubemap_output,
+                            timings=timing["stages"], **dict(options, encoder=encoder))
+    except Exception as e:
+        timing["error"] = f"{type(e).__name__}: {e}"
+    timing["total"] = time.perf_counter() - start
+    return timing
+
+
+def run_batch(root, pano_width=4096, jobs=None, max_pending=None, **options):
+    """
+    Project every face set found under root on a process pool.
+
+    Outputs are written next to each set as <image_name>_cubemap.png and
+    <image_name>_pano.png (or _pano_hemisphere.png; _<projection>.png for the other
+    projections), with the extension of the
+    encoder option if one is given (.hdr for .hdr face sets). At most max_pending jobs
+    are queued at a time so huge trees don't hold every job in flight.
+
+    Args:
+        root (str): Directory tree to scan with find_face_sets
+        pano_width (int): Width of the output panoramas (default: 4096)
+        jobs (int): Number of worker processes (default: os.cpu_count())
+        max_pending (int): Bound on submitted-but-unfinished jobs (default: 2 * jobs)
+        **options: Extra keyword arguments for cubemap_to_panorama; use_plan defaults
+                   to True when there is more than one set, so each worker process
+                   reuses its plan across the jobs it runs
+
+    Returns:
+        list: One timing dict per job (job, stages, total, error)
+    """
+    face_sets = find_face_sets(root)
+    if not face_sets:
+        raise FileNotFoundError(f"No complete face sets (_right.png, _left.png, etc., or .hdr) found under {root}")
+
+    jobs = jobs or os.cpu_count() or 1
+    max_pending = max_pending or 2 * jobs
+    options.setdefault("use_plan", len(face_sets) > 1)
+    print(f"Found {len(face_sets)} face sets under {root}, running {jobs} jobs at a time")
+
+    timings = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = set()
+        for directory, image_name in face_sets:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                timings.extend(future.result() for future in done)
+            pending.add(pool.submit(_batch_job, directory, image_name, pano_width, options))
+        timings.extend(future.result() for future in pending)
+    wall_time = time.perf_counter() - start
+
+    _print_batch_summary(timings, wall_time)
+    return timings
+
+
+def _print_batch_summary(timings, wall_time):
+    """Print the per-job stage timings of a batch run, sorted by job."""
+    timings.sort(key=lambda t: t["job"])
+    width = max(len(t["job"]) for t in timings)
+    print("\n" + "=" * 60)
+    print("BATCH SUMMARY")
+    print("=" * 60)
+    stages = []
+    for t in timings:
+        stages.extend(stage for stage, value in t["stages"].items()
+                      if stage not in stages and isinstance(value, float))
+    print(f"{'job':<{width}}" + "".join(f"  {stage:>10}" for stage in stages) + f"  {'total':>10}")
+    for t in timings:
+        if t["error"]:
+            print(f"{t['job']:<{width}}  FAILED after {t['total']:.2f}s: {t['error']}")
         else:
-            pano_output = base_path + "pano.png"
+            print(f"{t['job']:<{width}}" + "".join(f"  {t['stages'].get(stage, 0):9.2f}s" for stage in stages)
+                  + f"  {t['total']:9.2f}s")
+    for encoder in sorted({t["stages"]["encoder"] for t in timings if "encoder" in t["stages"]}):
+        print(f"Encoder: {encoder}")
+    failed = sum(1 for t in timings if t["error"])
+    busy = sum(t["total"] for t in timings)
+    print(f"{len(timings) - failed} ok, {failed} failed in {wall_time:.2f}s wall time "
+          f"({busy:.2f}s of job time)")
+
+
+def project_face_stack(face_stack, pano_width, pano_height=None, hemisphere_only=False, filter="nearest", ssaa=1,
+                       ssaa_jitter=False, plan_cache_dir=None, max_memory_mb=DEFAULT_MAX_MEMORY_MB,
+                       projection="equirect", orientation=None, window=None, use_plan=False):
+    """
+    Render an equirect panorama array from a (6, S, S, C) face stack, without saving it.
+
+    The quiet in-memory core of cubemap_to_panorama, for callers that schedule
+    decoding and encoding themselves (see run_pipeline). Plans are used under
+    the same rules as a single-process cubemap_to_panorama.
+
+    Returns:
+        np.ndarray: The (pano_height, pano_width, C) panorama
+    """
+    if pano_height is None:
+        pano_height = default_projection_height(projection, pano_width, hemisphere_only)
+    pano_width, pano_height = window_size(pano_width, pano_height, window)
+    face_size = face_stack.shape[1]
+    plan = None
+    plan_fits = estimate_plan_nbytes(pano_width, pano_height, filter) <= max_memory_mb * (1 << 20)
+    if ssaa == 1 and (plan_cache_dir is not None or (use_plan and plan_fits)):
+        plan = get_projection_plan(face_size, pano_width, pano_height, hemisphere_only, filter,
+                                   cache_dir=plan_cache_dir, max_memory_mb=max_memory_mb, layout="column",
+                                   projection=projection, orientation=orientation, window=window)
+    panorama = np.empty((pano_height, pano_width, face_stack.shape[-1]), dtype=face_stack.dtype)
+    for row_start, strip in render_panorama_strips(face_stack, face_size, pano_width, pano_height, hemisphere_only,
+                                                   filter, ssaa, ssaa_jitter, plan, max_memory_mb=max_memory_mb,
+                                                   layout="column", projection=projection, orientation=orientation,
+                                                   window=window):
+        panorama[row_start:row_start + len(strip)] = strip
+    return panorama
+
+
+def run_pipeline(root, pano_width=4096, queue_size=2, workers=None, hemisphere_only=False, filter="nearest",
+                 ssaa=1, ssaa_jitter=False, plan_cache_dir=None, max_memory_mb=DEFAULT_MAX_MEMORY_MB,
+                 encoder=None, mips=None, mip_filter="box", mode=None, cross=True, cross_layout="horizontal_cross",
+                 projection="equirect", orientation=None, lat_range=None, lon_range=None):
+    """
+    Process every face set under root as an overlapped decode -> project -> encode pipeline.
+
+    Where run_batch runs whole jobs side by side, this splits each job into
+    PIPELINE_STAGES, each served by its own threads and connected by bounded
+    queues: job N+1 decodes (disk, inflate) while job N projects (NumPy) and
+    job N-1 encodes (zlib), so all three resources stay busy in one process.
+    The queues hold at most queue_size jobs between stages, which bounds the
+    face stacks and panoramas in memory. Outputs are named as in run_batch.
+
+    Args:
+        root (str): Directory tree to scan with find_face_sets
+        queue_size (int): Jobs buffered between consecutive stages (default: 2)
+        workers (dict): Threads per stage (default: PIPELINE_WORKERS); more than one
+                        projection thread only helps if NumPy leaves cores idle
+        cross (bool): Also write each set's cubemap (default: True)
+        cross_layout (str): Layout of the written cubemaps (default: the 4x3 horizontal cross)
+        Other arguments: As for cubemap_to_panorama
+
+    Returns:
+        tuple: (timings, utilisation): one timing dict per job (job, stages, total, error)
+               as from run_batch, and stage -> fraction of the run its threads were busy
+    """
+    face_sets = find_face_sets(root)
+    if not face_sets:
+        raise FileNotFoundError(f"No complete face sets (_right.png, _left.png, etc., or .hdr) found under {root}")
+    workers = dict(PIPELINE_WORKERS, **(workers or {}))
+    cross_layout = resolve_layout(cross_layout)
+    orientation = orientation_matrix(orientation)
+    window = panorama_window(lat_range, lon_range)
+
+    def decode(job):
+        job["faces"], job["encoder"], job["cross_output"], job["pano_output"] = _batch_outputs(
+            *job["set"], encoder, hemisphere_only, projection)
+        needed = None
+        if not cross and projection == "equirect" and orientation is None:
+            # Faces outside the window are never sampled, so they are never decoded
+            face_size = _face_size(job["faces"][FACE_NAMES[0]])
+            full_height = default_projection_height(projection, pano_width, hemisphere_only)
+            needed = window_faces(window if window is not None else _hemisphere_window(hemisphere_only), face_size,
+                                  *window_size(pano_width, full_height, window), filter)
+        job["stack"] = load_face_stack(job.pop("faces"), mode=mode, needed=needed)
+
+    def project(job):
+        job["panorama"] = project_face_stack(job["stack"], pano_width, None, hemisphere_only, filter, ssaa,
+                                             ssaa_jitter, plan_cache_dir, max_memory_mb, projection, orientation,
+                                             window, use_plan=len(face_sets) > 1)
+
+    def encode(job):
+        settings = resolve_encoder(job["encoder"], job["pano_output"])
+        face_stack = job.pop("stack")
+        if cross:
+            save_cross(face_stack, job["cross_output"], encoder=resolve_encoder(job["encoder"], job["cross_output"]),
+                       layout=cross_layout, mode=mode, mips=mips, mip_filter=mip_filter)
+        panorama = job.pop("panorama")
+        if mips is not None:
+            wrap_x = projection in ("equirect", "cylindrical") and (window is None or window[3] - window[2] == 360)
+            save_mips(generate_mips(panorama, mip_filter, wrap_x=wrap_x), job["pano_output"], settings, mips)
+        else:
+            save_image(panorama, job["pano_output"], settings)
+        print(f"Panorama saved to: {job['pano_output']} [{describe_encoder(settings)}]")
+        job["stages"]["encoder"] = describe_encoder(settings)
+
+    work = {'decode': decode, 'project': project, 'encode': encode}
+    busy = {stage: 0.0 for stage in PIPELINE_STAGES}
+    busy_lock = threading.Lock()
+    finished = []
+
+    def serve(stage, inbox, outbox):
+        """Stage thread: take jobs until a None sentinel, passing failed jobs straight through."""
+        while True:
+            job = inbox.get()
+            if job is None:
+                return
+            if job["error"] is None:
+                stage_start = time.perf_counter()
+                job.setdefault("start", stage_start)
+                try:
+                    work[stage](job)
+                except Exception as e:
+                    job["error"] = f"{type(e).__name__}: {e}"
+                    job.pop("stack", None)
+                    job.pop("panorama", None)
+                elapsed = time.perf_counter() - stage_start
+                job["stages"][stage] = elapsed
+                with busy_lock:
+                    busy[stage] += elapsed
+            if outbox is not None:
+                # Blocks while the next stage is queue_size jobs behind
+                outbox.put(job)
+            else:
+                job["total"] = time.perf_counter() - job.pop("start", time.perf_counter())
+                finished.append(job)
+
+    print(f"Found {len(face_sets)} face sets under {root}, pipelining "
+          + ", ".join(f"{workers[stage]} {stage}" for stage in PIPELINE_STAGES) + " threads")
+    start = time.perf_counter()
+
+    # The job list is known up front; only the queues between stages are bounded
+    inboxes = [queue.Queue()] + [queue.Queue(maxsize=queue_size) for _ in PIPELINE_STAGES[1:]]
+    for directory, image_name in face_sets:
+        inboxes[0].put({"job": os.path.join(directory, image_name), "set": (directory, image_name),
+                        "stages": {}, "error": None})
+    threads = []
+    for index, stage in enumerate(PIPELINE_STAGES):
+        outbox = inboxes[index + 1] if index + 1 < len(PIPELINE_STAGES) else None
+        threads.append([threading.Thread(target=serve, args=(stage, inboxes[index], outbox), daemon=True)
+                        for _ in range(workers[stage])])
+        for thread in threads[-1]:
+            thread.start()
+
+    # Shut the stages down in order: each one's sentinels follow its last job
+    for index, stage in enumerate(PIPELINE_STAGES):
+        for _ in threads[index]:
+            inboxes[index].put(None)
+        for thread in threads[index]:
+            thread.join()
+    wall_time = time.perf_counter() - start
+
+    for job in finished:
+        for key in ("set", "encoder", "cross_output", "pano_output"):
+            job.pop(key, None)
+    _print_batch_summary(finished, wall_time)
+    utilisation = {stage: busy[stage] / (wall_time * workers[stage]) if wall_time > 0 else 0.0
+                   for stage in PIPELINE_STAGES}
+    print("Stage utilisation: " + ", ".join(f"{stage} {utilisation[stage]:.0%}" for stage in PIPELINE_STAGES)
+          + f" (bottleneck: {max(utilisation, key=utilisation.get)})")
+    return finished, utilisation
+
+
+# Example usage
+if __name__ == "__main__":
+    import sys
+    
+    if len(sys.argv) < 2:
+        print("Usage: python cubemap_stitcher.py <base_path> [pano_width] [--hemisphere]")
+        print("       python cubemap_stitcher.py <panorama.png> --to-cubemap [face_size] [--cross]")
+        print("       python cubemap_stitcher.py --batch <root> [pano_width] [--jobs=<n>]")
+        print("       python cubemap_stitcher.py <base_path> --view=<yaw>,<pitch>[,<fov>] [--view-size=512x288]")
+        print("\nExample:")
+        print("  python cubemap_stitcher.py /path/to/images/ 4096")
+        print("  python cubemap_stitcher.py /path/to/images/ 4096 --hemisphere")
+        print("  python cubemap_stitcher.py /path/to/sky10.png --to-cubemap 1024")
+        print("\nThis will:")
+        print("  1. Auto-detect image name from files ending with _right.png, _left.png, etc.")
+        print("     (or _right.hdr, ...; HDR faces default to .hdr output, 16-bit PNGs stay 16-bit)")
+        print("  2. Convert the 6 detected faces to panorama: <base_path>pano.png")
+        print("  3. Save cubemap to: <base_path>cubemap.png (in the background)")
+        print("\nOptions:")
+        print("  --hemisphere    Only render the top hemisphere (sky only)")
+        print("  --orient=<yaw>,<pitch>[,<roll>]  Rotate the sky (degrees) so its north matches")
+        print("                  the game world; baked into the projection, no extra resampling")
+        print("  --reorient      With a panorama as <base_path>, rotate it by --orient instead,")
+        print("                  writing <name>_oriented.png")
+        print("  --lat=<min>,<max>  Only render this latitude band, e.g. --lat=-10,90 for a sky band")
+        print("  --lon=<min>,<max>  Only render this longitude range (0 = left edge of the panorama);")
+        print("                  faces outside the window are not decoded")
+        print("  --projection=<name>  Output projection (default: equirect): eac (equi-angular")
+        print("                  cubemap, 3x2), octahedral, fisheye (a dome master with")
+        print("                  --hemisphere) or cylindrical; written to <base_path><name>.png")
+        print("  --to-cubemap    Split a panorama into <name>_right.png, <name>_left.png, etc.")
+        print("  --cross         With --to-cubemap, write a 4x3 cross <name>_cubemap.png instead")
+        print("  --no-cross      Don't write the stitched <base_path>cubemap.png")
+        print("  --layout=<name> Layout of the written cubemap: 4x3 (horizontal cross, default),")
+        print("                  3x4 (vertical cross), 6x1, 1x6 or 3x2 (no transparent padding).")
+        print("                  A cubemap image given as <base_path> is projected directly, its")
+        print("                  layout detected from the aspect ratio")
+        print("  --rgba          Always write RGBA; by default outputs keep the inputs' channels")
+        print("                  (L, LA, RGB or RGBA) and drop alpha that is fully opaque")
+        print("  --stack         Also write the decoded faces as a raw <base_path>faces.npy, which")
+        print("                  can be passed back in place of <base_path> to skip decoding")
+        print("  --view=<yaw>,<pitch>[,<fov>]  Render a perspective preview instead of the panorama,")
+        print("                  saved as <base_path>view-<yaw>_<pitch>.png (fov default: 90).")
+        print("                  Repeat for several views; they share one decode")
+        print("  --views         Render the preset views (" + ", ".join(VIEW_PRESETS) + ")")
+        print("                  as <base_path>view-<name>.png")
+        print("  --view-size=<w>x<h>  Size of the views (default: 512x288)")
+        print("  --batch <root>  Project every face set under <root>, writing")
+        print("                  <name>_cubemap.png and <name>_pano.png next to each set")
+        print("  --jobs=<n>      Number of batch jobs run in parallel (default: CPU count)")
+        print("  --pipeline      With --batch, overlap the decode, projection and encode of")
+        print("                  consecutive sets in one process and report stage utilisation")
+        print("  --queue=<n>     Sets buffered between pipeline stages (default: 2)")
+        print("  --incremental   Skip stitching/projection when inputs and settings are unchanged")
+        print("  --plan-cache=<dir>  Save/reuse projection lookup tables in <dir>")
+        print("  --filter=<name>     Sampling filter: nearest, bilinear, bicubic")
+        print("                      (default: nearest, or bilinear with --to-cubemap)")
+        print("  --ssaa=<n>          Average n x n supersamples per pixel (anti-aliasing)")
+        print("  --jitter            Jitter the supersample pattern")
+        print("  --max-memory=<mb>   Working-memory budget for the projection (default: 512)")
+        print("  --workers=<n>       Render the panorama on n processes (default: 1)")
+        print("  --encoder=<name>    Output encoder preset or format (default: png):")
+        print("                      fast-iterate  fast PNG (zlib level 1, sub filter)")
+        print("                      ship          lossy WebP, quality 90")
+        print("                      archive       lossless WebP, smallest lossless files")
+        print("                      png, webp, jpeg, avif (AVIF needs Pillow 11.2+)")
+        print("                      dds           GPU-ready BC1 (opaque) / BC3 (alpha) texture")
+        print("                      hdr           Radiance RGBE, float radiance (HDR sources)")
+        print("                      npy           raw memory-mappable array, for intermediates")
+        print("                      Options follow a colon, e.g. --encoder=dds:quality=high")
+        print("                      or --encoder=png:compress_level=9,filter=paeth")
+        print("  --mips              Also write mip levels of the panorama and cubemap (or the")
+        print("                      faces with --to-cubemap) as <name>_mip<n> files")
+        print("  --mips=container    Embed the mip chains in the outputs (DDS; a DDS cubemap")
+        print("                      <name>_cube.dds with --to-cubemap)")
+        print("  --mip-filter=<name> Mip filter: box (default) or kaiser")
+        sys.exit(1)
+    
+    try:
+        # Get base path (or batch root) and optional panorama width
+        args = sys.argv[1:]
+        batch = "--batch" in args
+        if batch:
+            args.remove("--batch")
+        base_path = args[0]
+        pano_width = 4096
+        hemisphere_only = False
+        to_cubemap = False
+        write_cross = False
+        no_cross = False
+        write_stack = False
+        mode = None
+        views = {}
+        view_size = (512, 288)
+        projection = "equirect"
+        orientation = None
+        lat_range = None
+        lon_range = None
+        reorient = False
+        layout = "horizontal_cross"
+        face_size = None
+        plan_cache_dir = None
+        sample_filter = None
+        ssaa = 1
+        ssaa_jitter = False
+        max_memory_mb = DEFAULT_MAX_MEMORY_MB
+        workers = 1
+        jobs = None
+        pipeline = False
+        queue_size = 2
+        incremental = False
+        encoder = None
+        mips = None
+        mip_filter = "box"
+        
+        # Parse additional arguments
+        for arg in args[1:]:
+            if arg == "--hemisphere":
+                hemisphere_only = True
+            elif arg == "--to-cubemap":
+                to_cubemap = True
+            elif arg == "--cross":
+                write_cross = True
+            elif arg == "--no-cross":
+                no_cross = True
+            elif arg == "--stack":
+                write_stack = True
+            elif arg == "--rgba":
+                mode = "RGBA"
+            elif arg.startswith("--view="):
+                angles = [float(value) for value in arg.split("=", 1)[1].split(",")]
+                name = "_".join(f"{angle:g}" for angle in angles[:2])
+                views[name] = (angles[0], angles[1], angles[2] if len(angles) > 2 else 90.0)
+            elif arg == "--views":
+                views.update(VIEW_PRESETS)
+            elif arg.startswith("--view-size="):
+                view_size = tuple(int(value) for value in arg.split("=", 1)[1].lower().split("x"))
+            elif arg.startswith("--orient="):
+                orientation = [float(value) for value in arg.split("=", 1)[1].split(",")]
+                orientation += [0.0] * (3 - len(orientation))
+            elif arg.startswith("--lat="):
+                lat_range = tuple(float(value) for value in arg.split("=", 1)[1].split(","))
+            elif arg.startswith("--lon="):
+                lon_range = tuple(float(value) for value in arg.split("=", 1)[1].split(","))
+            elif arg == "--reorient":
+                reorient = True
+            elif arg.startswith("--projection="):
+                projection = arg.split("=", 1)[1]
+            elif arg.startswith("--layout="):
+                layout = resolve_layout(arg.split("=", 1)[1])
+            elif arg.startswith("--plan-cache="):
+                plan_cache_dir = arg.split("=", 1)[1]
+            elif arg.startswith("--filter="):
+                sample_filter = arg.split("=", 1)[1]
+            elif arg.startswith("--ssaa="):
+                ssaa = int(arg.split("=", 1)[1])
+            elif arg == "--jitter":
+                ssaa_jitter = True
+            elif arg.startswith("--max-memory="):
+                max_memory_mb = float(arg.split("=", 1)[1])
+            elif arg.startswith("--workers="):
+                workers = int(arg.split("=", 1)[1])
+            elif arg == "--incremental":
+                incremental = True
+            elif arg.startswith("--jobs="):
+                jobs = int(arg.split("=", 1)[1])
+            elif arg == "--pipeline":
+                pipeline = True
+            elif arg.startswith("--queue="):
+                queue_size = int(arg.split("=", 1)[1])
+            elif arg == "--mips":
+                mips = "files"
+            elif arg.startswith("--mips="):
+                mips = arg.split("=", 1)[1]
+            elif arg.startswith("--mip-filter="):
+                mip_filter = arg.split("=", 1)[1]
+            elif arg.startswith("--encoder="):
+                encoder = parse_encoder_option(arg.split("=", 1)[1])
+            elif arg.isdigit():
+                pano_width = int(arg)
+                face_size = int(arg)
+        
+        if reorient:
+            # Panorama -> rotated panorama, written next to it
+            encoder = default_encoder(base_path, encoder)
+            reorient_panorama(base_path, os.path.splitext(base_path)[0] + "_oriented" + encoder_extension(encoder),
+                              orientation, sample_filter or "bilinear", hemisphere_only, max_memory_mb, encoder)
+            sys.exit(0)
+        
+        if to_cubemap:
+            # Panorama -> faces, written next to the panorama
+            encoder = default_encoder(base_path, encoder)
+            extension = encoder_extension(encoder)
+            output_base = os.path.splitext(base_path)[0]
+            if write_cross:
+                panorama_to_cubemap(base_path, None, face_size, sample_filter or "bilinear", hemisphere_only,
+                                    cross_output=output_base + "_cubemap" + extension, max_memory_mb=max_memory_mb,
+                                    encoder=encoder, mips=mips, mip_filter=mip_filter, mode=mode,
+                                    cross_layout=layout)
+            else:
+                panorama_to_cubemap(base_path, output_base, face_size, sample_filter or "bilinear", hemisphere_only,
+                                    max_memory_mb=max_memory_mb, encoder=encoder, mips=mips, mip_filter=mip_filter,
+                                    mode=mode)
+            sys.exit(0)
+        
+        if batch and pipeline:
+            timings, _ = run_pipeline(base_path, pano_width, queue_size, hemisphere_only=hemisphere_only,
+                                      filter=sample_filter or "nearest", ssaa=ssaa, ssaa_jitter=ssaa_jitter,
+                                      plan_cache_dir=plan_cache_dir, max_memory_mb=max_memory_mb, encoder=encoder,
+                                      mips=mips, mip_filter=mip_filter, mode=mode, cross=not no_cross,
+                                      cross_layout=layout, projection=projection, orientation=orientation,
+                                      lat_range=lat_range, lon_range=lon_range)
+            sys.exit(1 if any(t["error"] for t in timings) else 0)
+        
+        if batch:
+            timings = run_batch(base_path, pano_width, jobs, hemisphere_only=hemisphere_only,
+                                plan_cache_dir=plan_cache_dir, filter=sample_filter or "nearest", ssaa=ssaa,
+                                ssaa_jitter=ssaa_jitter, max_memory_mb=max_memory_mb, incremental=incremental,
+                                encoder=encoder, mips=mips, mip_filter=mip_filter, mode=mode, cross_layout=layout,
+                                projection=projection, orientation=orientation, lat_range=lat_range,
+                                lon_range=lon_range)
+            sys.exit(1 if any(t["error"] for t in timings) else 0)
         
         print("=" * 60)
-        print("STEP 1: Stitching cubemap from 6 faces...")
+        print("STEP 1: Finding the 6 cubemap faces...")
         print("=" * 60)
         
-        # Stitch the cubemap
-        cubemap = stitch_cubemap(base_path, cubemap_output)
+        if base_path.lower().endswith(".npy"):
+            # A face stack written by --stack: memory-mapped, nothing to find or decode
+            face_files = base_path
+            base_path = os.path.join(os.path.dirname(base_path), "")
+            write_stack = False
+            print(f"Using face stack: {face_files}")
+        elif os.path.isfile(base_path):
+            # An already stitched cubemap in any layout: projected as it is, nothing to stitch
+            face_files = base_path
+            base_path = os.path.splitext(base_path)[0] + "_"
+            no_cross = True
+            write_stack = False
+            print(f"Using cubemap: {face_files}")
+        else:
+            image_name, face_files = find_face_files(base_path)
+        
+        # Define output paths
+        source_file = face_files if isinstance(face_files, str) else face_files[FACE_NAMES[0]]
+        encoder = default_encoder(source_file, encoder)
+        extension = encoder_extension(encoder)
+        
+        if views:
+            # Previews only: ray-cast the requested views, no panorama or cross. The hyphen keeps
+            # view-front.png etc. from being taken for the faces of a set named "view"
+            render_views(face_files, views, *view_size, output_base=base_path + "view-",
+                         filter=sample_filter or "bilinear", encoder=encoder, mode=mode)
+            sys.exit(0)
+        cubemap_output = base_path + "cubemap" + extension
+        pano_output = base_path + ("pano" if projection == "equirect" else projection)
+        if hemisphere_only:
+            pano_output += "_hemisphere"
+        pano_output += extension
         
         print("\n" + "=" * 60)
-        print("STEP 2: Converting cubemap to panorama...")
+        print("STEP 2: Converting cubemap faces to panorama...")
         print("=" * 60)
         
-        # Convert to panorama
-        panorama = cubemap_to_panorama(cubemap, pano_output, pano_width, hemisphere_only=hemisphere_only)
+        # Project straight from the faces; the cross is only an extra output
+        timings = {}
+        panorama = cubemap_to_panorama(face_files, pano_output, pano_width, hemisphere_only=hemisphere_only,
+                                       plan_cache_dir=plan_cache_dir, filter=sample_filter or "nearest",
+                                       ssaa=ssaa, ssaa_jitter=ssaa_jitter, max_memory_mb=max_memory_mb,
+                                       workers=workers, incremental=incremental,
+                                       cross_output=None if no_cross else cubemap_output, encoder=encoder,
+                                       timings=timings, mips=mips, mip_filter=mip_filter,
+                                       stack_output=base_path + "faces.npy" if write_stack else None, mode=mode,
+                                       cross_layout=layout, projection=projection, orientation=orientation,
+                                       lat_range=lat_range, lon_range=lon_range)
         
         print("\n" + "=" * 60)
         print("COMPLETE!")
         print("=" * 60)
-        print(f"Cubemap saved to: {cubemap_output}")
+        if not no_cross:
+            print(f"Cubemap saved to: {cubemap_output}")
         print(f"Panorama saved to: {pano_output}")
+        print(f"Encoder: {timings['encoder']}")
+        print("Timings: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()
+                                      if isinstance(seconds, float)))
         
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,200 @@
+import os
+import subprocess
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import cubemap_stitcher
+from cubemap_stitcher import (FACE_NAMES, SOURCE_LAYOUTS, HDRStreamWriter, PNGStreamWriter, _panorama_reference,
+                              build_cross, build_layout, cubemap_to_panorama, read_hdr, read_png)
+
+
+FACE_SIZE = 16
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cubemap_stitcher.py")
+
+
+@pytest.fixture
+def faces():
+    # Random opaque RGB faces, so any wrong texel shows up as a mismatch
+    rng = np.random.default_rng(0)
+    return {name: rng.integers(0, 256, (FACE_SIZE, FACE_SIZE, 3), dtype=np.uint8) for name in FACE_NAMES}
+
+
+@pytest.mark.parametrize("hemisphere_only", [False, True])
+@pytest.mark.parametrize("pano_width", [64, 100])
+def test_vectorized_matches_reference(faces, tmp_path, hemisphere_only, pano_width):
+    """The vectorized nearest projection reproduces the per-pixel reference loop exactly."""
+    cross = build_cross(faces)
+    pano_height = pano_width // 4 if hemisphere_only else pano_width // 2
+    expected = _panorama_reference(cross, FACE_SIZE, pano_width, pano_height, hemisphere_only)
+
+    panorama = cubemap_to_panorama(faces, str(tmp_path / "pano.png"), pano_width, hemisphere_only=hemisphere_only,
+                                   filter="nearest")
+
+    assert np.array_equal(np.asarray(panorama), expected[..., :3])
+
+
+def test_reference_method_matches_vectorized(faces, tmp_path):
+    """method="reference" and the default engine write the same panorama."""
+    cross = build_cross(faces)
+    reference = cubemap_to_panorama(cross, str(tmp_path / "reference.png"), 64, method="reference")
+    vectorized = cubemap_to_panorama(cross, str(tmp_path / "vectorized.png"), 64)
+
+    assert np.array_equal(np.asarray(reference), np.asarray(vectorized))
+
+
+def test_cli_views_leave_faces_detectable(faces, tmp_path):
+    """Previews written by --views are not mistaken for faces by a later run on the same directory."""
+    for name, face in faces.items():
+        # A prefix sorting after "view", so detection would meet the previews first
+        Image.fromarray(face).save(tmp_path / f"world_{name}.png")
+    base_path = str(tmp_path) + os.sep
+
+    subprocess.run([sys.executable, SCRIPT, base_path, "--views", "--view-size=32x16"], check=True,
+                   capture_output=True)
+    subprocess.run([sys.executable, SCRIPT, base_path, "64"], check=True, capture_output=True)
+
+    assert Image.open(tmp_path / "pano.png").size == (64, 32)
+
+
+def test_cross_output_follows_its_own_extension(faces, tmp_path):
+    """Without an explicit encoder the cross is encoded for its own extension, not the panorama's."""
+    cubemap_to_panorama(faces, str(tmp_path / "pano.webp"), 64, cross_output=str(tmp_path / "cubemap.png"))
+
+    assert Image.open(tmp_path / "pano.webp").format == "WEBP"
+    assert Image.open(tmp_path / "cubemap.png").format == "PNG"
+
+
+@pytest.mark.parametrize("unfilter", ["pillow", "numpy"])
+@pytest.mark.parametrize("bit_depth", [8, 16])
+@pytest.mark.parametrize("mode", ["L", "LA", "RGB", "RGBA"])
+def test_png_round_trip(tmp_path, monkeypatch, mode, bit_depth, unfilter):
+    """read_png returns exactly what PNGStreamWriter wrote, whichever row filters it used."""
+    if unfilter == "numpy":
+        monkeypatch.setattr(cubemap_stitcher, "_png_unfilter_pillow", lambda *args: None)
+    dtype = np.uint8 if bit_depth == 8 else np.uint16
+    rng = np.random.default_rng(1)
+    # Noise over a gradient, so the adaptive filter picks a mix of row filters
+    pixels = (rng.integers(0, 64, (9, 13, len(mode))) + np.arange(13)[None, :, None] * 12).astype(dtype)
+    if bit_depth == 16:
+        pixels = pixels * 257 + rng.integers(0, 256, pixels.shape).astype(dtype)
+
+    for row_filter in ("adaptive",) + PNGStreamWriter.ROW_FILTERS:
+        path = str(tmp_path / f"{row_filter}.png")
+        with PNGStreamWriter(path, 13, 9, mode, filter=row_filter, bit_depth=bit_depth) as writer:
+            writer.write(pixels[:4])
+            writer.write(pixels[4:])
+
+        decoded = read_png(path)
+        assert decoded.dtype == dtype
+        assert np.array_equal(decoded, pixels)
+
+
+def test_hdr_round_trip(tmp_path):
+    """read_hdr reads HDRStreamWriter output back to within RGBE's 8-bit shared-exponent precision."""
+    rng = np.random.default_rng(2)
+    radiance = np.exp(rng.uniform(-6, 6, (6, 40, 3))).astype(np.float32)
+    radiance[2] = radiance[2, 0]  # A constant row, stored as run-length repeats
+    path = str(tmp_path / "sky.hdr")
+    with HDRStreamWriter(path, 40, 6) as writer:
+        writer.write(radiance[:3])
+        writer.write(radiance[3:])
+
+    decoded = read_hdr(path)
+    assert decoded.shape == radiance.shape
+    tolerance = radiance.max(axis=-1, keepdims=True) / 128
+    assert np.all(np.abs(decoded - radiance) <= tolerance)
+
+
+@pytest.mark.parametrize("filter", ["nearest", "bicubic"])
+@pytest.mark.parametrize("layout", list(SOURCE_LAYOUTS))
+def test_layouts_project_like_the_faces(faces, tmp_path, layout, filter):
+    """A cubemap file in any layout, detected from its aspect ratio, projects exactly like its faces."""
+    cubemap_path = str(tmp_path / f"{layout}.png")
+    Image.fromarray(build_layout(faces, layout)).save(cubemap_path)
+
+    expected = cubemap_to_panorama(faces, str(tmp_path / "faces_pano.png"), 64, filter=filter)
+    panorama = cubemap_to_panorama(cubemap_path, str(tmp_path / f"{layout}_pano.png"), 64, filter=filter)
+
+    assert np.array_equal(np.asarray(panorama), np.asarray(expected))
+
+
+@pytest.mark.parametrize("filter", ["nearest", "bilinear"])
+def test_workers_and_plans_match_serial(faces, tmp_path, monkeypatch, filter):
+    """Worker processes, in-process plans and saved plans all reproduce the serial on-the-fly render."""
+    monkeypatch.setattr(cubemap_stitcher, "_plan_cache", OrderedDict())
+    expected = np.asarray(cubemap_to_panorama(faces, str(tmp_path / "serial.png"), 64, filter=filter))
+
+    variants = {
+        "workers": dict(workers=2),
+        "plan": dict(use_plan=True),
+        "plan_workers": dict(use_plan=True, workers=2),
+        "saved_plan": dict(plan_cache_dir=str(tmp_path / "plans")),
+    }
+    for name, options in variants.items():
+        panorama = cubemap_to_panorama(faces, str(tmp_path / f"{name}.png"), 64, filter=filter, **options)
+        assert np.array_equal(np.asarray(panorama), expected), name
+    assert cubemap_stitcher._plan_cache
+
+
+@pytest.mark.parametrize("filter", ["nearest", "bilinear"])
+@pytest.mark.parametrize("lat_range, lon_range, rows, columns", [
+    ((-22.5, 90), None, slice(0, 20), slice(None)),
+    (None, (45, 180), slice(None), slice(8, 32)),
+    ((0, 45), (-90, 90), slice(8, 16), np.r_[48:64, 0:16]),
+])
+def test_window_is_a_crop_of_the_full_render(faces, tmp_path, filter, lat_range, lon_range, rows, columns):
+    """A lat/lon window on pixel boundaries renders exactly the matching crop of the full panorama."""
+    full = np.asarray(cubemap_to_panorama(faces, str(tmp_path / "full.png"), 64, filter=filter))
+    window = cubemap_to_panorama(faces, str(tmp_path / "window.png"), 64, filter=filter, lat_range=lat_range,
+                                 lon_range=lon_range)
+
+    assert np.array_equal(np.asarray(window), full[rows][:, columns])
+
+
+@pytest.mark.parametrize("filter", ["nearest", "bilinear"])
+@pytest.mark.parametrize("yaw", [90, 180, -90, 450])
+def test_quarter_turn_yaw_is_a_column_shift(faces, tmp_path, filter, yaw):
+    """A yaw by whole columns shifts the panorama: longitude yaw lands on column 0."""
+    full = np.asarray(cubemap_to_panorama(faces, str(tmp_path / "full.png"), 64, filter=filter))
+    turned = cubemap_to_panorama(faces, str(tmp_path / "turned.png"), 64, filter=filter, orientation=(yaw, 0, 0))
+
+    assert np.array_equal(np.asarray(turned), np.roll(full, -yaw * 64 // 360, axis=1))
+
+
+def test_npy_intermediates_round_trip(faces, tmp_path):
+    """A face stack written by stack_output projects like the faces, and .npy output holds the panorama."""
+    stack_path = str(tmp_path / "faces.npy")
+    expected = np.asarray(cubemap_to_panorama(faces, str(tmp_path / "pano.png"), 64, filter="bilinear",
+                                              stack_output=stack_path))
+
+    stack = np.load(stack_path, mmap_mode="r")
+    assert np.array_equal(stack, np.stack([faces[name] for name in FACE_NAMES]))
+    panorama = cubemap_to_panorama(stack_path, str(tmp_path / "pano.npy"), 64, filter="bilinear")
+    assert np.array_equal(np.asarray(panorama), expected)
+    assert np.array_equal(np.load(str(tmp_path / "pano.npy")), expected)
+
+
+def test_incremental_skips_until_mode_changes(faces, tmp_path, capsys):
+    """An unchanged incremental run is skipped; a different mode rebuilds the panorama and the cross."""
+    face_files = {}
+    for name, face in faces.items():
+        face_files[name] = str(tmp_path / f"sky_{name}.png")
+        Image.fromarray(face).save(face_files[name])
+    pano_path, cross_path = str(tmp_path / "pano.png"), str(tmp_path / "cubemap.png")
+
+    def convert(mode=None):
+        cubemap_to_panorama(face_files, pano_path, 64, incremental=True, cross_output=cross_path, mode=mode)
+        return capsys.readouterr().out
+
+    convert()
+    output = convert()
+    assert "Panorama up to date" in output and "skipping cross" in output
+
+    output = convert(mode="RGBA")
+    assert "up to date" not in output
+    assert Image.open(pano_path).mode == "RGBA"
+    assert "Panorama up to date" in convert(mode="RGBA")